@@ -0,0 +1,45 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Run the benchmark suites: ``python -m benchmarks [--quick] [--json FILE]
+[suite ...]``.
+
+``scripts/zerovm-cli-bench`` runs the same suites and stores the results, to
+compare revisions; see :mod:`benchmarks.store`.
+"""
+
+from benchmarks import bundle
+from benchmarks import e2e
+from benchmarks import harness
+from benchmarks import images
+from benchmarks import runner
+from benchmarks import serializer
+from benchmarks import startup
+from benchmarks import zerocloud
+from benchmarks import zvapp
+
+SUITES = [
+    ('serializer', serializer),
+    ('images', images),
+    ('runner', runner),
+    ('e2e', e2e),
+    ('bundle', bundle),
+    ('startup', startup),
+    ('zerocloud', zerocloud),
+    ('zvapp', zvapp),
+]
+
+if __name__ == '__main__':
+    harness.main(SUITES)
@@ -0,0 +1,224 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Benchmarks for ``zpm bundle``, over synthetic projects.
+
+Run with ``python -m benchmarks bundle``. :func:`make_project` writes a
+project of a given number of files, with sizes drawn from a
+:data:`DISTRIBUTIONS` entry, and dependencies served by a local wheelhouse
+from :func:`make_wheelhouse`. The same seed gives the same project, so the
+results of different commits can be compared.
+
+Each operation is a ``zpm bundle`` process; the CPU time and peak memory are
+its own. The project's ``tox.ini`` installs the dependencies from the
+wheelhouse, but a ``tox`` stand-in, which unpacks the wheels where tox
+would install them, is first on the ``PATH``: the benchmark measures
+bundling, not tox and pip, and needs neither, nor a Python 2.7.
+"""
+
+import os
+import random
+import stat
+import subprocess
+import sys
+import zipfile
+
+from benchmarks import harness
+
+FILE_COUNTS = (1000, 10000, 100000)
+QUICK_FILE_COUNTS = (200,)
+#: Files in each directory of a project.
+FILES_PER_DIR = 100
+
+#: Functions drawing the size of a file from a :class:`random.Random`.
+DISTRIBUTIONS = {
+    # Source trees: mostly a few KiB, some up to a few hundred.
+    'source': lambda rng: min(int(rng.lognormvariate(8, 1.5)), 1 << 20),
+    'small': lambda rng: 1024,
+}
+
+#: Dependencies of the synthetic projects, as (name, modules) pairs.
+DEPENDENCIES = [('synthdep%d' % i, 50) for i in range(5)]
+
+ZPM = os.path.join(harness.ROOT, 'scripts', 'zpm')
+
+ZAPP_YAML = """\
+project_type: python
+execution:
+  groups:
+    - name: "synthetic"
+      path: file://python2.7:python
+      args: "main.py"
+      devices:
+      - name: python2.7
+      - name: stdout
+meta:
+  Version: ""
+  name: "synthetic"
+  Author-email: ""
+  Summary: ""
+help:
+  description: ""
+  args: []
+bundling:
+  - "main.py"
+  - "src/*/*.py"
+  - "data/*/*"
+dependencies:
+%(dependencies)s
+"""
+
+TOX_INI = """\
+[tox]
+toxworkdir={toxinidir}/.zapp
+envlist = venv
+skipsdist = true
+
+[testenv:venv]
+deps = -r{toxinidir}/deps.txt
+install_command = pip install --no-index --find-links=%(wheelhouse)s \
+{opts} {packages}
+"""
+
+#: Installs the wheels from the wheelhouse of a ``tox.ini`` where
+#: ``tox -c tox.ini`` would, in the virtualenv that
+#: :func:`zpmlib.zappbundler.python_bundler` bundles from.
+TOX = """\
+#!%(python)s
+import os
+import shutil
+import sys
+import zipfile
+
+ini = sys.argv[sys.argv.index('-c') + 1]
+workdir = os.path.dirname(ini)
+site_pkgs = os.path.join(workdir, '.zapp/venv/lib/python2.7/site-packages')
+if '-r' in sys.argv and os.path.exists(site_pkgs):
+    shutil.rmtree(site_pkgs)
+if not os.path.exists(site_pkgs):
+    with open(ini) as fp:
+        wheelhouse = fp.read().split('--find-links=')[1].split()[0]
+    wheels = os.listdir(wheelhouse)
+    with open(os.path.join(workdir, 'deps.txt')) as fp:
+        for dep in fp.read().split():
+            wheel = [w for w in wheels if w.startswith(dep + '-')][0]
+            zipfile.ZipFile(os.path.join(wheelhouse, wheel)).extractall(
+                site_pkgs)
+"""
+
+
+def make_wheelhouse(wheelhouse, dependencies=DEPENDENCIES):
+    """
+    Write a pure Python wheel for each of the ``dependencies``, a `list` of
+    (name, number of modules) pairs.
+    """
+    os.makedirs(wheelhouse)
+    for name, modules in dependencies:
+        dist_info = '%s-1.0.dist-info' % name
+        wheel = os.path.join(wheelhouse, '%s-1.0-py2.py3-none-any.whl' % name)
+        with zipfile.ZipFile(wheel, 'w', zipfile.ZIP_DEFLATED) as zfp:
+            zfp.writestr('%s/__init__.py' % name, '')
+            for i in range(modules):
+                zfp.writestr('%s/module%d.py' % (name, i),
+                             'VALUE = %d\n' % i * 50)
+            zfp.writestr('%s/METADATA' % dist_info,
+                         'Metadata-Version: 2.1\nName: %s\nVersion: 1.0\n'
+                         % name)
+            zfp.writestr('%s/WHEEL' % dist_info,
+                         'Wheel-Version: 1.0\nRoot-Is-Purelib: true\n'
+                         'Tag: py2-none-any\nTag: py3-none-any\n')
+            zfp.writestr('%s/RECORD' % dist_info, '')
+
+
+def make_project(root, file_count, wheelhouse, distribution='source',
+                 dependencies=DEPENDENCIES, seed=0):
+    """
+    Write a project of ``file_count`` files to bundle, a quarter of them
+    Python sources and the rest data, in directories of
+    :data:`FILES_PER_DIR` files.
+
+    :returns:
+        The total size of the files, in bytes.
+    """
+    rng = random.Random(seed)
+    size = DISTRIBUTIONS[distribution]
+    os.makedirs(os.path.join(root, '.zapp'))
+    with open(os.path.join(root, 'zapp.yaml'), 'w') as fp:
+        fp.write(ZAPP_YAML % {'dependencies': '\n'.join(
+            '  - %s' % name for name, _ in dependencies)})
+    with open(os.path.join(root, '.zapp', 'tox.ini'), 'w') as fp:
+        fp.write(TOX_INI % {'wheelhouse': wheelhouse})
+    with open(os.path.join(root, 'main.py'), 'w') as fp:
+        fp.write('print("Hello from ZeroVM!")\n')
+    total = 0
+    for i in range(file_count):
+        if i % 4 == 0:
+            file_name = os.path.join('src', 'pkg%04d' % (i // FILES_PER_DIR),
+                                     'module%06d.py' % i)
+        else:
+            file_name = os.path.join('data', 'set%04d' % (i // FILES_PER_DIR),
+                                     'record%06d.dat' % i)
+        file_name = os.path.join(root, file_name)
+        if not os.path.isdir(os.path.dirname(file_name)):
+            os.makedirs(os.path.dirname(file_name))
+        nbytes = size(rng)
+        with open(file_name, 'wb') as fp:
+            # Compressible like text, without being all the same.
+            fp.write(((b'%06d ' % i) * (nbytes // 7 + 1))[:nbytes])
+        total += nbytes
+    return total
+
+
+def make_tox(bin_dir):
+    """
+    Write the ``tox`` stand-in to ``bin_dir``.
+    """
+    os.makedirs(bin_dir)
+    tox = os.path.join(bin_dir, 'tox')
+    with open(tox, 'w') as fp:
+        fp.write(TOX % {'python': sys.executable})
+    os.chmod(tox, os.stat(tox).st_mode | stat.S_IXUSR)
+
+
+def _bundle(root, bin_dir):
+    env = dict(os.environ)
+    env['PATH'] = os.pathsep.join([bin_dir, env.get('PATH', '')])
+    env['PYTHONPATH'] = harness.ROOT
+
+    def bundle():
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([sys.executable, ZPM, 'bundle',
+                                   '--log-level', 'error'],
+                                  cwd=root, env=env, stdout=devnull)
+    return bundle
+
+
+def benchmarks(tmpdir, quick=False):
+    wheelhouse = os.path.join(tmpdir, 'wheelhouse')
+    make_wheelhouse(wheelhouse)
+    bin_dir = os.path.join(tmpdir, 'bin')
+    make_tox(bin_dir)
+    result = []
+    for count in QUICK_FILE_COUNTS if quick else FILE_COUNTS:
+        root = os.path.join(tmpdir, 'project-%d' % count)
+        make_project(root, count, wheelhouse)
+        result.append(harness.benchmark('zpm_bundle', 'files=%d' % count,
+                                        count, 'file', _bundle(root, bin_dir),
+                                        children=True))
+    return result
+
+
+if __name__ == '__main__':
+    harness.main([('bundle', sys.modules[__name__])])
@@ -0,0 +1,61 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+End-to-end benchmark of ``zvsh`` runs, against ``fake-zerovm``.
+
+Run with ``python -m benchmarks e2e``. Each operation is a complete ``zvsh``
+process, so ops/s is the number of runs per second; the peak memory is that
+of the largest child process.
+"""
+
+import os
+import subprocess
+import sys
+
+from benchmarks import harness
+
+RUNS = 50
+QUICK_RUNS = 5
+ZVSH = os.path.join(harness.ROOT, 'scripts', 'zvsh')
+FAKE_ZEROVM = os.path.join(harness.ROOT, 'scripts', 'fake-zerovm')
+
+
+def _runs(tmpdir, count, args):
+    env = dict(os.environ)
+    env['PATH'] = os.pathsep.join([tmpdir, env.get('PATH', '')])
+    env['PYTHONPATH'] = harness.ROOT
+
+    def runs():
+        with open(os.devnull, 'r+b') as devnull:
+            for _ in range(count):
+                subprocess.check_call([sys.executable, ZVSH] + args,
+                                      cwd=tmpdir, env=env, stdin=devnull,
+                                      stdout=devnull)
+    return runs
+
+
+def benchmarks(tmpdir, quick=False):
+    # zvsh runs "zerovm" from the PATH.
+    os.symlink(FAKE_ZEROVM, os.path.join(tmpdir, 'zerovm'))
+    with open(os.path.join(tmpdir, 'prog.nexe'), 'wb') as fp:
+        fp.write(b'\x7fELF')
+    count = QUICK_RUNS if quick else RUNS
+    return [harness.benchmark('zvsh_run', 'runs=%d' % count, count, 'run',
+                              _runs(tmpdir, count, ['prog.nexe']),
+                              children=True)]
+
+
+if __name__ == '__main__':
+    harness.main([('e2e', sys.modules[__name__])])
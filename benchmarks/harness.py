@@ -0,0 +1,314 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Shared machinery of the benchmark suites.
+
+A suite is a module with a ``benchmarks(tmpdir, quick)`` function which
+returns a list of :class:`Benchmark`. Each benchmark is run once to warm up
+and measure its peak memory, then timed ``repeat`` times. A benchmark can
+return a `dict` of metrics of its own, which are kept for its fastest run.
+Results can be saved as JSON, tagged with the git revision, to compare
+commits.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+from collections import namedtuple
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 can't trace allocations.
+    tracemalloc = None
+
+#: Root of the source tree.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#: A benchmark case.
+#:
+#: ``name`` and ``param`` identify it, ``ops`` is the number of operations
+#: (such as channels or MiB) ``func`` performs per call, and ``unit`` names
+#: them. When ``children`` is set, ``func`` does its work in child processes,
+#: and the peak memory is the largest resident set of a child instead of the
+#: Python allocations of this process. The CPU time counts both.
+Benchmark = namedtuple('Benchmark', ['name', 'param', 'ops', 'unit', 'func',
+                                     'children'])
+
+
+def benchmark(name, param, ops, unit, func, children=False):
+    return Benchmark(name, param, ops, unit, func, children)
+
+
+def _children_maxrss():
+    # ru_maxrss is in KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+
+def _forked_children_maxrss(func):
+    # The largest child of this process so far may belong to another
+    # benchmark: call func in a fork, which starts with no children.
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = 1
+        try:
+            func()
+            os.write(write_fd, str(_children_maxrss()).encode('ascii'))
+            status = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(status)
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as fp:
+        data = fp.read()
+    _, status = os.waitpid(pid, 0)
+    if status != 0:
+        raise RuntimeError('benchmark failed')
+    return int(data)
+
+
+def _cpu_time():
+    # User and system time of this process and of its waited for children.
+    return sum(os.times()[:4])
+
+
+def peak_memory(bench):
+    """
+    Call ``bench.func`` once, and get the peak memory it used in bytes, or
+    None if it can't be measured.
+    """
+    if bench.children:
+        return _forked_children_maxrss(bench.func)
+    if tracemalloc is None:
+        bench.func()
+        return None
+    tracemalloc.start()
+    try:
+        bench.func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(suite, bench, repeat):
+    """
+    Run a benchmark.
+
+    :returns:
+        `dict` of the results.
+    """
+    peak = peak_memory(bench)
+    times = []
+    cpu_times = []
+    metrics = []
+    for _ in range(repeat):
+        start = time.time()
+        start_cpu = _cpu_time()
+        result = bench.func()
+        times.append(time.time() - start)
+        cpu_times.append(_cpu_time() - start_cpu)
+        metrics.append(result if isinstance(result, dict) else {})
+    best = min(times)
+    return {
+        'suite': suite,
+        'name': bench.name,
+        'param': bench.param,
+        'ops': bench.ops,
+        'unit': bench.unit,
+        'times': times,
+        'best': best,
+        'mean': sum(times) / len(times),
+        'cpu_times': cpu_times,
+        'best_cpu': min(cpu_times),
+        'per_op': best / bench.ops,
+        'peak_memory': peak,
+        'metrics': metrics[times.index(best)],
+    }
+
+
+def git_revision():
+    """
+    Get the git revision of the source tree, or None.
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            rev = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                          cwd=ROOT, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return rev.decode('ascii').strip()
+
+
+def git_dirty():
+    """
+    Tell whether the source tree has uncommitted changes, or None if it
+    isn't a git checkout.
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            status = subprocess.check_output(
+                ['git', 'status', '--porcelain', '--untracked-files=no'],
+                cwd=ROOT, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return bool(status.strip())
+
+
+def _cpu_model():
+    try:
+        with open('/proc/cpuinfo') as fp:
+            for line in fp:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except IOError:
+        pass
+    return platform.processor()
+
+
+def _total_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def host_fingerprint():
+    """
+    Identify the machine and interpreter running the benchmarks, so that
+    only comparable results are compared: a short hash of the CPU model and
+    count, the memory size, the operating system and the Python
+    implementation and version. The host name is left out, as it changes
+    with each container of a CI service.
+    """
+    try:
+        import multiprocessing
+        cpus = multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        cpus = None
+    parts = [platform.machine(), _cpu_model(), cpus, _total_memory(),
+             platform.system(), platform.python_implementation(),
+             platform.python_version()]
+    digest = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+    return digest[:12]
+
+
+def metadata():
+    return {
+        'time': time.time(),
+        'revision': git_revision(),
+        'dirty': git_dirty(),
+        'host': host_fingerprint(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'argv': sys.argv,
+    }
+
+
+def save(results, file_name):
+    """
+    Write ``results`` to ``file_name`` as JSON, with :func:`metadata`.
+    """
+    with open(file_name, 'w') as fp:
+        json.dump({'meta': metadata(), 'results': results}, fp, indent=2,
+                  sort_keys=True)
+
+
+def _format_memory(nbytes):
+    if nbytes is None:
+        return '-'
+    return '%.1fMiB' % (nbytes / 1048576.0)
+
+
+def run(suites, repeat=3, quick=False, out=None):
+    """
+    Run the benchmarks of ``suites``, a `list` of (name, module) pairs, and
+    print a line for each. A benchmark that fails is reported, with its
+    traceback on stderr, and left out of the results; the others still run.
+
+    :returns:
+        `list` of the result of each benchmark, see :func:`measure`.
+    """
+    out = out or sys.stdout
+    results = []
+    out.write('%-28s %12s %10s %9s %12s %16s %10s\n'
+              % ('benchmark', 'param', 'best (s)', 'cpu (s)', 'ops/s',
+                 'per op', 'peak mem'))
+    for suite_name, suite in suites:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for bench in suite.benchmarks(tmpdir, quick):
+                try:
+                    result = measure(suite_name, bench, repeat)
+                except Exception:
+                    traceback.print_exc()
+                    out.write('%-28s %12s %10s\n'
+                              % ('%s.%s' % (suite_name, bench.name),
+                                 bench.param, 'failed'))
+                    out.flush()
+                    continue
+                results.append(result)
+                out.write('%-28s %12s %10.4f %9.3f %12.1f %13.2fus/%s %10s\n'
+                          % ('%s.%s' % (suite_name, bench.name),
+                             bench.param, result['best'], result['best_cpu'],
+                             bench.ops / result['best'],
+                             result['per_op'] * 1e6, bench.unit,
+                             _format_memory(result['peak_memory'])))
+                if result['metrics']:
+                    out.write('    %s\n' % ' '.join(
+                        '%s=%s' % item
+                        for item in sorted(result['metrics'].items())))
+                out.flush()
+        finally:
+            shutil.rmtree(tmpdir)
+    return results
+
+
+def main(suites, argv=None):
+    """
+    Command line entry point of the suites.
+    """
+    parser = argparse.ArgumentParser(description='Run zerovm-cli benchmarks')
+    parser.add_argument('suite', nargs='*',
+                        help='suites to run (default: all of %s)'
+                             % ', '.join(name for name, _ in suites))
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs of each benchmark')
+    parser.add_argument('--quick', action='store_true',
+                        help='use small sizes, to check the benchmarks work')
+    parser.add_argument('--json', metavar='FILE',
+                        help='save the results to FILE as JSON')
+    args = parser.parse_args(argv)
+    if args.suite:
+        unknown = set(args.suite) - set(name for name, _ in suites)
+        if unknown:
+            parser.error('unknown suite: %s' % ', '.join(sorted(unknown)))
+        suites = [(name, suite) for name, suite in suites
+                  if name in args.suite]
+    results = run(suites, repeat=args.repeat, quick=args.quick)
+    if args.json:
+        save(results, args.json)
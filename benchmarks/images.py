@@ -0,0 +1,88 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Benchmarks for scanning ``--zvm-image`` tars with
+:meth:`zvshlib.zvsh.ZvShell.add_image_args`.
+
+Run with ``python -m benchmarks images``. The synthetic images are sparse
+files of 1 MiB members with the nexe last, so the whole tar is scanned
+without filling the disk.
+"""
+
+import os
+import sys
+import tarfile
+
+from benchmarks import harness
+from zvshlib import zvsh
+
+MiB = 1024 * 1024
+IMAGE_SIZES = (100 * MiB, 1024 * MiB, 5 * 1024 * MiB)
+QUICK_IMAGE_SIZES = (10 * MiB,)
+MEMBER_SIZE = MiB
+NEXE = 'bin/prog.nexe'
+
+
+def _blocks(size):
+    return (size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE * \
+        tarfile.BLOCKSIZE
+
+
+def sparse_tar(file_name, size, member_size=MEMBER_SIZE, nexe=NEXE):
+    """
+    Write a tar of about ``size`` bytes of ``member_size`` members holding
+    zeros, without writing the zeros, followed by a small ``nexe``.
+    """
+    nexe_data = b'\x7fELF' + b'\0' * 4092
+    with open(file_name, 'wb') as fp:
+        for i in range(max(size // member_size, 1)):
+            info = tarfile.TarInfo('data/%06d.bin' % i)
+            info.size = member_size
+            fp.write(info.tobuf())
+            fp.seek(_blocks(member_size), os.SEEK_CUR)
+        info = tarfile.TarInfo(nexe)
+        info.size = len(nexe_data)
+        fp.write(info.tobuf())
+        fp.write(nexe_data)
+        fp.write(b'\0' * (_blocks(len(nexe_data)) - len(nexe_data)))
+        fp.write(b'\0' * 2 * tarfile.BLOCKSIZE)
+        fp.truncate((fp.tell() + tarfile.RECORDSIZE - 1)
+                    // tarfile.RECORDSIZE * tarfile.RECORDSIZE)
+
+
+def _scan(image, savedir):
+    def scan():
+        shell = zvsh.ZvShell(zvsh.ZvConfig(), savedir)
+        shell.program = NEXE
+        shell.add_image_args([image])
+        assert shell.program != NEXE, 'nexe not found in %s' % image
+    return scan
+
+
+def benchmarks(tmpdir, quick=False):
+    sizes = QUICK_IMAGE_SIZES if quick else IMAGE_SIZES
+    result = []
+    for size in sizes:
+        image = os.path.join(tmpdir, 'image-%d.tar' % size)
+        sparse_tar(image, size)
+        savedir = os.path.join(tmpdir, 'run-%d' % size)
+        result.append(harness.benchmark(
+            'add_image_args', '%dMiB' % (size // MiB), size // MiB, 'MiB',
+            _scan(image, savedir)))
+    return result
+
+
+if __name__ == '__main__':
+    harness.main([('images', sys.modules[__name__])])
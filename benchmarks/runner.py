@@ -0,0 +1,112 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Benchmarks for relaying output with :class:`zvshlib.zvsh.ZvRunner`.
+
+Run with ``python -m benchmarks runner``. ``fake-zerovm`` generates the
+output, which the runner pumps from the stdout FIFO to ``/dev/null``. The
+peak memory should not grow with the amount of output. The time the pump
+spent blocked reading and writing, from :class:`zvshlib.zvsh.PumpStats`, is
+shown under each line.
+"""
+
+import os
+import sys
+
+from benchmarks import harness
+from zvshlib import zvsh
+
+GiB = 1024 * 1024 * 1024
+OUTPUT_SIZES = (GiB, 5 * GiB, 10 * GiB)
+QUICK_OUTPUT_SIZES = (64 * 1024 * 1024,)
+FAKE_ZEROVM = os.path.join(harness.ROOT, 'scripts', 'fake-zerovm')
+
+MANIFEST = """\
+Version = 20130611
+Memory = 4294967296,0
+Node = 1
+Timeout = 3600
+Program = %(program)s
+Channel = /dev/stdin,/dev/stdin,0,0,1099511627776,1099511627776,0,0
+Channel = %(stdout)s,/dev/stdout,0,0,0,0,1099511627776,1099511627776
+Channel = %(stderr)s,/dev/stderr,0,0,0,0,1099511627776,1099511627776
+"""
+
+
+class _Environ(object):
+    """
+    Set environment variables and redirect our stdout to ``/dev/null``
+    while in use.
+    """
+
+    def __init__(self, **env):
+        self.env = env
+        self.saved = None
+        self.stdout = None
+
+    def __enter__(self):
+        self.saved = dict((key, os.environ.get(key)) for key in self.env)
+        os.environ.update(self.env)
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *exc_info):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+        for key, value in self.saved.items():
+            if value is None:
+                del os.environ[key]
+            else:
+                os.environ[key] = value
+
+
+def _pump(tmpdir, size):
+    manifest = os.path.join(tmpdir, 'manifest.1')
+    stdout = os.path.join(tmpdir, 'stdout.1')
+    stderr = os.path.join(tmpdir, 'stderr.1')
+    with open(manifest, 'w') as fp:
+        fp.write(MANIFEST % {'program': FAKE_ZEROVM, 'stdout': stdout,
+                             'stderr': stderr})
+
+    def pump():
+        runner = zvsh.ZvRunner([sys.executable, FAKE_ZEROVM, '-PQ', manifest],
+                               stdout, stderr, tmpdir)
+        with open(os.devnull, 'rb') as stdin:
+            runner.stdin = stdin
+            with _Environ(FAKE_ZEROVM_MODE='generate',
+                          FAKE_ZEROVM_BYTES=str(size),
+                          PYTHONPATH=harness.ROOT):
+                rc = runner.execute()
+        assert rc == 0, 'fake-zerovm failed: %s' % runner.report
+        # Blocked reading, the pump waits for ZeroVM; blocked writing, for
+        # the consumer.
+        stdout_stats = runner.stats()['streams']['stdout']
+        return {
+            'chunks': stdout_stats['chunks'],
+            'read_s': round(stdout_stats['read_time'], 3),
+            'write_s': round(stdout_stats['write_time'], 3),
+        }
+    return pump
+
+
+def benchmarks(tmpdir, quick=False):
+    sizes = QUICK_OUTPUT_SIZES if quick else OUTPUT_SIZES
+    return [harness.benchmark('pump_stdout', '%dMiB' % (size >> 20),
+                              size >> 20, 'MiB', _pump(tmpdir, size))
+            for size in sizes]
+
+
+if __name__ == '__main__':
+    harness.main([('runner', sys.modules[__name__])])
@@ -0,0 +1,88 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Benchmarks for :mod:`zvshlib.serializer`.
+
+Run with ``python -m benchmarks serializer``. For each channel count, the
+time per channel should stay flat; growing times mean something went
+quadratic.
+"""
+
+import os
+import sys
+
+from benchmarks import harness
+from zvshlib import serializer
+from zvshlib import zvsh
+
+CHANNEL_COUNTS = (1000, 10000, 100000)
+QUICK_CHANNEL_COUNTS = (1000,)
+
+
+def _channels(count):
+    return [('/srv/objects/obj %d, part' % i, '/dev/%d.obj' % i, 3, 0,
+             4294967296, 4294967296, 4294967296, 4294967296)
+            for i in range(count)]
+
+
+def _settings():
+    return [('Node', 1), ('Version', '20130611'), ('Timeout', 50),
+            ('Memory', '4294967296,0'), ('Program', '/tmp/boot.1')]
+
+
+def _manifest(channels):
+    manifest = zvsh.Manifest('20130611', 50, 4294967296, '/tmp/boot.1')
+    manifest.channels.add_all(
+        (channel[0], channel[1], channel[2], channel[4:])
+        for channel in channels)
+    return manifest
+
+
+def cases(count, tmpdir):
+    """
+    Get the (name, function) pairs to time for ``count`` channels.
+    """
+    channels = _channels(count)
+    uris = [channel[0] for channel in channels]
+    mapping = [serializer.mapping_line(channel[1], 'file')
+               for channel in channels]
+    manifest_fn = os.path.join(tmpdir, 'manifest.1')
+    manifest = _manifest(channels)
+
+    return [
+        ('nvram_escape', lambda: [zvsh._nvram_escape(uri) for uri in uris]),
+        ('dumps_manifest',
+         lambda: serializer.dumps_manifest(_settings(), channels)),
+        ('dump_manifest',
+         lambda: serializer.dump(
+             manifest_fn, serializer.iter_manifest(_settings(), channels))),
+        ('manifest_dumps', manifest.dumps),
+        ('channel_table', lambda: _manifest(channels).dumps()),
+        ('dumps_nvram',
+         lambda: serializer.dumps_nvram([
+             ('args', [serializer.args_line(uris[:100])]),
+             ('mapping', mapping)])),
+    ]
+
+
+def benchmarks(tmpdir, quick=False):
+    counts = QUICK_CHANNEL_COUNTS if quick else CHANNEL_COUNTS
+    return [harness.benchmark(name, count, count, 'channel', func)
+            for count in counts
+            for name, func in cases(count, tmpdir)]
+
+
+if __name__ == '__main__':
+    harness.main([('serializer', sys.modules[__name__])])
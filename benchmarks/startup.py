@@ -0,0 +1,223 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Cold start of the ``zvsh``, ``zvm`` and ``zpm`` entry points.
+
+``python -m benchmarks startup`` times whole runs of each entry point, like
+the other suites. ``python -m benchmarks.startup`` measures what they import
+with ``python -X importtime`` (Python 3.7 and later) instead, and fails when
+an entry point spends more than its budget importing modules, or imports
+one of the modules it has no use for, such as the Swift client.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks import harness
+
+#: Entry points, as (name, arguments of the script) pairs. ``--help`` stops
+#: the scripts as soon as they have parsed their arguments, once every
+#: module they need at start up is imported.
+ENTRY_POINTS = [
+    ('zvsh', ['zvsh', '--help']),
+    ('zvm run', ['zvm', 'run', '--help']),
+    ('zpm help', ['zpm', 'help']),
+    ('zpm version', ['zpm', 'version']),
+]
+
+#: Budget of each entry point, in milliseconds spent importing modules
+#: beyond those the interpreter imports by itself.
+BUDGETS = {
+    'zvsh': 60,
+    'zvm run': 80,
+    'zpm help': 30,
+    'zpm version': 30,
+}
+
+#: Modules the entry points must not import: they are only needed to talk
+#: to ZeroCloud, or to bundle and deploy zapps.
+UNWANTED = ('swiftclient', 'requests', 'jinja2', 'yaml', 'prettytable',
+            'zpmlib.zpm')
+
+REPEAT = 5
+
+
+def parse_importtime(text):
+    """
+    Parse the output of ``python -X importtime``.
+
+    :returns:
+        `list` of (module, self time, cumulative time, depth) tuples, the
+        times in microseconds, in the order of the output.
+
+    >>> parse_importtime('''import time: self [us] | cumulative | imported package
+    ... import time:       120 |        120 |     _json
+    ... import time:       400 |        520 |   json.decoder
+    ... import time:       300 |        820 | json
+    ... usage: zvsh''')
+    [('_json', 120, 120, 2), ('json.decoder', 400, 520, 1), ('json', 300, 820, 0)]
+    """  # noqa
+    result = []
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()[1:]
+        module = name.lstrip()
+        depth = (len(name) - len(module)) // 2
+        result.append((module, int(fields[0]), int(fields[1]), depth))
+    return result
+
+
+def _importtime(args):
+    env = dict(os.environ, PYTHONPATH=harness.ROOT)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen([sys.executable, '-X', 'importtime'] + args,
+                                cwd=harness.ROOT, env=env, stdout=devnull,
+                                stderr=subprocess.PIPE)
+        _, err = proc.communicate()
+    return parse_importtime(err.decode('utf-8', 'replace'))
+
+
+def import_cost(script_args, baseline=()):
+    """
+    Run an entry point with ``-X importtime``.
+
+    :param script_args:
+        The script, in ``scripts/``, and its arguments.
+    :param baseline:
+        Modules to leave out, those the interpreter imports by itself.
+    :returns:
+        `tuple` of the total import time in microseconds, a `dict` of the
+        cumulative time of each module it imported at the top level, and a
+        `set` of all the modules it imported.
+    """
+    script = os.path.join(harness.ROOT, 'scripts', script_args[0])
+    args = list(script_args[1:])
+    modules = {}
+    imported = set()
+    for module, _, cumulative, depth in _importtime([script] + args):
+        imported.add(module)
+        if depth == 0 and module not in baseline:
+            modules[module] = cumulative
+    return sum(modules.values()), modules, imported
+
+
+def measure(repeat=REPEAT):
+    """
+    Measure the import cost of each entry point, keeping the best of
+    ``repeat`` runs.
+
+    :returns:
+        `list` of the results, as `dict` objects.
+    """
+    # Run once, so the later runs find the bytecode compiled.
+    baseline = set(module for module, _, _, _ in _importtime(['-c', 'pass']))
+    results = []
+    for name, script_args in ENTRY_POINTS:
+        import_cost(script_args, baseline)
+        runs = [import_cost(script_args, baseline) for _ in range(repeat)]
+        total, modules, imported = min(runs, key=lambda run: run[0])
+        results.append({
+            'entry_point': name,
+            'import_us': total,
+            'budget_us': BUDGETS[name] * 1000,
+            'modules': modules,
+            'unwanted': sorted(set(UNWANTED) & imported),
+        })
+    return results
+
+
+def check(results):
+    """
+    :returns:
+        `list` of messages about the entry points over budget, or importing
+        unwanted modules.
+    """
+    failures = []
+    for result in results:
+        if result['import_us'] > result['budget_us']:
+            failures.append('%s: imports take %.1fms, over the budget of '
+                            '%.1fms' % (result['entry_point'],
+                                        result['import_us'] / 1000.0,
+                                        result['budget_us'] / 1000.0))
+        if result['unwanted']:
+            failures.append('%s: imports %s' % (result['entry_point'],
+                                                ', '.join(result['unwanted'])))
+    return failures
+
+
+def report(results, top=5, out=None):
+    out = out or sys.stdout
+    out.write('%-14s %12s %12s  %s\n' % ('entry point', 'imports (ms)',
+                                         'budget (ms)', 'heaviest imports'))
+    for result in results:
+        heaviest = sorted(result['modules'].items(), key=lambda item: -item[1])
+        out.write('%-14s %12.1f %12.1f  %s\n'
+                  % (result['entry_point'], result['import_us'] / 1000.0,
+                     result['budget_us'] / 1000.0,
+                     ', '.join('%s %.1fms' % (module, cost / 1000.0)
+                               for module, cost in heaviest[:top])))
+
+
+def _run(tmpdir, script_args):
+    script = os.path.join(harness.ROOT, 'scripts', script_args[0])
+    env = dict(os.environ, PYTHONPATH=harness.ROOT)
+
+    def run():
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([sys.executable, script] + script_args[1:],
+                                  cwd=tmpdir, env=env, stdout=devnull)
+    return run
+
+
+def benchmarks(tmpdir, quick=False):
+    return [harness.benchmark('start', name.replace(' ', '_'), 1, 'run',
+                              _run(tmpdir, script_args), children=True)
+            for name, script_args in ENTRY_POINTS]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Check the import cost of the zerovm-cli entry points')
+    parser.add_argument('--repeat', type=int, default=REPEAT,
+                        help='runs of each entry point (default: %(default)s)')
+    parser.add_argument('--top', type=int, default=5,
+                        help='heaviest imports to show for each entry point')
+    parser.add_argument('--json', metavar='FILE',
+                        help='save the results to FILE as JSON')
+    args = parser.parse_args(argv)
+    if sys.version_info < (3, 7):
+        parser.error('-X importtime needs Python 3.7 or later')
+    results = measure(args.repeat)
+    report(results, top=args.top)
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({'meta': harness.metadata(), 'results': results}, fp,
+                      indent=2, sort_keys=True)
+    failures = check(results)
+    for failure in failures:
+        sys.stderr.write('%s\n' % failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
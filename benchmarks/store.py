@@ -0,0 +1,458 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Store of benchmark results, and comparison of revisions: the
+``zerovm-cli-bench`` tool.
+
+``zerovm-cli-bench run [suite ...]`` runs the suites like ``python -m
+benchmarks``, and adds the results to a SQLite file, ``.benchmarks.sqlite``
+at the root of the tree by default, tagged with the git revision and
+:func:`harness.host_fingerprint`. ``zerovm-cli-bench compare OLD NEW``
+compares the timings of two revisions on this host: the runs of a revision
+are pooled, and a bootstrap confidence interval of the ratio of the mean
+times tells whether a change is significant or noise. ``zerovm-cli-bench
+export`` writes the stored results. Both can write Markdown or JSON.
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+
+from collections import OrderedDict
+
+from benchmarks import harness
+
+DEFAULT_DB = os.path.join(harness.ROOT, '.benchmarks.sqlite')
+#: Resamples of the bootstrap.
+RESAMPLES = 5000
+CONFIDENCE = 0.95
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    revision TEXT,
+    dirty INTEGER,
+    host TEXT NOT NULL,
+    python TEXT,
+    platform TEXT,
+    argv TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    run INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    suite TEXT NOT NULL,
+    name TEXT NOT NULL,
+    param TEXT NOT NULL,
+    ops REAL NOT NULL,
+    unit TEXT NOT NULL,
+    times TEXT NOT NULL,
+    cpu_times TEXT NOT NULL,
+    peak_memory INTEGER,
+    metrics TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_revision ON runs (revision, host);
+"""
+
+
+class Store(object):
+    """
+    SQLite file of benchmark runs and their results.
+    """
+
+    def __init__(self, file_name):
+        self.conn = sqlite3.connect(file_name)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def add(self, results, meta):
+        """
+        Add a run, ``results`` from :func:`harness.run` with the
+        :func:`harness.metadata` ``meta``.
+
+        :returns:
+            The id of the run.
+        """
+        with self.conn:
+            cursor = self.conn.execute(
+                'INSERT INTO runs (time, revision, dirty, host, python, '
+                'platform, argv) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (meta['time'], meta['revision'], meta['dirty'], meta['host'],
+                 meta['python'], meta['platform'], json.dumps(meta['argv'])))
+            run_id = cursor.lastrowid
+            self.conn.executemany(
+                'INSERT INTO results (run, suite, name, param, ops, unit, '
+                'times, cpu_times, peak_memory, metrics) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(run_id, r['suite'], r['name'], r['param'], r['ops'],
+                  r['unit'], json.dumps(r['times']),
+                  json.dumps(r['cpu_times']), r['peak_memory'],
+                  json.dumps(r['metrics'], sort_keys=True))
+                 for r in results])
+        return run_id
+
+    def runs(self, revision=None, host=None):
+        """
+        Get the runs, oldest first, of the revisions starting with
+        ``revision`` and of ``host``, or of all of them.
+
+        :returns:
+            `list` of `dict` of each run, with a ``results`` count.
+        """
+        query = ('SELECT runs.*, COUNT(results.run) AS results FROM runs '
+                 'LEFT JOIN results ON results.run = runs.id WHERE 1')
+        params = []
+        if revision is not None:
+            query += ' AND runs.revision LIKE ?'
+            params.append(revision + '%')
+        if host is not None:
+            query += ' AND runs.host = ?'
+            params.append(host)
+        query += ' GROUP BY runs.id ORDER BY runs.time'
+        return [dict(row) for row in self.conn.execute(query, params)]
+
+    def results(self, run_ids):
+        """
+        Get the results of the runs ``run_ids``, in the order they ran.
+
+        :returns:
+            `list` of `dict` of each result, like those of
+            :func:`harness.measure` plus the ``run`` and its ``revision``.
+        """
+        if not run_ids:
+            return []
+        rows = self.conn.execute(
+            'SELECT results.*, runs.revision FROM results '
+            'JOIN runs ON runs.id = results.run WHERE results.run IN (%s) '
+            'ORDER BY runs.time, results.rowid'
+            % ', '.join('?' * len(run_ids)), list(run_ids))
+        results = []
+        for row in rows:
+            result = dict(row)
+            for key in ('times', 'cpu_times', 'metrics'):
+                result[key] = json.loads(result[key])
+            times = result['times']
+            result['best'] = min(times)
+            result['mean'] = sum(times) / len(times)
+            result['best_cpu'] = min(result['cpu_times'])
+            result['per_op'] = result['best'] / result['ops']
+            results.append(result)
+        return results
+
+
+def _mean(values):
+    return sum(values) / float(len(values))
+
+
+def _resample(rng, values):
+    n = len(values)
+    return [values[int(rng.random() * n)] for _ in range(n)]
+
+
+def bootstrap_ratio(old, new, resamples=RESAMPLES, confidence=CONFIDENCE,
+                    seed=0):
+    """
+    Estimate the ratio of the mean of ``new`` to the mean of ``old``, with
+    a percentile bootstrap confidence interval.
+
+    >>> ratio, low, high = bootstrap_ratio([1.0, 1.1, 0.9], [0.5, 0.55, 0.45])
+    >>> ratio
+    0.5
+    >>> low < 0.5 < high < 1
+    True
+
+    :returns:
+        (ratio, low, high) `tuple`.
+    """
+    rng = random.Random(seed)
+    ratios = sorted(_mean(_resample(rng, new)) / _mean(_resample(rng, old))
+                    for _ in range(resamples))
+    tail = (1 - confidence) / 2
+    low = ratios[int(tail * (resamples - 1))]
+    high = ratios[int(round((1 - tail) * (resamples - 1)))]
+    return _mean(new) / _mean(old), low, high
+
+
+def _key(result):
+    return (result['suite'], result['name'], result['param'], result['ops'])
+
+
+def _pool(results):
+    # The timings of each benchmark over all the runs, in order.
+    pooled = OrderedDict()
+    for result in results:
+        entry = pooled.setdefault(_key(result), dict(result, times=[]))
+        entry['times'].extend(result['times'])
+    return pooled
+
+
+def compare(old_results, new_results, resamples=RESAMPLES,
+            confidence=CONFIDENCE):
+    """
+    Compare the timings of the benchmarks in both ``old_results`` and
+    ``new_results``, each pooled over their runs.
+
+    :returns:
+        `list` of `dict` of each benchmark, where ``change`` is the ratio of
+        the new mean time to the old, ``low`` and ``high`` its confidence
+        interval, and ``verdict`` is ``faster`` or ``slower`` when the
+        interval excludes 1, or ``same`` otherwise.
+    """
+    old = _pool(old_results)
+    new = _pool(new_results)
+    rows = []
+    for key, entry in new.items():
+        if key not in old:
+            continue
+        old_times = old[key]['times']
+        new_times = entry['times']
+        ratio, low, high = bootstrap_ratio(old_times, new_times,
+                                           resamples=resamples,
+                                           confidence=confidence)
+        if high < 1:
+            verdict = 'faster'
+        elif low > 1:
+            verdict = 'slower'
+        else:
+            verdict = 'same'
+        rows.append({
+            'suite': entry['suite'],
+            'name': entry['name'],
+            'param': entry['param'],
+            'old_mean': _mean(old_times),
+            'new_mean': _mean(new_times),
+            'old_samples': len(old_times),
+            'new_samples': len(new_times),
+            'change': ratio,
+            'low': low,
+            'high': high,
+            'verdict': verdict,
+        })
+    return rows
+
+
+def _percent(ratio):
+    return '%+.1f%%' % ((ratio - 1) * 100)
+
+
+def _markdown_table(header, rows):
+    lines = ['| %s |' % ' | '.join(header),
+             '|%s|' % '|'.join('---' for _ in header)]
+    lines.extend('| %s |' % ' | '.join(row) for row in rows)
+    return '\n'.join(lines) + '\n'
+
+
+def format_comparison(rows, old, new, fmt='text', confidence=CONFIDENCE):
+    """
+    Format the :func:`compare` ``rows`` of the revisions ``old`` and
+    ``new`` as ``text``, ``markdown`` or ``json``.
+    """
+    if fmt == 'json':
+        return json.dumps({'old': old, 'new': new, 'confidence': confidence,
+                           'benchmarks': rows},
+                          indent=2, sort_keys=True) + '\n'
+    table = [('%s.%s' % (row['suite'], row['name']), row['param'],
+              '%.4f' % row['old_mean'], '%.4f' % row['new_mean'],
+              _percent(row['change']),
+              '[%s, %s]' % (_percent(row['low']), _percent(row['high'])),
+              row['verdict'])
+             for row in rows]
+    header = ('benchmark', 'param', 'old (s)', 'new (s)', 'change',
+              '%d%% CI' % round(confidence * 100), 'verdict')
+    if fmt == 'markdown':
+        return ('Comparison of `%s` (old) and `%s` (new):\n\n' % (old, new)
+                + _markdown_table(header, table))
+    line = '%-28s %12s %10s %10s %8s %20s %7s\n'
+    return (line % header) + ''.join(line % row for row in table)
+
+
+def format_results(results, fmt='text'):
+    """
+    Format stored ``results`` as ``text``, ``markdown`` or ``json``.
+    """
+    if fmt == 'json':
+        return json.dumps(results, indent=2, sort_keys=True) + '\n'
+    table = [((row['revision'] or '-')[:12],
+              '%s.%s' % (row['suite'], row['name']), row['param'],
+              '%.4f' % row['best'], '%.4f' % row['mean'],
+              '%.3f' % row['best_cpu'],
+              '%.2fus/%s' % (row['per_op'] * 1e6, row['unit']),
+              harness._format_memory(row['peak_memory']))
+             for row in results]
+    header = ('revision', 'benchmark', 'param', 'best (s)', 'mean (s)',
+              'cpu (s)', 'per op', 'peak mem')
+    if fmt == 'markdown':
+        return _markdown_table(header, table)
+    line = '%-12s %-28s %12s %10s %10s %9s %16s %10s\n'
+    return (line % header) + ''.join(line % row for row in table)
+
+
+def resolve_revision(revision):
+    """
+    Get the full git revision of ``revision``, such as a tag or ``HEAD~1``,
+    or ``revision`` itself, to match the start of stored revisions, if git
+    doesn't know it.
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            rev = subprocess.check_output(
+                ['git', 'rev-parse', '--verify', '--quiet',
+                 revision + '^{commit}'],
+                cwd=harness.ROOT, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return revision
+    return rev.decode('ascii').strip()
+
+
+def _run_ids(store, revision, host):
+    runs = store.runs(resolve_revision(revision), host)
+    if not runs:
+        raise SystemExit('error: no runs of %s on host %s'
+                         % (revision, host or 'any'))
+    return [run['id'] for run in runs]
+
+
+def _cmd_run(store, args, suites):
+    if args.suite:
+        unknown = set(args.suite) - set(name for name, _ in suites)
+        if unknown:
+            raise SystemExit('error: unknown suite: %s'
+                             % ', '.join(sorted(unknown)))
+        suites = [(name, suite) for name, suite in suites
+                  if name in args.suite]
+    results = harness.run(suites, repeat=args.repeat, quick=args.quick)
+    meta = harness.metadata()
+    if meta['dirty']:
+        sys.stderr.write('warning: the tree has uncommitted changes, the '
+                         'results are stored as those of %s\n'
+                         % (meta['revision'] or 'no revision'))
+    run_id = store.add(results, meta)
+    sys.stdout.write('stored run %d of %s on host %s\n'
+                     % (run_id, (meta['revision'] or '-')[:12],
+                        meta['host']))
+
+
+def _cmd_list(store, args, _suites):
+    host = None if args.any_host else args.host
+    sys.stdout.write('%5s %-20s %-12s %-6s %-12s %8s\n'
+                     % ('run', 'time', 'revision', 'dirty', 'host',
+                        'results'))
+    for run in store.runs(host=host):
+        sys.stdout.write('%5d %-20s %-12s %-6s %-12s %8d\n' % (
+            run['id'],
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(run['time'])),
+            (run['revision'] or '-')[:12],
+            'yes' if run['dirty'] else 'no', run['host'], run['results']))
+
+
+def _cmd_compare(store, args, _suites):
+    host = None if args.any_host else args.host
+    old = store.results(_run_ids(store, args.old, host))
+    new = store.results(_run_ids(store, args.new, host))
+    rows = compare(old, new, resamples=args.resamples,
+                   confidence=args.confidence)
+    sys.stdout.write(format_comparison(rows, args.old, args.new,
+                                       fmt=args.format,
+                                       confidence=args.confidence))
+
+
+def _cmd_export(store, args, _suites):
+    host = None if args.any_host else args.host
+    if args.revision is None:
+        run_ids = [run['id'] for run in store.runs(host=host)]
+    else:
+        run_ids = _run_ids(store, args.revision, host)
+    sys.stdout.write(format_results(store.results(run_ids), fmt=args.format))
+
+
+def set_up_arg_parser(suites):
+    parser = argparse.ArgumentParser(
+        prog='zerovm-cli-bench',
+        description='Store and compare zerovm-cli benchmark results')
+    parser.add_argument('--db', metavar='FILE',
+                        default=os.environ.get('ZEROVM_CLI_BENCH_DB',
+                                               DEFAULT_DB),
+                        help='SQLite file of the results (default: '
+                             '$ZEROVM_CLI_BENCH_DB or %(default)s)')
+    subparsers = parser.add_subparsers(title='commands', dest='command')
+
+    def host_arguments(subparser):
+        subparser.add_argument('--host', default=harness.host_fingerprint(),
+                               help='host fingerprint of the runs (default: '
+                                    'this host, %(default)s)')
+        subparser.add_argument('--any-host', action='store_true',
+                               help='use the runs of all hosts')
+
+    run = subparsers.add_parser('run', help='run suites and store the '
+                                            'results')
+    run.add_argument('suite', nargs='*',
+                     help='suites to run (default: all of %s)'
+                          % ', '.join(name for name, _ in suites))
+    run.add_argument('--repeat', type=int, default=3,
+                     help='timed runs of each benchmark')
+    run.add_argument('--quick', action='store_true',
+                     help='use small sizes, to check the benchmarks work')
+    run.set_defaults(func=_cmd_run)
+
+    runs = subparsers.add_parser('list', help='list the stored runs')
+    host_arguments(runs)
+    runs.set_defaults(func=_cmd_list)
+
+    cmp_ = subparsers.add_parser(
+        'compare', help='compare the results of two revisions')
+    cmp_.add_argument('old', help='git revision, or start of one, of the '
+                                  'baseline')
+    cmp_.add_argument('new', help='git revision, or start of one, to '
+                                  'compare with the baseline')
+    host_arguments(cmp_)
+    cmp_.add_argument('--confidence', type=float, default=CONFIDENCE,
+                      help='confidence level of the intervals '
+                           '(default: %(default)s)')
+    cmp_.add_argument('--resamples', type=int, default=RESAMPLES,
+                      help='bootstrap resamples (default: %(default)s)')
+    cmp_.add_argument('--format', choices=['text', 'markdown', 'json'],
+                      default='text')
+    cmp_.set_defaults(func=_cmd_compare)
+
+    export = subparsers.add_parser('export', help='write stored results')
+    export.add_argument('revision', nargs='?',
+                        help='git revision, or start of one (default: all)')
+    host_arguments(export)
+    export.add_argument('--format', choices=['text', 'markdown', 'json'],
+                        default='markdown')
+    export.set_defaults(func=_cmd_export)
+    return parser
+
+
+def main(suites, argv=None):
+    """
+    Command line entry point of ``zerovm-cli-bench``.
+    """
+    parser = set_up_arg_parser(suites)
+    args = parser.parse_args(argv)
+    if getattr(args, 'func', None) is None:
+        parser.error('too few arguments')
+    store = Store(args.db)
+    try:
+        args.func(store, args, suites)
+    finally:
+        store.close()
@@ -0,0 +1,204 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from benchmarks import store
+
+# Not git revisions, so that resolve_revision leaves them alone.
+OLD = 'a' * 40
+NEW = 'b' * 40
+
+
+def _result(times, name='dumps', param='1000'):
+    return {
+        'suite': 'serializer',
+        'name': name,
+        'param': param,
+        'ops': 1000,
+        'unit': 'channel',
+        'times': times,
+        'cpu_times': [t * 0.9 for t in times],
+        'peak_memory': 1048576,
+        'metrics': {'chunks': 2},
+    }
+
+
+def _meta(revision, host='host1', when=1000.0):
+    return {
+        'time': when,
+        'revision': revision,
+        'dirty': False,
+        'host': host,
+        'python': 'CPython 3.4.0',
+        'platform': 'Linux',
+        'argv': ['zerovm-cli-bench', 'run'],
+    }
+
+
+class TestStore:
+    """
+    Tests for :mod:`benchmarks.store`.
+    """
+
+    def setup_method(self, _method):
+        self.tempdir = tempfile.mkdtemp()
+        self.db = os.path.join(self.tempdir, 'bench.sqlite')
+        self.store = store.Store(self.db)
+
+    def teardown_method(self, _method):
+        self.store.close()
+        shutil.rmtree(self.tempdir)
+
+    def _main(self, capsys, *argv):
+        self.store.close()
+        store.main([], ['--db', self.db] + list(argv))
+        self.store = store.Store(self.db)
+        return capsys.readouterr()[0]
+
+    def test_add(self):
+        run_id = self.store.add([_result([0.3, 0.1, 0.2]),
+                                 _result([1.0], name='loads')],
+                                _meta(OLD))
+        self.store.add([], _meta(NEW, host='host2', when=2000.0))
+
+        runs = self.store.runs()
+        assert [OLD, NEW] == [run['revision'] for run in runs]
+        assert [2, 0] == [run['results'] for run in runs]
+        assert [run_id] == [run['id'] for run in self.store.runs('aaaa')]
+        assert [] == self.store.runs(OLD, host='host2')
+        assert [NEW] == [run['revision']
+                         for run in self.store.runs(host='host2')]
+
+        results = self.store.results([run_id])
+        assert ['dumps', 'loads'] == [r['name'] for r in results]
+        result = results[0]
+        assert OLD == result['revision']
+        assert [0.3, 0.1, 0.2] == result['times']
+        assert 0.1 == result['best']
+        assert abs(result['mean'] - 0.2) < 1e-9
+        assert 0.1 / 1000 == result['per_op']
+        assert {'chunks': 2} == result['metrics']
+        assert [] == self.store.results([])
+
+    def test_bootstrap_ratio(self):
+        old = [1.0, 1.02, 0.98, 1.01, 0.99]
+        ratio, low, high = store.bootstrap_ratio(old, [t * 2 for t in old])
+        assert abs(ratio - 2) < 1e-9
+        assert 1 < low <= ratio <= high
+        # Seeded: the same interval each time.
+        assert (ratio, low, high) == store.bootstrap_ratio(
+            old, [t * 2 for t in old])
+
+    def test_compare(self):
+        old = [_result([1.0, 1.02, 0.98]), _result([1.0, 1.01, 0.99],
+                                                   name='loads'),
+               _result([1.0, 1.02, 0.98], name='dump')]
+        new = [_result([1.5, 1.52, 1.48]), _result([1.01, 0.98, 1.0],
+                                                   name='loads'),
+               _result([0.5, 0.51, 0.49], name='dump'),
+               _result([1.0], name='only_new')]
+        rows = store.compare(old, new, resamples=1000)
+        assert [('dumps', 'slower'), ('loads', 'same'), ('dump', 'faster')
+                ] == [(row['name'], row['verdict']) for row in rows]
+        assert abs(rows[0]['change'] - 1.5) < 1e-9
+        assert rows[1]['low'] < 1 < rows[1]['high']
+
+    def test_compare_pools_runs(self):
+        old = [_result([1.0, 1.1]), _result([0.9, 1.0])]
+        new = [_result([2.0]), _result([2.1]), _result([1.9])]
+        [row] = store.compare(old, new, resamples=1000)
+        assert 4 == row['old_samples']
+        assert 3 == row['new_samples']
+        assert abs(row['old_mean'] - 1.0) < 1e-9
+        assert abs(row['new_mean'] - 2.0) < 1e-9
+        assert 'slower' == row['verdict']
+
+    def test_compare_command(self, capsys):
+        for i, times in enumerate([[1.0, 1.02], [0.98, 1.0]]):
+            self.store.add([_result(times)], _meta(OLD, when=i))
+        self.store.add([_result([2.0, 2.02, 1.98])], _meta(NEW, when=10))
+        # Another host's runs are left out of the pool.
+        self.store.add([_result([0.1, 0.1])], _meta(NEW, host='host2',
+                                                    when=11))
+
+        out = self._main(capsys, 'compare', OLD[:7], NEW[:7],
+                         '--host', 'host1', '--format', 'json')
+        data = json.loads(out)
+        assert OLD[:7] == data['old']
+        [row] = data['benchmarks']
+        assert (4, 3) == (row['old_samples'], row['new_samples'])
+        assert 'slower' == row['verdict']
+
+        out = self._main(capsys, 'compare', OLD[:7], NEW[:7],
+                         '--host', 'host1', '--format', 'markdown')
+        lines = out.splitlines()
+        assert ('Comparison of `aaaaaaa` (old) and `bbbbbbb` (new):'
+                == lines[0])
+        assert ('| benchmark | param | old (s) | new (s) | change | 95% CI '
+                '| verdict |' == lines[2])
+        assert lines[4].startswith('| serializer.dumps | 1000 | 1.0000 | '
+                                   '2.0000 | +100.0% | [')
+        assert lines[4].endswith('| slower |')
+
+        with pytest.raises(SystemExit) as exc:
+            self._main(capsys, 'compare', OLD[:7], NEW[:7],
+                       '--host', 'host2')
+        assert 'no runs of aaaaaaa on host host2' in str(exc.value)
+
+    def test_list(self, capsys):
+        self.store.add([_result([1.0])], _meta(OLD))
+        meta = _meta(NEW, host='host2', when=2000.0)
+        meta['dirty'] = True
+        self.store.add([], meta)
+
+        lines = self._main(capsys, 'list', '--host', 'host1').splitlines()
+        assert 2 == len(lines)
+        assert ['run', 'time', 'revision', 'dirty', 'host', 'results'
+                ] == lines[0].split()
+        fields = lines[1].split()
+        assert ['1', OLD[:12], 'no', 'host1', '1'] == (fields[:1]
+                                                       + fields[3:])
+
+        lines = self._main(capsys, 'list', '--any-host').splitlines()
+        assert ['2', NEW[:12], 'yes', 'host2', '0'] == (lines[2].split()[:1]
+                                                        + lines[2].split()[3:])
+
+    def test_export(self, capsys):
+        self.store.add([_result([0.2, 0.1])], _meta(OLD))
+        self.store.add([_result([0.4])], _meta(NEW, when=2000.0))
+
+        lines = self._main(capsys, 'export', '--host', 'host1').splitlines()
+        assert ('| revision | benchmark | param | best (s) | mean (s) '
+                '| cpu (s) | per op | peak mem |' == lines[0])
+        assert ('| aaaaaaaaaaaa | serializer.dumps | 1000 | 0.1000 | 0.1500 '
+                '| 0.090 | 100.00us/channel | 1.0MiB |' == lines[2])
+        assert 4 == len(lines)
+
+        out = self._main(capsys, 'export', NEW, '--host', 'host1',
+                         '--format', 'json')
+        [result] = json.loads(out)
+        assert NEW == result['revision']
+        assert [0.4] == result['times']
+
+        lines = self._main(capsys, 'export', OLD, '--host', 'host1',
+                           '--format', 'text').splitlines()
+        assert 2 == len(lines)
+        assert ['aaaaaaaaaaaa', 'serializer.dumps', '1000', '0.1000',
+                '0.1500'] == lines[1].split()[:5]
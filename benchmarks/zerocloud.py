@@ -0,0 +1,142 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Benchmarks for ``zpm deploy`` and ``zpm execute``, against the local
+ZeroCloud stand-in of ``zpmlib/tests/fakecloud.py``.
+
+Run with ``python -m benchmarks zerocloud``. Each request waits for the
+simulated ``LATENCY``, so the time of a deployment is mostly its number of
+round trips; ``post_zapp`` is limited by the simulated ``BANDWIDTH``.
+
+``deploy_memory`` deploys zapps of growing size with ``zpm --profile-memory
+deploy``, in a child process: its peak memory should not grow with them.
+"""
+
+import os
+import re
+import subprocess
+import sys
+
+from benchmarks import harness
+from zpmlib import commands
+from zpmlib import zpm
+
+sys.path.insert(0, os.path.join(harness.ROOT, 'zpmlib', 'tests'))
+import fakecloud  # noqa
+
+#: Seconds each request waits, as on a LAN.
+LATENCY = 0.002
+#: Bytes per second of each connection, a gigabit link.
+BANDWIDTH = 125 * 1000 * 1000
+UI_FILES = (10, 100)
+QUICK_UI_FILES = (10,)
+ZAPP_SIZES = (16 * 1024 * 1024, 128 * 1024 * 1024)
+QUICK_ZAPP_SIZES = (1024 * 1024,)
+PAYLOAD_SIZES = (16 * 1024 * 1024, 128 * 1024 * 1024, 512 * 1024 * 1024)
+QUICK_PAYLOAD_SIZES = (4 * 1024 * 1024, 16 * 1024 * 1024)
+ZPM = os.path.join(harness.ROOT, 'scripts', 'zpm')
+
+
+def _args(cloud, *argv):
+    return commands.set_up_arg_parser().parse_args(list(argv) + [
+        '--auth', cloud.auth_url, '--user', cloud.user, '--key', cloud.key,
+        '--log-level', 'error'])
+
+
+def _deploy(cloud, zapp):
+    args = _args(cloud, 'deploy', 'target', zapp, '--force')
+
+    def deploy():
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                zpm.deploy_project(args)
+            finally:
+                sys.stdout = stdout
+    return deploy
+
+
+def _post_job(cloud, count):
+    conn = zpm.ZeroCloudConnection(cloud.auth_url, cloud.user, cloud.key)
+    conn.authenticate()
+
+    def post_job():
+        for _ in range(count):
+            conn.post_job(fakecloud.JOB, response_dict={})
+    return post_job
+
+
+def _execute(cloud, zapp):
+    args = _args(cloud, 'execute', zapp)
+
+    def execute():
+        zpm.execute(args)
+    return execute
+
+
+def _deploy_memory(cloud, zapp):
+    argv = [sys.executable, ZPM, '--profile-memory', 'deploy', 'memory', zapp,
+            '--force', '--auth', cloud.auth_url, '--user', cloud.user,
+            '--key', cloud.key]
+    env = dict(os.environ, PYTHONPATH=harness.ROOT)
+
+    def deploy():
+        proc = subprocess.Popen(argv, env=env, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        _, err = proc.communicate()
+        # Only the latest deployment is needed.
+        cloud.containers.pop('memory', None)
+        if proc.returncode != 0:
+            raise RuntimeError(err.decode('utf-8', 'replace'))
+        peak = re.search(r'zpm: peak memory ([0-9.]+MiB)',
+                         err.decode('utf-8', 'replace'))
+        return {'traced_peak': peak.group(1)}
+    return deploy
+
+
+def benchmarks(tmpdir, quick=False):
+    cloud = fakecloud.FakeZeroCloud(latency=LATENCY,
+                                    bandwidth=BANDWIDTH).start()
+    # The server thread is a daemon, and goes away with the process.
+    result = []
+    for ui_files in QUICK_UI_FILES if quick else UI_FILES:
+        zapp = os.path.join(tmpdir, 'ui-%d.zapp' % ui_files)
+        fakecloud.write_zapp(zapp, ui_files=ui_files)
+        result.append(harness.benchmark(
+            'deploy', 'ui_files=%d' % ui_files, ui_files + 3, 'object',
+            _deploy(cloud, zapp)))
+    result.append(harness.benchmark('post_job', 'jobs=20', 20, 'job',
+                                    _post_job(cloud, 20)))
+    for size in QUICK_ZAPP_SIZES if quick else ZAPP_SIZES:
+        zapp = os.path.join(tmpdir, 'payload-%d.zapp' % size)
+        # Random data, so the zapp is as large once compressed.
+        fakecloud.write_zapp(zapp)
+        with open(zapp, 'ab') as fp:
+            fp.write(os.urandom(size))
+        result.append(harness.benchmark(
+            'post_zapp', '%dMiB' % (size >> 20), size >> 20, 'MiB',
+            _execute(cloud, zapp)))
+    for size in QUICK_PAYLOAD_SIZES if quick else PAYLOAD_SIZES:
+        zapp = os.path.join(tmpdir, 'deploy-%d.zapp' % size)
+        # Zeros: the zapp is small, but not once decompressed for upload.
+        fakecloud.write_zapp(zapp, payload_size=size)
+        result.append(harness.benchmark(
+            'deploy_memory', '%dMiB' % (size >> 20), size >> 20, 'MiB',
+            _deploy_memory(cloud, zapp), children=True))
+    return result
+
+
+if __name__ == '__main__':
+    harness.main([('zerocloud', sys.modules[__name__])])
@@ -0,0 +1,177 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Scale benchmark of ``zvapp``, running jobs of thousands of nodes against
+``fake-zerovm``.
+
+Run with ``python -m benchmarks zvapp``. :func:`make_job` writes a cluster
+map of ``map`` nodes reading an object and writing their output, each
+connected to a few ``reduce`` nodes. Each operation is a ``zvapp`` process,
+which reports the time it spent setting up the nodes with
+``--timings-json``; the benchmark also samples the file descriptors it has
+open and its resident memory.
+
+zvapp runs on Python 2, with eventlet and python-zerocloud installed; set
+``ZVAPP_PYTHON`` to the interpreter to use, ``python2`` by default. Without
+one, the suite has no benchmarks.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+
+from benchmarks import harness
+
+NODE_COUNTS = (1000, 2000, 5000, 10000)
+QUICK_NODE_COUNTS = (50,)
+#: Channels of each map node: stdin, stdout, stderr, and a network channel
+#: to each reduce node.
+CHANNELS = 8
+ZVAPP = os.path.join(harness.ROOT, 'zvapp')
+FAKE_ZEROVM = os.path.join(harness.ROOT, 'scripts', 'fake-zerovm')
+SAMPLE_INTERVAL = 0.005
+
+
+def make_job(job_file, account_dir, nodes, channels=CHANNELS):
+    """
+    Write a cluster map of ``nodes`` nodes with ``channels`` channels each,
+    and the objects it uses under ``account_dir``, for
+    ``zvapp --swift-account-path``.
+    """
+    reducers = max(channels - 3, 0)
+    for container, obj, data in [('apps', 'prog.nexe', b'\x7fELF'),
+                                 ('data', 'input', b'input\n' * 100)]:
+        path = os.path.join(account_dir, container)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        with open(os.path.join(path, obj), 'wb') as fp:
+            fp.write(data)
+    exe = {'path': 'swift://local/apps/prog.nexe'}
+    job = [{
+        'name': 'map',
+        'exec': exe,
+        'file_list': [{'device': 'stdin', 'path': 'swift://local/data/input'},
+                      {'device': 'stdout'},
+                      {'device': 'stderr'}],
+        'count': nodes - reducers,
+    }]
+    if reducers:
+        job[0]['connect'] = ['reduce']
+        job.append({'name': 'reduce', 'exec': exe,
+                    'file_list': [{'device': 'stdout'}],
+                    'count': reducers})
+    with open(job_file, 'w') as fp:
+        json.dump(job, fp, indent=2)
+
+
+class _Sampler(threading.Thread):
+    """
+    Poll the open file descriptors and the resident memory of a process,
+    from ``/proc``, until it exits.
+    """
+
+    def __init__(self, pid):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.pid = pid
+        self.done = threading.Event()
+        self.max_fds = 0
+        self.peak_rss = 0
+
+    def run(self):
+        proc = '/proc/%d' % self.pid
+        while not self.done.is_set():
+            try:
+                self.max_fds = max(self.max_fds,
+                                   len(os.listdir(os.path.join(proc, 'fd'))))
+                with open(os.path.join(proc, 'status')) as fp:
+                    for line in fp:
+                        if line.startswith('VmHWM:'):
+                            # In kB.
+                            self.peak_rss = int(line.split()[1]) * 1024
+            except (IOError, OSError):
+                pass
+            self.done.wait(SAMPLE_INTERVAL)
+
+
+def _missing(python):
+    """
+    Why ``python`` can't run zvapp, or None if it can.
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            rc = subprocess.call([python, '-c', 'import eventlet, zerocloud'],
+                                 stdout=devnull, stderr=devnull)
+    except OSError as exc:
+        return '%s: %s' % (python, exc.strerror)
+    if rc != 0:
+        return "%s can't import eventlet and zerocloud" % python
+    return None
+
+
+def _run(tmpdir, python, job_file, account_dir):
+    env = dict(os.environ)
+    # zvapp runs "zerovm" from the PATH.
+    env['PATH'] = os.pathsep.join([tmpdir, env.get('PATH', '')])
+    env['PYTHONPATH'] = harness.ROOT
+    timings_file = os.path.join(tmpdir, 'timings.json')
+
+    def run():
+        with open(os.devnull, 'w') as devnull:
+            proc = subprocess.Popen(
+                [python, ZVAPP, '--swift-account-path', account_dir,
+                 '--timings-json', timings_file, job_file],
+                cwd=tmpdir, env=env, stdout=devnull)
+            sampler = _Sampler(proc.pid)
+            sampler.start()
+            rc = proc.wait()
+            sampler.done.set()
+            sampler.join()
+        if rc != 0:
+            raise RuntimeError('zvapp failed with exit code %d' % rc)
+        with open(timings_file) as fp:
+            timings = json.load(fp)
+        return {
+            'setup_per_node_us': int(timings['setup_per_node'] * 1e6),
+            'setup_s': round(timings['setup'], 3),
+            'run_s': round(timings['run'], 3),
+            'max_fds': sampler.max_fds,
+            'peak_rss': harness._format_memory(sampler.peak_rss),
+        }
+    return run
+
+
+def benchmarks(tmpdir, quick=False):
+    python = os.environ.get('ZVAPP_PYTHON', 'python2')
+    missing = _missing(python)
+    if missing:
+        sys.stderr.write('zvapp: skipped, %s (set ZVAPP_PYTHON)\n' % missing)
+        return []
+    os.symlink(FAKE_ZEROVM, os.path.join(tmpdir, 'zerovm'))
+    result = []
+    for nodes in QUICK_NODE_COUNTS if quick else NODE_COUNTS:
+        job_file = os.path.join(tmpdir, 'job-%d.json' % nodes)
+        account_dir = os.path.join(tmpdir, 'swift')
+        make_job(job_file, account_dir, nodes)
+        result.append(harness.benchmark(
+            'zvapp_run', 'nodes=%d' % nodes, nodes, 'node',
+            _run(tmpdir, python, job_file, account_dir), children=True))
+    return result
+
+
+if __name__ == '__main__':
+    harness.main([('zvapp', sys.modules[__name__])])
@@ -79,6 +79,7 @@ setup(
         'Programming Language :: Python :: 3.4',
         'Topic :: Software Development :: Build Tools',
     ),
-    scripts=['scripts/zvsh', 'scripts/zvm', 'scripts/zpm'],
+    scripts=['scripts/zvsh', 'scripts/zvsh-trace', 'scripts/fake-zerovm',
+             'scripts/zvm', 'scripts/zpm'],
     **kwargs
 )
@@ -17,13 +17,21 @@ import logging
 import os
 import operator
 import argparse
+import sys
+import threading
 
 import zpmlib
-from zpmlib import zpm
+
+# The commands import :mod:`zpmlib.zpm`, and with it the Swift client, when
+# they run: ``zvm run``, ``zpm help`` and ``zpm version`` don't need it, and
+# start faster without it. ``python -m benchmarks.startup`` keeps track.
 
 # List of function that will be the top-level zpm commands.
 _commands = []
 
+#: Number of allocation sites shown by ``--profile-memory``.
+PROFILE_MEMORY_TOP = 10
+
 LOG = zpmlib.get_logger(__name__)
 
 
@@ -50,6 +58,10 @@ def set_up_arg_parser():
     parser.add_argument('--version', action='version',
                         help='show the version number and exit',
                         version='zpm version %s' % zpmlib.__version__)
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='trace the memory allocations of the command, '
+                             'and show its peak memory use and top '
+                             'allocation sites')
 
     subparsers = parser.add_subparsers(description='available subcommands',
                                        metavar='COMMAND')
@@ -71,6 +83,88 @@ def set_up_arg_parser():
     return parser
 
 
+def run_command(args):
+    """
+    Run the command of the parsed ``args``, under :func:`profile_memory`
+    with ``--profile-memory``, and under cProfile as ``ZEROVM_CLI_CPROFILE``
+    asks (see :mod:`zvshlib.cprofile`).
+    """
+    from zvshlib import cprofile
+    if args.profile_memory:
+        return cprofile.run(profile_memory, args.func, args)
+    return cprofile.run(args.func, args)
+
+
+class _PeakSnapshots(threading.Thread):
+    """
+    Snapshot the traced allocations each time they grow by more than a
+    tenth, to show the allocation sites near the peak rather than those
+    left at the end.
+    """
+
+    interval = 0.01
+
+    def __init__(self, tracemalloc):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.tracemalloc = tracemalloc
+        self.done = threading.Event()
+        self.size = 0
+        self.snapshot = None
+
+    def run(self):
+        while not self.done.is_set():
+            current, _ = self.tracemalloc.get_traced_memory()
+            if current > self.size * 1.1:
+                self.snapshot = self.tracemalloc.take_snapshot()
+                self.size = current
+            self.done.wait(self.interval)
+
+
+def _format_size(size):
+    return '%.1fMiB' % (size / 1048576.0)
+
+
+def profile_memory(func, args, top=PROFILE_MEMORY_TOP, out=None):
+    """
+    Call ``func(args)`` with :mod:`tracemalloc` tracing allocations, and
+    write its peak memory use and top allocation sites to ``out``, which
+    defaults to `sys.stderr`.
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        raise zpmlib.ZPMException('--profile-memory needs Python 3.4 or later')
+    out = out or sys.stderr
+    tracemalloc.start()
+    peaks = _PeakSnapshots(tracemalloc)
+    peaks.start()
+    try:
+        return func(args)
+    finally:
+        peaks.done.set()
+        peaks.join()
+        current, peak = tracemalloc.get_traced_memory()
+        if peaks.snapshot is None or current > peaks.size:
+            peaks.snapshot = tracemalloc.take_snapshot()
+            peaks.size = current
+        snapshot = peaks.snapshot
+        tracemalloc.stop()
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, pattern)
+            for pattern in (tracemalloc.__file__, '<frozen importlib*',
+                            '<unknown>')])
+        out.write('zpm: peak memory %s, %s at exit\n'
+                  % (_format_size(peak), _format_size(current)))
+        out.write('zpm: top allocation sites at %s:\n'
+                  % _format_size(peaks.size))
+        for stat in snapshot.statistics('lineno')[:top]:
+            frame = stat.traceback[0]
+            out.write('%10s %8d blocks  %s:%d\n'
+                      % (_format_size(stat.size), stat.count, frame.filename,
+                         frame.lineno))
+
+
 def command(func):
     """Register `func` as a top-level zpm command.
 
@@ -213,6 +307,8 @@ def new(args):
     created in the current directory.
     """
 
+    from zpmlib import zpm
+
     try:
         project_files = zpm.create_project(
             args.dir,
@@ -236,6 +332,8 @@ def bundle(args):
     This command creates a Zapp using the instructions in zapp.yaml.
     The file is read from the project root.
     """
+    from zpmlib import zpm
+
     root = zpm.find_project_root()
     zpm.bundle_project(root, refresh_deps=args.refresh_deps)
 
@@ -266,6 +364,8 @@ def deploy(args):
     by the Swift command line tool, so if you're already using that to
     upload files to Swift, you will be ready to go.
     """
+    from zpmlib import zpm
+
     LOG.info('deploying %s' % args.zapp)
     zpm.deploy_project(args)
 
@@ -280,6 +380,8 @@ def deploy(args):
 def execute(args):
     """Remotely execute a ZeroVM application.
     """
+    from zpmlib import zpm
+
     resp = zpm.execute(args)
     if args.summary:
         total_time, exec_table = zpm._get_exec_table(resp)
@@ -313,4 +415,6 @@ def version(args):
 @login_args
 def auth(args):
     """Get auth token and storage URL information"""
+    from zpmlib import zpm
+
     zpm.auth(args)
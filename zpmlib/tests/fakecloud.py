@@ -0,0 +1,422 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+A local stand-in for ZeroCloud, to test and benchmark ``zpm deploy`` and
+``zpm execute`` without a Swift cluster.
+
+:class:`FakeZeroCloud` serves, from memory:
+
+* v1 auth: ``GET /auth/v1.0`` with ``X-Auth-User`` and ``X-Auth-Key``,
+* container ``PUT`` and ``GET`` (JSON listings, with ``marker`` and
+  ``limit``),
+* object ``PUT``, ``GET`` and ``HEAD``,
+* ``POST`` to the account with ``X-Zerovm-Execute``, which answers with the
+  configured ``x-nexe-*`` headers and output instead of running anything.
+
+Every request waits ``latency`` seconds before it is answered, and request
+and response bodies move at ``bandwidth`` bytes per second on each
+connection. Run it by itself with ``python zpmlib/tests/fakecloud.py``.
+"""
+
+import argparse
+import hashlib
+import json
+import socket
+import tarfile
+import threading
+import time
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, unquote, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import parse_qs, urlparse
+try:
+    from cStringIO import StringIO as BytesIO
+except ImportError:
+    from io import BytesIO
+
+ACCOUNT = 'AUTH_test'
+USER = 'test:tester'
+KEY = 'testing'
+CHUNK_SIZE = 65536
+#: Seconds to wait for each line of a chunked body.
+CHUNKED_TIMEOUT = 2
+LISTING_LIMIT = 10000
+
+#: Headers of the answer to a job, for a job of one node; ``x-nexe-*``
+#: headers given to :class:`FakeZeroCloud` are added or replace these.
+NEXE_HEADERS = {
+    'x-nexe-system': 'node-1',
+    'x-nexe-status': 'ok.',
+    'x-nexe-retcode': '0',
+    'x-nexe-etag': 'disabled',
+    'x-nexe-validation': '0',
+    'x-nexe-cdr-line': '0.250, 0.200, 0.01 0.02 1 4096 2 8192 0 0 0 0',
+}
+
+
+ZAPP_YAML = """\
+execution:
+  groups:
+    - name: "hello"
+      path: file://python2.7:python
+      args: "hello.py"
+      devices:
+      - name: python
+      - name: stdout
+meta:
+  Version: ""
+  name: "hello"
+  Author-email: ""
+  Summary: ""
+help:
+  description: ""
+  args:
+  - ["", ""]
+bundling:
+  - "hello.py"
+ui:
+  - "index.html"
+  - "ui/*"
+"""
+
+JOB = [{'exec': {'args': 'hello.py', 'path': 'file://python2.7:python'},
+        'devices': [{'name': 'python'}, {'name': 'stdout'}],
+        'name': 'hello'}]
+
+
+def write_zapp(file_name, ui_files=0, payload_size=0):
+    """
+    Write a zapp to deploy, with an ``index.html``, ``ui_files`` more UI
+    files, half of them templates, and ``payload_size`` bytes of data.
+    """
+    files = [
+        ('zapp.yaml', ZAPP_YAML.encode('utf-8')),
+        ('boot/system.map', json.dumps(JOB).encode('utf-8')),
+        ('hello.py', b'print("Hello from ZeroVM!")\n'),
+        ('index.html', b'<html><body>Hello!</body></html>'),
+        ('data.bin', b'\0' * payload_size),
+    ]
+    for i in range(ui_files):
+        if i % 2:
+            files.append(('ui/%04d.js.tmpl' % i,
+                          b'var opts = {{ auth_opts }};'))
+        else:
+            files.append(('ui/%04d.css' % i, b'body { margin: 0; }'))
+    tar = tarfile.open(file_name, 'w:gz')
+    for name, data in files:
+        info = tarfile.TarInfo(name=name)
+        info.size = len(data)
+        tar.addfile(info, BytesIO(data))
+    tar.close()
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, as Swift does, so reusing connections can be measured.
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately: without this, Nagle's
+    # algorithm and delayed ACKs add 40ms to the answers with a body.
+    disable_nagle_algorithm = True
+
+    @property
+    def cloud(self):
+        return self.server.cloud
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _throttle(self, nbytes):
+        if self.cloud.bandwidth:
+            time.sleep(float(nbytes) / self.cloud.bandwidth)
+
+    def _read_body(self):
+        # Transfer-Encoding wins over Content-Length (RFC 7230, 3.3.3). A
+        # malformed chunked body gives None.
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            # A body that isn't chunked may never give the line end of a
+            # chunk size.
+            self.connection.settimeout(CHUNKED_TIMEOUT)
+            try:
+                return self._read_chunked()
+            except (ValueError, socket.timeout):
+                return None
+            finally:
+                self.connection.settimeout(None)
+        return self._read(int(self.headers.get('Content-Length') or 0))
+
+    def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            if size == 0:
+                self.rfile.readline()
+                break
+            chunks.append(self._read(size))
+            self.rfile.readline()
+        return b''.join(chunks)
+
+    def _read(self, size):
+        chunks = []
+        while size > 0:
+            chunk = self.rfile.read(min(size, CHUNK_SIZE))
+            if not chunk:
+                break
+            self._throttle(len(chunk))
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def _respond(self, status, body=b'', headers=None, send_body=True):
+        headers = dict(headers or {})
+        headers.setdefault('Content-Type', 'text/plain; charset=utf-8')
+        self.send_response(status)
+        for key, value in sorted(headers.items()):
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            for i in range(0, len(body), CHUNK_SIZE):
+                chunk = body[i:i + CHUNK_SIZE]
+                self._throttle(len(chunk))
+                self.wfile.write(chunk)
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        self.cloud._record(method, url.path)
+        if self.cloud.latency:
+            time.sleep(self.cloud.latency)
+        # Read the body first, whatever the answer: the connection is kept.
+        body = self._read_body() if method in ('PUT', 'POST') else b''
+        if body is None:
+            # The rest of the body can't be told from the next request.
+            self.close_connection = True
+            return self._respond(400, b'Bad Request')
+        parts = [unquote(part) for part in url.path.split('/')[1:]]
+        if parts[:1] == ['auth']:
+            return self._auth()
+        if (parts[:2] != ['v1', ACCOUNT]
+                or self.headers.get('X-Auth-Token') != self.cloud.token):
+            return self._respond(401, b'Unauthorized')
+        container = parts[2] if len(parts) > 2 else ''
+        obj = '/'.join(parts[3:])
+        if not container:
+            if method == 'POST' and self.headers.get('X-Zerovm-Execute'):
+                return self._execute(body)
+            return self._respond(405, b'Method Not Allowed')
+        if not obj:
+            return self._container(method, container, parse_qs(url.query))
+        return self._object(method, container, obj, body)
+
+    def _auth(self):
+        user = (self.headers.get('X-Auth-User')
+                or self.headers.get('X-Storage-User'))
+        key = (self.headers.get('X-Auth-Key')
+               or self.headers.get('X-Storage-Pass'))
+        if (user, key) != (self.cloud.user, self.cloud.key):
+            return self._respond(401, b'Unauthorized')
+        with self.cloud.lock:
+            self.cloud.auth_requests += 1
+        self._respond(200, headers={'X-Storage-Url': self.cloud.storage_url,
+                                    'X-Auth-Token': self.cloud.token,
+                                    'X-Storage-Token': self.cloud.token})
+
+    def _container(self, method, container, query):
+        objects = self.cloud.containers.get(container)
+        if method == 'PUT':
+            if objects is None:
+                self.cloud.containers[container] = {}
+                return self._respond(201)
+            return self._respond(202)
+        if method not in ('GET', 'HEAD'):
+            return self._respond(405, b'Method Not Allowed')
+        if objects is None:
+            return self._respond(404, b'Not Found')
+        marker = query.get('marker', [''])[0]
+        limit = int(query.get('limit', [LISTING_LIMIT])[0])
+        names = sorted(name for name in objects if name > marker)[:limit]
+        listing = [{'name': name,
+                    'bytes': len(objects[name][0]),
+                    'hash': hashlib.md5(objects[name][0]).hexdigest(),
+                    'content_type': objects[name][1]}
+                   for name in names]
+        headers = {'Content-Type': 'application/json; charset=utf-8',
+                   'X-Container-Object-Count': str(len(objects))}
+        self._respond(200, json.dumps(listing).encode('utf-8'), headers,
+                      send_body=method == 'GET')
+
+    def _object(self, method, container, obj, body):
+        objects = self.cloud.containers.get(container)
+        if objects is None:
+            return self._respond(404, b'Not Found')
+        if method == 'PUT':
+            content_type = self.headers.get('Content-Type',
+                                            'application/octet-stream')
+            objects[obj] = (body, content_type)
+            return self._respond(201, headers={
+                'Etag': hashlib.md5(body).hexdigest()})
+        if method not in ('GET', 'HEAD'):
+            return self._respond(405, b'Method Not Allowed')
+        if obj not in objects:
+            return self._respond(404, b'Not Found')
+        data, content_type = objects[obj]
+        self._respond(200, data, {'Content-Type': content_type,
+                                  'Etag': hashlib.md5(data).hexdigest()},
+                      send_body=method == 'GET')
+
+    def _execute(self, body):
+        with self.cloud.lock:
+            self.cloud.jobs.append((self.headers.get('Content-Type'),
+                                    len(body)))
+        headers = dict(NEXE_HEADERS, **self.cloud.nexe_headers)
+        self._respond(200, self.cloud.output, headers)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_HEAD(self):
+        self._dispatch('HEAD')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+
+class FakeZeroCloud(object):
+    """
+    A ZeroCloud stand-in, serving from a thread on ``127.0.0.1``.
+
+    Use it as a context manager, or :meth:`start` and :meth:`stop` it.
+
+    :param latency:
+        Seconds to wait before answering each request.
+    :param bandwidth:
+        Bytes per second at which bodies move on each connection, or None
+        for no limit.
+    :param nexe_headers:
+        `dict` of ``x-nexe-*`` headers answering jobs, see
+        :data:`NEXE_HEADERS`.
+    :param output:
+        Body answering jobs, the output of the job.
+    :param port:
+        Port to listen on; by default, any free port.
+    """
+
+    def __init__(self, latency=0, bandwidth=None, nexe_headers=None,
+                 output=b'hello\n', port=0, user=USER, key=KEY):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.nexe_headers = dict(nexe_headers or {})
+        self.output = output
+        self.user = user
+        self.key = key
+        self.token = 'AUTH_tk' + hashlib.md5(key.encode('utf-8')).hexdigest()
+        self.lock = threading.Lock()
+        #: `dict` of container names to `dict` of object names to
+        #: (data, content type) tuples.
+        self.containers = {}
+        #: (method, path) of each request received.
+        self.requests = []
+        #: (content type, body size) of each job posted.
+        self.jobs = []
+        self.auth_requests = 0
+        self.server = _Server(('127.0.0.1', port), _Handler)
+        self.server.cloud = self
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    @property
+    def auth_url(self):
+        return self.url + '/auth/v1.0'
+
+    @property
+    def storage_url(self):
+        return '%s/v1/%s' % (self.url, ACCOUNT)
+
+    def _record(self, method, path):
+        with self.lock:
+            self.requests.append((method, path))
+
+    def count(self, method):
+        """
+        Number of ``method`` requests received, auth included.
+        """
+        with self.lock:
+            return sum(1 for request in self.requests if request[0] == method)
+
+    def reset(self):
+        """
+        Forget the requests and jobs received, but not the objects stored.
+        """
+        with self.lock:
+            del self.requests[:]
+            del self.jobs[:]
+            self.auth_requests = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a fake ZeroCloud')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds to wait before answering requests')
+    parser.add_argument('--bandwidth', type=int,
+                        help='bytes per second on each connection')
+    parser.add_argument('--nexe-header', action='append', default=[],
+                        metavar='NAME=VALUE',
+                        help='x-nexe-* header answering jobs')
+    args = parser.parse_args(argv)
+    nexe_headers = dict(header.split('=', 1) for header in args.nexe_header)
+    cloud = FakeZeroCloud(latency=args.latency, bandwidth=args.bandwidth,
+                          nexe_headers=nexe_headers, port=args.port)
+    print('export ST_AUTH=%s ST_USER=%s ST_KEY=%s'
+          % (cloud.auth_url, cloud.user, cloud.key))
+    try:
+        cloud.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -2,25 +2,27 @@
 Main help text is shown when no command is given:
 
   $ zpm help
-  usage: zpm [-h] [--version] COMMAND ...
+  usage: zpm [-h] [--version] [--profile-memory] COMMAND ...
   
   ZeroVM Package Manager
   
   optional arguments:
-    -h, --help  show this help message and exit
-    --version   show the version number and exit
+    -h, --help        show this help message and exit
+    --version         show the version number and exit
+    --profile-memory  trace the memory allocations of the command, and show its
+                      peak memory use and top allocation sites
   
   subcommands:
     available subcommands
   
     COMMAND
-      auth      Get auth token and storage URL information
-      bundle    Bundle a ZeroVM application
-      deploy    Deploy a ZeroVM application
-      execute   Remotely execute a ZeroVM application.
-      help      Show this help
-      new       Create template zapp.yaml file
-      version   Show the version number
+      auth            Get auth token and storage URL information
+      bundle          Bundle a ZeroVM application
+      deploy          Deploy a ZeroVM application
+      execute         Remotely execute a ZeroVM application.
+      help            Show this help
+      new             Create template zapp.yaml file
+      version         Show the version number
   
   See 'zpm <command> --help' for more information on a specific command.
 
@@ -52,25 +54,27 @@ Test with non-existing command:
 
   $ zpm help no-such-command
   no such command: no-such-command
-  usage: zpm [-h] [--version] COMMAND ...
+  usage: zpm [-h] [--version] [--profile-memory] COMMAND ...
   
   ZeroVM Package Manager
   
   optional arguments:
-    -h, --help  show this help message and exit
-    --version   show the version number and exit
+    -h, --help        show this help message and exit
+    --version         show the version number and exit
+    --profile-memory  trace the memory allocations of the command, and show its
+                      peak memory use and top allocation sites
   
   subcommands:
     available subcommands
   
     COMMAND
-      auth      Get auth token and storage URL information
-      bundle    Bundle a ZeroVM application
-      deploy    Deploy a ZeroVM application
-      execute   Remotely execute a ZeroVM application.
-      help      Show this help
-      new       Create template zapp.yaml file
-      version   Show the version number
+      auth            Get auth token and storage URL information
+      bundle          Bundle a ZeroVM application
+      deploy          Deploy a ZeroVM application
+      execute         Remotely execute a ZeroVM application.
+      help            Show this help
+      new             Create template zapp.yaml file
+      version         Show the version number
   
   See 'zpm <command> --help' for more information on a specific command.
 
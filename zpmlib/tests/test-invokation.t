@@ -2,6 +2,6 @@
 Invokation with no arguments fails with a nice error message:
 
   $ zpm
-  usage: zpm [-h] [--version] COMMAND ...
+  usage: zpm [-h] [--version] [--profile-memory] COMMAND ...
   zpm: error: too few arguments
   [2]
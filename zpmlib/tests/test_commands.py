@@ -12,6 +12,12 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import os
+import subprocess
+import sys
+
+from io import StringIO
+
 import mock
 
 from zpmlib import commands
@@ -36,3 +42,38 @@ def test_swift_log_filter():
 
     assert log_filter.filter(record) is True
     assert log_filter.filter(filtered_record) is False
+
+
+def test_commands_import_lazily():
+    # zvm run, zpm help and zpm version must not pay for the Swift client,
+    # nor for cProfile hooks they may not use.
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    code = ('import sys; from zpmlib import commands; '
+            'print(sorted(set(sys.modules) & set(%r)))'
+            % (['zpmlib.zpm', 'swiftclient', 'jinja2', 'yaml',
+                'zvshlib.cprofile'],))
+    env = dict(os.environ, PYTHONPATH=root)
+    # No check_output on Python 2.6.
+    proc = subprocess.Popen([sys.executable, '-c', code], env=env,
+                            stdout=subprocess.PIPE)
+    output, _ = proc.communicate()
+    assert 0 == proc.returncode
+    assert b'[]' == output.strip()
+
+
+def test_profile_memory():
+    kept = []
+
+    def func(args):
+        # Kept alive past the call, so that the snapshot profile_memory
+        # takes as it returns has them, whenever its thread last sampled.
+        kept.append([bytearray(1024) for _ in range(args)])
+        return len(kept[0])
+
+    out = StringIO()
+    assert 1000 == commands.profile_memory(func, 1000, top=3, out=out)
+    lines = out.getvalue().splitlines()
+    assert lines[0].startswith('zpm: peak memory ')
+    assert 5 == len(lines)
+    assert any(__file__.rstrip('c') in line for line in lines[2:])
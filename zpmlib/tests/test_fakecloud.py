@@ -0,0 +1,178 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Tests of ``zpm deploy`` and ``zpm execute`` against
+:class:`fakecloud.FakeZeroCloud`, guarding the number of requests they
+make and that they stream.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from io import BytesIO
+
+import pytest
+try:
+    from http.client import HTTPConnection
+    from urllib.parse import urlparse
+except ImportError:
+    from httplib import HTTPConnection
+    from urlparse import urlparse
+
+import fakecloud
+from zpmlib import commands
+from zpmlib import zpm
+
+
+class TestFakeZeroCloud:
+    """
+    Tests for ``zpm`` against :class:`fakecloud.FakeZeroCloud`.
+    """
+
+    def setup_method(self, _method):
+        self.tempdir = tempfile.mkdtemp()
+        self.zapp = os.path.join(self.tempdir, 'hello.zapp')
+        fakecloud.write_zapp(self.zapp, ui_files=4)
+        self.cloud = fakecloud.FakeZeroCloud().start()
+
+    def teardown_method(self, _method):
+        self.cloud.stop()
+        shutil.rmtree(self.tempdir)
+
+    def _args(self, *argv):
+        parser = commands.set_up_arg_parser()
+        return parser.parse_args(list(argv) + [
+            '--auth', self.cloud.auth_url, '--user', self.cloud.user,
+            '--key', self.cloud.key])
+
+    def _connection(self):
+        conn = zpm.ZeroCloudConnection(self.cloud.auth_url, self.cloud.user,
+                                       self.cloud.key)
+        conn.authenticate()
+        return conn
+
+    def test_auth(self):
+        with pytest.raises(zpm.swiftclient.ClientException):
+            zpm.ZeroCloudConnection(self.cloud.auth_url, self.cloud.user,
+                                    'wrong', retries=0).authenticate()
+        conn = self._connection()
+        assert self.cloud.storage_url == conn.url
+        assert 1 == self.cloud.auth_requests
+
+    def test_deploy(self):
+        zpm.deploy_project(self._args('deploy', 'target', self.zapp))
+
+        objects = self.cloud.containers['target']
+        assert ['boot/system.map', 'hello.zapp', 'index.html', 'ui/0000.css',
+                'ui/0001.js', 'ui/0002.css', 'ui/0003.js'] == sorted(objects)
+        job = json.loads(objects['boot/system.map'][0].decode('utf-8'))
+        assert ('swift://AUTH_test/target/hello.zapp'
+                == job[0]['devices'][-1]['path'])
+        assert b'{{' not in objects['ui/0001.js'][0]
+        # One auth, a container GET, its PUT, and a PUT per object.
+        assert 1 == self.cloud.auth_requests
+        assert 1 == self.cloud.count('GET') - self.cloud.auth_requests
+        assert len(objects) + 1 == self.cloud.count('PUT')
+
+    def test_deploy_execute(self, capsys):
+        self.cloud.output = b'Hello from ZeroVM!\n'
+        zpm.deploy_project(self._args('deploy', 'target', self.zapp,
+                                      '--execute'))
+
+        assert capsys.readouterr()[0].endswith('\nHello from ZeroVM!\n')
+        # The execution reuses the token of the deployment.
+        assert 1 == self.cloud.auth_requests
+        assert [('application/json',
+                 len(self.cloud.containers['target']['boot/system.map'][0]))
+                ] == self.cloud.jobs
+
+    def test_execute_container(self):
+        self.cloud.nexe_headers = {'x-nexe-system': 'node-1,node-2',
+                                   'x-nexe-status': 'ok.,ok.',
+                                   'x-nexe-retcode': '0,1',
+                                   'x-nexe-cdr-line': (
+                                       '1.5, 1.0, 0.1 0.2 1 2 3 4 5 6 7 8, '
+                                       '0.5, 0.3 0.4 1 2 3 4 5 6 7 8')}
+        zpm.deploy_project(self._args('deploy', 'target', self.zapp))
+        self.cloud.reset()
+
+        output = BytesIO()
+        resp = zpm.execute(self._args('execute', '--container', 'target',
+                                      'hello'),
+                           response_body_buffer=output)
+        assert 200 == resp['status']
+        assert b'hello\n' == output.getvalue()
+        total_time, table = zpm._get_exec_table(resp)
+        assert '1.5' == total_time
+        assert 2 == len(table._rows)
+        # Auth, the job description, and the job.
+        assert [('GET', '/auth/v1.0'),
+                ('GET', '/v1/AUTH_test/target/boot/system.map'),
+                ('POST', '/v1/AUTH_test')] == self.cloud.requests
+
+    def test_execute_zapp(self):
+        fakecloud.write_zapp(self.zapp, payload_size=4 * zpm.BUFFER_SIZE)
+        resp = zpm.execute(self._args('execute', self.zapp))
+        assert 200 == resp['status']
+        assert [('application/x-gzip', os.path.getsize(self.zapp))
+                ] == self.cloud.jobs
+
+    def test_post_job_latency(self):
+        conn = self._connection()
+        self.cloud.latency = 0.05
+        start = time.time()
+        conn.post_job(fakecloud.JOB, response_dict={})
+        conn.post_job(fakecloud.JOB, response_dict={})
+        assert time.time() - start >= 0.1
+        assert 1 == self.cloud.auth_requests
+
+    def test_post_zapp_bandwidth(self):
+        conn = self._connection()
+        self.cloud.bandwidth = 1024 * 1024
+        resp = {}
+        start = time.time()
+        conn.post_zapp(BytesIO(b'\0' * 4 * 65536), response_dict=resp,
+                       content_length=4 * 65536)
+        assert time.time() - start >= 0.25
+        assert 200 == resp['status']
+        assert [('application/x-gzip', 4 * 65536)] == self.cloud.jobs
+
+    def test_transfer_encoding(self):
+        conn = self._connection()
+        token = {'X-Auth-Token': conn.token}
+        path = urlparse(self.cloud.storage_url).path
+        # Chunked, Transfer-Encoding wins over Content-Length.
+        http = HTTPConnection(urlparse(self.cloud.url).netloc)
+        http.request('PUT', path + '/target', headers=token)
+        http.getresponse().read()
+        http.request('PUT', path + '/target/hello',
+                     body=b'5\r\nhello\r\n0\r\n\r\n',
+                     headers=dict(token, **{'Transfer-Encoding': 'chunked',
+                                            'Content-Length': '15'}))
+        resp = http.getresponse()
+        resp.read()
+        assert 201 == resp.status
+        assert b'hello' == self.cloud.containers['target']['hello'][0]
+        # Not chunked after all.
+        http.request('POST', path, body=b'hello',
+                     headers=dict(token, **{'Transfer-Encoding': 'chunked',
+                                            'Content-Length': '5',
+                                            'X-Zerovm-Execute': '1.0'}))
+        assert 400 == http.getresponse().status
+        assert [] == self.cloud.jobs
+        http.close()
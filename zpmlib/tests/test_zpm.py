@@ -376,9 +376,13 @@ print("Hello from ZeroVM!")
         )
 
     def test__generate_uploads(self):
-        uploads = zpm._generate_uploads(self.conn, self.target,
-                                        self.zapp_path, self.auth_opts)
-        uploads = list(uploads)
+        uploads = []
+        for path, data, content_type in zpm._generate_uploads(
+                self.conn, self.target, self.zapp_path, self.auth_opts):
+            if hasattr(data, 'read'):
+                # The zapp is streamed from its file.
+                data = data.read()
+            uploads.append((path, data, content_type))
 
         foojs_tmpl = jinja2.Template(self.foojstmpl_contents.decode())
         foojs = foojs_tmpl.render(auth_opts=self.auth_opts)
@@ -22,7 +22,6 @@ of a 'dir').
 
 
 import os
-import jinja2
 
 TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
 _DEFAULT_UI_TEMPLATES = ['index.html.tmpl', 'style.css', 'zerocloud.js']
@@ -51,6 +50,8 @@ def template(location, template, with_ui):
 def render_zapp_yaml(name, template_name=_PYTHON_ZAPP_YAML):
     # TODO: wtf is `name`?
     """Load and render the zapp.yaml template."""
+    import jinja2
+
     loader = jinja2.PackageLoader('zpmlib', 'templates')
     env = jinja2.Environment(loader=loader)
     tmpl = env.get_template(template_name)
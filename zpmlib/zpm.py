@@ -29,16 +29,13 @@ try:
 except ImportError:
     from io import BytesIO
 
-import jinja2
-import prettytable
-import six
 import swiftclient
-import yaml
 
 import zpmlib
 from zpmlib import util
 from zpmlib import zappbundler
 from zpmlib import zapptemplate
+from zvshlib import serializer
 
 _DEFAULT_UI_TEMPLATES = ['index.html.tmpl', 'style.css', 'zerocloud.js']
 _ZAPP_YAML = 'python-zapp.yaml'
@@ -140,12 +137,6 @@ def _generate_job_desc(zapp):
     """
     job = []
 
-    # TODO(mg): we should eventually reuse zvsh._nvram_escape
-    def escape(value):
-        for c in '\\", \n':
-            value = value.replace(c, '\\x%02x' % ord(c))
-        return value
-
     def translate_args(cmdline):
         # On Python 2, the yaml module loads non-ASCII strings as
         # unicode objects. In Python 2.7.2 and earlier, we must give
@@ -157,7 +148,7 @@ def _generate_job_desc(zapp):
         args = shlex.split(cmdline)
         if need_decode:
             args = [arg.decode('utf8') for arg in args]
-        return ' '.join(escape(arg) for arg in args)
+        return ' '.join(serializer.escape(arg) for arg in args)
 
     for zgroup in zapp['execution']['groups']:
         # Copy everything, but handle 'env', 'path', and 'args' specially:
@@ -275,6 +266,8 @@ def bundle_project(root, refresh_deps=False):
     """
     Bundle the project under root.
     """
+    import yaml
+
     zapp_yaml = os.path.join(root, 'zapp.yaml')
     zapp = yaml.safe_load(open(zapp_yaml))
 
@@ -358,13 +351,15 @@ def _find_ui_uploads(zapp, tar):
 
 def _post_job(url, token, data, http_conn=None, response_dict=None,
               content_type='application/json', content_length=None,
-              response_body_buffer=None):
+              response_body_buffer=None, service_token=None):
     # Modelled after swiftclient.client.post_account.
     headers = {'X-Auth-Token': token,
                'X-Zerovm-Execute': '1.0',
                'Content-Type': content_type}
     if content_length:
         headers['Content-Length'] = str(content_length)
+    if service_token:
+        headers['X-Service-Token'] = service_token
 
     if http_conn:
         parsed, conn = http_conn
@@ -493,6 +488,9 @@ def _generate_uploads(conn, target, zapp_path, auth_opts):
     """Generate sequence of (container-and-file-path, data, content-type)
     tuples.
     """
+    import jinja2
+    import yaml
+
     tar = tarfile.open(zapp_path, 'r:gz')
     zapp_config = yaml.safe_load(tar.extractfile('zapp.yaml'))
 
@@ -500,7 +498,12 @@ def _generate_uploads(conn, target, zapp_path, auth_opts):
     swift_url = _get_swift_zapp_url(conn.url, remote_zapp_path)
     job = _prepare_job(tar, zapp_config, swift_url)
 
-    yield (remote_zapp_path, gzip.open(zapp_path).read(), 'application/x-tar')
+    # Stream the decompressed zapp rather than holding it all in memory.
+    zapp_file = gzip.open(zapp_path)
+    try:
+        yield (remote_zapp_path, zapp_file, 'application/x-tar')
+    finally:
+        zapp_file.close()
     yield ('%s/%s' % (target, SYSTEM_MAP_ZAPP_PATH), json.dumps(job),
            'application/json')
 
@@ -624,6 +627,8 @@ def _guess_auth_version(args):
 
 
 def deploy_project(args):
+    import jinja2
+
     conn = _get_zerocloud_conn(args)
     conn.authenticate()
     ui_auth_version = conn.auth_version
@@ -644,7 +649,9 @@ def deploy_project(args):
         # for compatibility with the option name in 'zpm execute'
         args.container = args.target
         resp_body_buffer = BytesIO()
-        resp = execute(args, response_body_buffer=resp_body_buffer)
+        # Reuse the connection, and its token.
+        resp = execute(args, response_body_buffer=resp_body_buffer,
+                       conn=conn)
         resp_body_buffer.seek(0)
 
         if resp['status'] < 200 or resp['status'] >= 300:
@@ -656,7 +663,9 @@ def deploy_project(args):
             print(exec_table)
             print('Total time: %s' % total_time)
 
-        sys.stdout.write(resp_body_buffer.read())
+        # The output is bytes: on Python 3, write it to the binary buffer.
+        getattr(sys.stdout, 'buffer', sys.stdout).write(
+            resp_body_buffer.read())
 
 
 def _get_exec_table(resp):
@@ -671,6 +680,8 @@ def _get_exec_table(resp):
         ``prettytable.PrettyTable`` containing the summary of all node
         executions in the job.
     """
+    import prettytable
+
     headers = resp['headers']
     total_time, table_data = _get_exec_table_data(headers)
 
@@ -721,7 +732,7 @@ def _get_exec_table_data(headers):
     total_time = cdr_data.pop(0)
     cdr_data = iter(cdr_data)
 
-    adviter = lambda x: six.advance_iterator(x)
+    adviter = next
 
     table_data = []
     while True:
@@ -738,14 +749,18 @@ def _get_exec_table_data(headers):
     return total_time, table_data
 
 
-def execute(args, response_body_buffer=None):
+def execute(args, response_body_buffer=None, conn=None):
     """Execute a zapp remotely on a ZeroCloud deployment.
 
+    :param conn:
+        Authenticated :class:`ZeroCloudConnection` to use; by default, a new
+        one is made from the ``args``.
     :returns:
         A `dict` with response data, including the keys 'status', 'reason', and
         'headers'.
     """
-    conn = _get_zerocloud_conn(args)
+    if conn is None:
+        conn = _get_zerocloud_conn(args)
 
     resp = dict()
     if args.container:
@@ -765,11 +780,13 @@ def execute(args, response_body_buffer=None):
         LOG.debug('RESP HEADERS: %s', resp['headers'])
     else:
         size = os.path.getsize(args.zapp)
-        zapp_file = open(args.zapp, 'rb')
-        data_reader = iter(lambda: zapp_file.read(BUFFER_SIZE), b'')
-        conn.post_zapp(data_reader, response_dict=resp, content_length=size,
-                       response_body_buffer=response_body_buffer)
-        zapp_file.close()
+        # A file, not an iterator: given an iterator, requests adds
+        # "Transfer-Encoding: chunked" to the Content-Length, but sends the
+        # body as is.
+        with open(args.zapp, 'rb') as zapp_file:
+            conn.post_zapp(zapp_file, response_dict=resp,
+                           content_length=size,
+                           response_body_buffer=response_body_buffer)
     return resp
 
 
@@ -37,7 +37,9 @@ def set_up_arg_parser():
     'command',
     help=('Zvsh command, can be:\n'
           '- path to ZeroVM executable\n'
-          '- "gdb" (for running debugger)\n'),
+          '- "gdb" (for running debugger)\n'
+          'Not needed with --zvm-replay\n'),
+    nargs='?',
 )
 @commands.arg(
     '--zvm-image',
@@ -73,6 +75,79 @@ def set_up_arg_parser():
           'directory will be created/re-created\n'),
     action='store',
 )
+@commands.arg(
+    '--zvm-nodes',
+    help=('Run this many copies of the program side by side, with Node ids '
+          '1..N\n'),
+    type=int,
+    default=1,
+)
+@commands.arg(
+    '--zvm-save-runs',
+    help=('Save the files of each run into a new timestamped directory\n'
+          'inside --zvm-save-dir\n'),
+    action='store_true',
+)
+@commands.arg(
+    '--zvm-save-keep',
+    help='With --zvm-save-runs, only keep the files of this many runs\n',
+    type=int,
+)
+@commands.arg(
+    '--zvm-autosize',
+    help=('Set Memory, Timeout and the channel limits from the profile\n'
+          'of earlier runs of the same program and arguments\n'),
+    action='store_true',
+)
+@commands.arg(
+    '--zvm-stats',
+    help=('Append the timings, resource usage and report of the run to\n'
+          'this file, as one line of JSON\n'),
+    action='store',
+)
+@commands.arg(
+    '--zvm-profile',
+    help=('Write the time spent in each phase of the run to this file\n'
+          '(or a new file in this directory), as Chrome trace JSON;\n'
+          'also set by the ZVSH_PROFILE environment variable\n'),
+    action='store',
+)
+@commands.arg(
+    '--zvm-bench',
+    help=('Run the program this many times, discarding its output, and\n'
+          'print statistics of the wall time, ZeroVM CPU time and zvsh\n'
+          'overhead of the runs\n'),
+    type=int,
+)
+@commands.arg(
+    '--zvm-warmup',
+    help='With --zvm-bench, first run the program this many times\n',
+    type=int,
+    default=0,
+)
+@commands.arg(
+    '--zvm-bench-csv',
+    help='With --zvm-bench, write the measures of each run to this CSV file\n',
+    action='store',
+)
+@commands.arg(
+    '--zvm-record',
+    help=('Record the run into this directory, with snapshots of its nexe,\n'
+          'images, file channels and stdin, so it can be replayed\n'),
+    action='store',
+)
+@commands.arg(
+    '--zvm-replay',
+    help=('Run the recording in this directory again, and warn if the\n'
+          'output differs from the recorded output\n'),
+    action='store',
+)
+@commands.arg(
+    '--zvm-no-cache',
+    help=('Don\'t use the result and run plan caches, even if they are\n'
+          'enabled in zvsh.cfg\n'),
+    action='store_true',
+)
 @commands.arg(
     'cmd_args',
     help='command line arguments\n',
@@ -87,5 +162,11 @@ def run(args):
     # In this case, there are instead two: `zvm run`.
     # So we need to trim off `zvm` in order to keep the same behavior, without
     # changing the zvsh code.
+    if args.command is None and not args.zvm_replay:
+        raise RuntimeError('A command is required, unless --zvm-replay is '
+                           'given')
+    conflict = zvsh.conflicting_options(args)
+    if conflict:
+        raise RuntimeError(conflict)
     shell = zvsh.Shell(sys.argv[1:], args=args)
     shell.run()
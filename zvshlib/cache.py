@@ -0,0 +1,539 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+On-disk caches used by zvsh to avoid repeating work between runs.
+
+All caches live below a single cache directory (``[cache] path`` in
+zvsh.cfg). Entries are written to a temporary name first and then renamed
+into place, so concurrent zvsh processes never see partially written data.
+"""
+
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import stat
+import tarfile
+
+from tempfile import mkdtemp, mkstemp
+
+#: Size of the chunks read when hashing files.
+DIGEST_BUFFER_SIZE = 65536
+#: ioctl request cloning a file on copy-on-write file systems (Linux).
+FICLONE = 0x40049409
+
+
+def _makedirs(dir_path):
+    try:
+        os.makedirs(dir_path)
+    except OSError as err:
+        if err.errno != errno.EEXIST or not os.path.isdir(dir_path):
+            raise
+
+
+def _atomic_write(file_path, data):
+    """
+    Write ``data`` (`bytes`) to ``file_path`` by way of a temporary file in
+    the same directory, so readers see either the old or the new contents.
+    """
+    fd, tmp_path = mkstemp(dir=os.path.dirname(file_path))
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+    os.rename(tmp_path, file_path)
+
+
+def clone_file(src, dst):
+    """
+    Copy ``src`` to ``dst``, sharing the data blocks of the two files if the
+    file system supports copy-on-write clones (btrfs, XFS, ...).
+    """
+    with open(src, 'rb') as src_fp:
+        with open(dst, 'wb') as dst_fp:
+            try:
+                fcntl.ioctl(dst_fp.fileno(), FICLONE, src_fp.fileno())
+                return
+            except (IOError, OSError):
+                pass
+            shutil.copyfileobj(src_fp, dst_fp)
+
+
+def find_executable(name):
+    """
+    Find the full path of the executable ``name`` on the ``PATH``, or `None`
+    if there is no such executable.
+    """
+    if os.path.dirname(name):
+        candidates = [name]
+    else:
+        candidates = [os.path.join(dir_path, name) for dir_path in
+                      os.environ.get('PATH', os.defpath).split(os.pathsep)]
+    for candidate in candidates:
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return os.path.abspath(candidate)
+    return None
+
+
+def is_trusted(file_path):
+    """
+    Check that ``file_path`` and its directory can only be modified by the
+    current user or root: both must be owned by one of them and neither may
+    be writable by group or others.
+    """
+    for each in (file_path, os.path.dirname(os.path.abspath(file_path))):
+        try:
+            st = os.stat(each)
+        except OSError:
+            return False
+        if st.st_uid not in (0, os.geteuid()):
+            return False
+        if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            return False
+    return True
+
+
+def _evict(entries_dir, marker, max_size):
+    """
+    Remove the least recently used entries of a cache until the total size
+    of the entries is at most ``max_size`` bytes. Entries are the
+    directories below ``entries_dir`` which contain a file named ``marker``;
+    their mtime tells when they were last used.
+    """
+    entries = []
+    total = 0
+    for root, _dirs, files in os.walk(entries_dir):
+        if marker not in files:
+            continue
+        size = sum(os.path.getsize(os.path.join(root, f)) for f in files)
+        entries.append((os.path.getmtime(root), size, root))
+        total += size
+    entries.sort()
+    while total > max_size and entries:
+        _mtime, size, entry_dir = entries.pop(0)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total -= size
+
+
+def file_digest(file_path, index_dir=None):
+    """
+    Get the sha256 hex digest of the contents of ``file_path``.
+
+    If ``index_dir`` is given, digests are memoized there, keyed by the path
+    and its ``stat`` data (device, inode, size, mtime). Large images are then
+    only hashed again after they change.
+    """
+    index_file = None
+    if index_dir is not None:
+        st = os.stat(file_path)
+        stat_key = '%s\0%d\0%d\0%d\0%r' % (
+            os.path.abspath(file_path), st.st_dev, st.st_ino, st.st_size,
+            st.st_mtime)
+        index_file = os.path.join(
+            index_dir, hashlib.sha1(stat_key.encode('utf-8')).hexdigest())
+        try:
+            with open(index_file) as fp:
+                return fp.read().strip()
+        except IOError:
+            pass
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(DIGEST_BUFFER_SIZE), b''):
+            digest.update(chunk)
+    hexdigest = digest.hexdigest()
+
+    if index_file is not None:
+        _makedirs(index_dir)
+        _atomic_write(index_file, hexdigest.encode('ascii'))
+    return hexdigest
+
+
+class ResultEntry(object):
+    """
+    A cached zvsh run: the captured stdout and stderr files plus the
+    application and ZeroVM return codes.
+    """
+
+    def __init__(self, entry_dir, rc, zvm_rc):
+        self.stdout = os.path.join(entry_dir, 'stdout')
+        self.stderr = os.path.join(entry_dir, 'stderr')
+        self.rc = rc
+        self.zvm_rc = zvm_rc
+
+
+class ResultCache(object):
+    """
+    Size-bounded cache of ZeroVM run results.
+
+    ZeroVM execution is deterministic, so a run whose program, images, input
+    channels, manifest and nvram are identical to a previous one produces the
+    same output. Entries are keyed by a digest of those inputs (see
+    :meth:`key`) and evicted least-recently-used first once the cache grows
+    beyond ``max_size`` bytes.
+
+    :param cache_dir:
+        Directory holding the cache entries.
+    :param int max_size:
+        Upper bound, in bytes, of the space used by cached output.
+    """
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.digest_dir = os.path.join(cache_dir, 'digests')
+        self.results_dir = os.path.join(cache_dir, 'results')
+
+    def key(self, program, channel_files, nvram, manifest, stdin=None):
+        """
+        Compute the cache key of a run.
+
+        :param program:
+            Path to the nexe.
+        :param channel_files:
+            Paths of all the files attached as channels (images and ``@``
+            files).
+        :param str nvram:
+            Text of the generated nvram file.
+        :param str manifest:
+            Text of the generated manifest, with run-specific paths removed.
+        :param stdin:
+            Optional path to a file holding the data sent to `/dev/stdin`.
+        """
+        key = hashlib.sha256()
+        parts = [('program', file_digest(program, self.digest_dir))]
+        for channel_file in channel_files:
+            parts.append(('channel',
+                          file_digest(channel_file, self.digest_dir)))
+        if stdin is not None:
+            parts.append(('stdin', file_digest(stdin)))
+        parts.append(('nvram', hashlib.sha256(
+            nvram.encode('utf-8')).hexdigest()))
+        parts.append(('manifest', hashlib.sha256(
+            manifest.encode('utf-8')).hexdigest()))
+        for name, value in parts:
+            key.update(('%s=%s\n' % (name, value)).encode('ascii'))
+        return key.hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.results_dir, key[:2], key)
+
+    def get(self, key):
+        """
+        Look up ``key`` and return a :class:`ResultEntry`, or `None` on a
+        cache miss.
+        """
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, 'result.json')) as fp:
+                result = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+        # Mark the entry as recently used for the eviction policy.
+        try:
+            os.utime(entry_dir, None)
+        except OSError:
+            pass
+        return ResultEntry(entry_dir, result['rc'], result['zvm_rc'])
+
+    def put(self, key, stdout, stderr, rc, zvm_rc):
+        """
+        Store a run result.
+
+        :param stdout:
+            Path to a file holding the captured stdout.
+        :param stderr:
+            Path to a file holding the captured stderr.
+        :param int rc:
+            Application return code.
+        :param int zvm_rc:
+            ZeroVM return code.
+        """
+        entry_dir = self._entry_dir(key)
+        _makedirs(os.path.dirname(entry_dir))
+        tmp_dir = mkdtemp(dir=os.path.dirname(entry_dir))
+        shutil.copyfile(stdout, os.path.join(tmp_dir, 'stdout'))
+        shutil.copyfile(stderr, os.path.join(tmp_dir, 'stderr'))
+        with open(os.path.join(tmp_dir, 'result.json'), 'w') as fp:
+            json.dump(dict(rc=rc, zvm_rc=zvm_rc), fp)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another run stored the same result first.
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in
+        ``max_size`` bytes.
+        """
+        _evict(self.results_dir, 'result.json', self.max_size)
+
+
+class ValidationRecord(object):
+    """
+    Record of the nexes which passed NaCl validation under a given zerovm
+    binary.
+
+    Validating a large nexe on every start is expensive. A nexe whose digest
+    is in the record can be started with validation skipped. The record is
+    only used if :func:`is_trusted` holds for it, so it must be maintained by
+    the operator, and it is discarded as soon as the zerovm binary changes.
+
+    The record is a text file. The first line identifies the zerovm binary;
+    each following line is the sha256 digest of a validated nexe::
+
+        zerovm <sha256 of the zerovm binary>
+        <sha256 of a nexe>
+        ...
+
+    :param record_path:
+        Path to the record file.
+    :param zerovm_digest:
+        Digest of the zerovm binary in use (see :func:`file_digest`).
+    """
+
+    def __init__(self, record_path, zerovm_digest):
+        self.record_path = record_path
+        self.header = 'zerovm %s' % zerovm_digest
+
+    def _read(self):
+        try:
+            with open(self.record_path) as fp:
+                lines = fp.read().splitlines()
+        except IOError:
+            return set()
+        if not lines or lines[0] != self.header:
+            # Recorded for another zerovm binary; none of it applies.
+            return set()
+        return set(lines[1:])
+
+    def __contains__(self, nexe_digest):
+        if not is_trusted(self.record_path):
+            return False
+        return nexe_digest in self._read()
+
+    def add(self, nexe_digest):
+        """
+        Record ``nexe_digest`` as validated. Does nothing if the record
+        belongs to someone else.
+        """
+        if os.path.exists(self.record_path):
+            if os.stat(self.record_path).st_uid != os.geteuid():
+                return
+            digests = self._read()
+        else:
+            _makedirs(os.path.dirname(os.path.abspath(self.record_path)))
+            digests = set()
+        digests.add(nexe_digest)
+        lines = [self.header] + sorted(digests)
+        _atomic_write(self.record_path,
+                      ('\n'.join(lines) + '\n').encode('ascii'))
+        os.chmod(self.record_path, 0o644)
+
+
+class ImageCache(object):
+    """
+    Persistent writable tar images, shared between runs.
+
+    Every run works on a private snapshot of the shared image (see
+    :meth:`snapshot`), so concurrent runs never write to the same file. When
+    a run is done, :meth:`publish` atomically replaces the shared image with
+    its snapshot; if several runs publish, the last one wins.
+
+    :param cache_dir:
+        Directory holding the shared images.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def image_path(self, key):
+        return os.path.join(self.cache_dir, '%s.tar' % key)
+
+    def snapshot(self, key, snapshot_path):
+        """
+        Copy the shared image ``key`` (an empty tar if there is none yet) to
+        ``snapshot_path``.
+        """
+        image_path = self.image_path(key)
+        if not os.path.exists(image_path):
+            _makedirs(self.cache_dir)
+            fd, tmp_path = mkstemp(dir=self.cache_dir)
+            os.close(fd)
+            tarfile.open(tmp_path, 'w').close()
+            os.rename(tmp_path, image_path)
+        clone_file(image_path, snapshot_path)
+        st = os.stat(snapshot_path)
+        return (st.st_size, st.st_mtime)
+
+    def publish(self, key, snapshot_path, snapshot_stat):
+        """
+        Make ``snapshot_path`` the new shared image ``key``, unless it is
+        unchanged since :meth:`snapshot` returned ``snapshot_stat``.
+        """
+        st = os.stat(snapshot_path)
+        if (st.st_size, st.st_mtime) == snapshot_stat:
+            return
+        fd, tmp_path = mkstemp(dir=self.cache_dir)
+        os.close(fd)
+        clone_file(snapshot_path, tmp_path)
+        os.rename(tmp_path, self.image_path(key))
+
+
+class PlanCache(object):
+    """
+    Size-bounded cache of run plans.
+
+    Setting up a run means scanning the images for the nexe, extracting it
+    and generating the nvram and manifest. A run plan holds the outcome of
+    all that: the generated files, with the working directory replaced by
+    :attr:`WORKDIR`, plus whatever state zvsh needs to go on with the run.
+    Plans are keyed by a digest of everything that went into them (see
+    :meth:`key`), so a plan can be stamped out into a new working directory
+    instead of being generated again.
+
+    :param cache_dir:
+        Directory holding the plans.
+    :param int max_size:
+        Upper bound, in bytes, of the space used by the plans.
+    """
+    #: Stands for the working directory in the text of cached files.
+    WORKDIR = '@@WORKDIR@@'
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def key(self, *parts):
+        """
+        Compute the key of a plan from ``parts``, which can be anything JSON
+        can encode.
+        """
+        data = json.dumps(parts, sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key):
+        """
+        Look up ``key`` and return the plan `dict` stored with :meth:`put`,
+        or `None` on a cache miss. The plan's ``dir`` item is the directory
+        holding its files.
+        """
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, 'plan.json')) as fp:
+                plan = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+        try:
+            os.utime(entry_dir, None)
+        except OSError:
+            pass
+        plan['dir'] = entry_dir
+        return plan
+
+    def put(self, key, plan, files):
+        """
+        Store ``plan``, a JSON encodable `dict`, along with copies of
+        ``files`` (a `dict` of file names to paths).
+        """
+        entry_dir = self._entry_dir(key)
+        _makedirs(os.path.dirname(entry_dir))
+        tmp_dir = mkdtemp(dir=os.path.dirname(entry_dir))
+        for name, file_path in files.items():
+            clone_file(file_path, os.path.join(tmp_dir, name))
+        plan = dict(plan, files=sorted(files))
+        with open(os.path.join(tmp_dir, 'plan.json'), 'w') as fp:
+            json.dump(plan, fp)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        _evict(self.cache_dir, 'plan.json', self.max_size)
+
+
+def percentile(values, pct):
+    """
+    Get the ``pct`` percentile (nearest rank) of ``values``.
+
+    >>> percentile([5, 1, 4, 2, 3], 50)
+    3
+    >>> percentile([5, 1, 4, 2, 3], 95)
+    5
+    """
+    values = sorted(values)
+    rank = int(-(-len(values) * pct // 100))
+    return values[max(rank, 1) - 1]
+
+
+class ProfileStore(object):
+    """
+    Store of the resources used by past runs of a program.
+
+    Each profile holds the samples of the most recent runs of a given nexe
+    with given arguments, as `dict` objects such as
+    ``{'memory': 5242880, 'runtime': 0.42, 'reads': 12, ...}``. Profiles are
+    JSON files, updated under a lock so concurrent runs don't lose samples.
+
+    :param store_dir:
+        Directory holding the profiles.
+    :param int keep:
+        Number of samples kept in each profile.
+    """
+
+    def __init__(self, store_dir, keep):
+        self.store_dir = store_dir
+        self.keep = keep
+
+    def key(self, nexe_digest, args):
+        """
+        Compute the key of the profile of the nexe with the digest
+        ``nexe_digest`` run with ``args``.
+        """
+        data = json.dumps([nexe_digest, args])
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def _profile_path(self, key):
+        return os.path.join(self.store_dir, key[:2], '%s.json' % key)
+
+    def samples(self, key):
+        """
+        Get the `list` of samples in the profile ``key``, oldest first.
+        """
+        try:
+            with open(self._profile_path(key)) as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return []
+
+    def add(self, key, sample):
+        """
+        Add ``sample`` to the profile ``key``, dropping the oldest samples
+        beyond ``keep``.
+        """
+        profile_path = self._profile_path(key)
+        _makedirs(os.path.dirname(profile_path))
+        with open(profile_path + '.lock', 'a') as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            samples = self.samples(key)
+            samples.append(sample)
+            _atomic_write(profile_path,
+                          json.dumps(samples[-self.keep:]).encode('utf-8'))
@@ -0,0 +1,169 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+cProfile of the zvsh, zvm, zpm and zvapp commands themselves, from the
+environment, to find where their Python code spends its time.
+
+With ``ZEROVM_CLI_CPROFILE`` set to a file name, a command runs under
+cProfile, and its statistics are written to the file with :mod:`pstats`,
+for ``python -m pstats``, snakeviz or gprof2dot. cProfile only sees the
+thread it was started in: ``ZEROVM_CLI_CPROFILE_STACKS`` names a file to
+write the stacks of all the threads to, sampled every millisecond,
+collapsed one per line with their count, as ``flamegraph.pl`` and speedscope
+read them. Either can name a directory, where a new file named after the
+command, the time and the process id is written, so the processes of a run
+don't overwrite each other.
+
+When neither is set, :func:`run` and :func:`start` only look them up.
+
+This is not ``--zvm-profile`` (``zvshlib.spans``), which times the phases
+of a zvsh run, nor the ``[cache] profiles`` of the resources used by ZeroVM
+programs (``zvshlib.cache.ProfileStore``).
+"""
+
+import os
+import sys
+import threading
+import time
+
+#: Environment variable naming the file (or directory) to write the pstats
+#: of a command to.
+CPROFILE_ENV = 'ZEROVM_CLI_CPROFILE'
+#: Environment variable naming the file (or directory) to write the sampled
+#: stacks of a command to.
+STACKS_ENV = 'ZEROVM_CLI_CPROFILE_STACKS'
+#: Seconds between stack samples.
+SAMPLE_INTERVAL = 0.001
+
+# Whether a command is being profiled, so that nested entry points (such as
+# Shell.run under `zvm run`) leave it to the outermost.
+_active = False
+
+
+def _output_file(file_name, ext):
+    if os.path.isdir(file_name):
+        command = os.path.basename(sys.argv[0]) or 'python'
+        file_name = os.path.join(file_name, '%s-%d-%d.%s'
+                                 % (command, time.time() * 1e6, os.getpid(),
+                                    ext))
+    return file_name
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+class StackSampler(threading.Thread):
+    """
+    Sample the stacks of the other threads every ``interval`` seconds, and
+    count each distinct stack, rooted at the name of its thread.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.done = threading.Event()
+        self.counts = {}
+
+    def sample(self):
+        names = dict((thread.ident, thread.name)
+                     for thread in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, 'Thread-%d' % ident))
+            key = ';'.join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def run(self):
+        while not self.done.is_set():
+            self.sample()
+            self.done.wait(self.interval)
+
+    def stop(self):
+        self.done.set()
+        self.join()
+
+    def dump(self, file_name):
+        """
+        Write the collapsed stacks to ``file_name``, one ``stack count``
+        line each.
+        """
+        with open(file_name, 'w') as fp:
+            for stack, count in sorted(self.counts.items()):
+                fp.write('%s %d\n' % (stack, count))
+
+
+def start(env=None):
+    """
+    Start profiling as the environment ``env`` (``os.environ`` by default)
+    asks.
+
+    :returns:
+        A function stopping the profile and writing it out, or None when no
+        profile was started. It is safe to call more than once.
+    """
+    global _active
+    env = os.environ if env is None else env
+    profile_file = env.get(CPROFILE_ENV)
+    stacks_file = env.get(STACKS_ENV)
+    if _active or not (profile_file or stacks_file):
+        return None
+    _active = True
+    profiler = sampler = None
+    if stacks_file:
+        sampler = StackSampler()
+        sampler.start()
+    if profile_file:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def stop():
+        global _active
+        if not _active:
+            return
+        _active = False
+        # Stop both before writing either out, so neither profiles that.
+        if profiler is not None:
+            profiler.disable()
+        if sampler is not None:
+            sampler.stop()
+        if profiler is not None:
+            profiler.dump_stats(_output_file(profile_file, 'pstats'))
+        if sampler is not None:
+            sampler.dump(_output_file(stacks_file, 'folded'))
+    return stop
+
+
+def run(func, *args, **kwargs):
+    """
+    Call ``func`` with ``args`` and ``kwargs``, profiled if the environment
+    asks for it, and return its result.
+    """
+    stop = start()
+    if stop is None:
+        return func(*args, **kwargs)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        stop()
@@ -0,0 +1,362 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+A stand-in for ZeroVM, for testing and benchmarking zvsh and zvapp on
+machines without ZeroVM.
+
+``fake-zerovm`` takes the command line of ``zerovm`` and reads the manifest,
+but instead of running the program it copies the ``/dev/stdin`` channel to
+the ``/dev/stdout`` channel, or writes generated bytes to ``/dev/stdout``.
+Channel limits and the ``Timeout`` of the manifest are enforced, the latter
+with ``SIGALRM`` when the session runs in the main thread, so that blocking
+reads and FIFO opens time out too. ``-T``
+writes a trace log (see :mod:`zvshlib.ztrace`), and at exit a report is
+written to stdout in the format of ZeroVM, with real accounting: the memory
+is the peak resident set of ``fake-zerovm``, which stands in for the
+program, not the ``Memory`` reserved by the manifest.
+
+It is configured with environment variables:
+
+* ``FAKE_ZEROVM_MODE``: ``copy`` (the default) or ``generate``
+* ``FAKE_ZEROVM_BYTES``: number of bytes to generate (default 0)
+* ``FAKE_ZEROVM_BLOCK``: size of each read and write (default 65536)
+* ``FAKE_ZEROVM_DELAY``: seconds of simulated work before exiting
+* ``FAKE_ZEROVM_RC``: return code of the program (default 0)
+
+To use it, put it on the ``PATH`` as ``zerovm``.
+"""
+
+import os
+import resource
+import signal
+import sys
+import time
+
+#: Exit state of a session which ended normally.
+STATUS_OK = 'ok'
+STATUS_TIMEOUT = 'session timeout'
+
+_DEFAULTS = {
+    'MODE': 'copy',
+    'BYTES': '0',
+    'BLOCK': '65536',
+    'DELAY': '0',
+    'RC': '0',
+}
+
+
+class LimitExceeded(Exception):
+    """
+    Raised when a channel runs out of gets, puts, or bytes.
+    """
+
+
+class SessionTimeout(Exception):
+    """
+    Raised when the session runs longer than the manifest ``Timeout``.
+    """
+
+
+def read_manifest(manifest_file):
+    """
+    Read a manifest.
+
+    :returns:
+        `tuple` of a `dict` of the settings, and a `list` of the channels in
+        manifest order, each a `list` of its fields: uri, alias, access
+        type, etag, gets, get size, puts and put size.
+    """
+    settings = {}
+    channels = []
+    with open(manifest_file) as fp:
+        for line in fp:
+            key, sep, value = line.partition('=')
+            if not sep:
+                continue
+            key, value = key.strip(), value.strip()
+            if key == 'Channel':
+                fields = [f.strip() for f in value.split(',')]
+                channels.append(fields)
+            else:
+                settings[key] = value
+    return settings, channels
+
+
+class Channel(object):
+    """
+    One end of a manifest channel, counting its I/O against its limits.
+
+    :param fp:
+        Binary file object.
+    :param int handle:
+        Channel number shown in the trace log.
+    :param int ops:
+        Number of reads or writes allowed.
+    :param int size:
+        Number of bytes allowed.
+    :param bool reading:
+        Whether the channel is read or written.
+    """
+
+    def __init__(self, fp, handle, ops, size, tracer, reading):
+        self.fp = fp
+        self.reading = reading
+        self.handle = handle
+        self.ops = ops
+        self.size = size
+        self.count = 0
+        self.nbytes = 0
+        self.tracer = tracer
+
+    def _check(self, length):
+        if self.count >= self.ops or self.nbytes + length > self.size:
+            raise LimitExceeded()
+
+    def read(self, length):
+        self._check(1)
+        start = time.time()
+        data = self.fp.read(min(length, self.size - self.nbytes))
+        self.count += 1
+        self.nbytes += len(data)
+        self.tracer.trace(start, 'TrapRead', self.handle, length,
+                          self.nbytes - len(data), len(data))
+        return data
+
+    def write(self, data):
+        self._check(len(data))
+        start = time.time()
+        self.fp.write(data)
+        self.count += 1
+        self.nbytes += len(data)
+        self.tracer.trace(start, 'TrapWrite', self.handle, len(data),
+                          self.nbytes - len(data), len(data))
+
+
+class Tracer(object):
+    """
+    Writes a trace log in the format of ZeroVM, if ``trace_file`` is set.
+    """
+
+    def __init__(self, trace_file, start):
+        self.fp = open(trace_file, 'w') if trace_file else None
+        self.start = start
+        self.seq = 0
+
+    def trace(self, start, call, handle, size, offset, result):
+        if self.fp is None:
+            return
+        self.seq += 1
+        now = time.time()
+        self.fp.write('%d %.6f %.6f %s(%d, 0x0, %d, %d) = %d\n'
+                      % (self.seq, start - self.start, now - start, call,
+                         handle, size, offset, result))
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+
+
+def _stdin():
+    return getattr(sys.stdin, 'buffer', sys.stdin)
+
+
+def _open_channel(fields, handle, reading, tracer):
+    uri = fields[0]
+    gets, get_size, puts, put_size = [int(f) for f in fields[4:8]]
+    if reading:
+        fp = _stdin() if uri == '/dev/stdin' else open(uri, 'rb')
+        return Channel(fp, handle, gets, get_size, tracer, True)
+    return Channel(open(uri, 'wb'), handle, puts, put_size, tracer, False)
+
+
+class Session(object):
+    """
+    A fake ZeroVM session.
+
+    :param manifest_file:
+        Path of the manifest.
+    :param trace_file:
+        Optional path of a trace log to write.
+    :param env:
+        `dict` of settings, see the module documentation; defaults to
+        ``os.environ``.
+    """
+
+    def __init__(self, manifest_file, trace_file=None, env=None):
+        if env is None:
+            env = os.environ
+        self.config = dict((key, env.get('FAKE_ZEROVM_' + key, default))
+                           for key, default in _DEFAULTS.items())
+        self.settings, channels = read_manifest(manifest_file)
+        # alias -> (handle, fields)
+        self.channels = dict((fields[1], (handle, fields))
+                             for handle, fields in enumerate(channels))
+        self.trace_file = trace_file
+        self.start = time.time()
+        timeout = int(self.settings.get('Timeout', 0))
+        self.deadline = self.start + timeout if timeout > 0 else None
+        self.rc = int(self.config['RC'])
+        self.status = STATUS_OK
+        self.io = []
+
+    def _check_time(self):
+        if self.deadline is not None and time.time() > self.deadline:
+            raise SessionTimeout()
+
+    def _on_alarm(self, _signum, _frame):
+        raise SessionTimeout()
+
+    def _start_alarm(self):
+        # Interrupts the session at the deadline, even in a blocking call.
+        # Only the main thread can handle signals; elsewhere, the deadline
+        # is only checked between channel operations.
+        if self.deadline is None:
+            return None
+        try:
+            previous = signal.signal(signal.SIGALRM, self._on_alarm)
+        except ValueError:
+            return None
+        signal.setitimer(signal.ITIMER_REAL,
+                         max(self.deadline - time.time(), 0.001))
+        return previous
+
+    def _stop_alarm(self, previous):
+        if previous is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+    def run(self):
+        """
+        Run the session.
+
+        :returns:
+            The exit code of ZeroVM: 0 if the session ended normally.
+        """
+        program = self.settings.get('Program')
+        if not program or not os.path.isfile(program):
+            self.status = 'program %s not found' % program
+            return 1
+        tracer = Tracer(self.trace_file, self.start)
+        previous_handler = self._start_alarm()
+        try:
+            self._run(tracer)
+        except SessionTimeout:
+            self.status = STATUS_TIMEOUT
+            return 1
+        finally:
+            self._stop_alarm(previous_handler)
+            for channel in self.io:
+                if channel.fp is not _stdin():
+                    channel.fp.close()
+            tracer.close()
+        return 0
+
+    def _run(self, tracer):
+        # Open the output channels first: zvsh blocks opening their FIFOs.
+        outputs = {}
+        for alias in ('/dev/stdout', '/dev/stderr'):
+            if alias in self.channels:
+                handle, fields = self.channels[alias]
+                outputs[alias] = _open_channel(fields, handle, False, tracer)
+                self.io.append(outputs[alias])
+        stdout = outputs.get('/dev/stdout')
+        block = int(self.config['BLOCK'])
+        try:
+            if self.config['MODE'] == 'generate':
+                self._generate(stdout, int(self.config['BYTES']), block)
+            elif '/dev/stdin' in self.channels:
+                handle, fields = self.channels['/dev/stdin']
+                stdin = _open_channel(fields, handle, True, tracer)
+                self.io.append(stdin)
+                self._copy(stdin, stdout, block)
+        except LimitExceeded:
+            # A program which checks its I/O fails here.
+            self.rc = self.rc or 1
+        delay = float(self.config['DELAY'])
+        if delay:
+            if self.deadline is not None:
+                delay = min(delay, self.deadline - time.time() + 0.01)
+            time.sleep(max(delay, 0))
+        self._check_time()
+
+    def _generate(self, stdout, nbytes, block):
+        data = b'x' * block
+        while nbytes > 0:
+            self._check_time()
+            chunk = data[:nbytes]
+            if stdout is not None:
+                stdout.write(chunk)
+            nbytes -= len(chunk)
+
+    def _copy(self, stdin, stdout, block):
+        while True:
+            self._check_time()
+            data = stdin.read(block)
+            if not data:
+                break
+            if stdout is not None:
+                stdout.write(data)
+
+    def accounting(self):
+        """
+        Get the accounting line of the report.
+        """
+        times = os.times()
+        # The program is simulated in this process. ru_maxrss is in KiB on
+        # Linux.
+        memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        reads = [c for c in self.io if c.reading]
+        writes = [c for c in self.io if not c.reading]
+        return '%.2f %.2f %d 0 %d %d %d %d 0 0 0 0' % (
+            times[1], times[0], memory,
+            sum(c.count for c in reads), sum(c.nbytes for c in reads),
+            sum(c.count for c in writes), sum(c.nbytes for c in writes))
+
+    def report(self):
+        """
+        Get the report ZeroVM writes at exit; see
+        :func:`zvshlib.zvsh.parse_report`.
+        """
+        return ('validator state = 0\n'
+                'daemon pid = 0\n'
+                'user return code = %d\n'
+                'etag(s) = disabled\n'
+                'accounting = %s\n'
+                'exit state = %s\n'
+                % (self.rc, self.accounting(), self.status))
+
+
+def main(argv=None):
+    """
+    Run ``fake-zerovm`` with the command line of ``zerovm``: options, of
+    which only ``-T trace_file`` has an effect, followed by the manifest.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    trace_file = None
+    args = list(argv)
+    while args and args[0].startswith('-'):
+        option = args.pop(0)
+        if option.startswith('-T'):
+            trace_file = option[2:] or args.pop(0)
+    if len(args) != 1:
+        sys.stderr.write('usage: fake-zerovm [options] manifest\n')
+        return 2
+    session = Session(args[0], trace_file)
+    zvm_rc = session.run()
+    out = sys.stdout
+    out.write(session.report())
+    out.flush()
+    return zvm_rc
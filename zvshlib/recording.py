@@ -0,0 +1,185 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Recordings of zvsh runs, for ``--zvm-record`` and ``--zvm-replay``.
+
+A recording directory holds ``run.json``, describing the run, and
+``objects/``, a content-addressed store of the files the run read: the
+nexe, the images, the nvram and other file channels, and the stdin. In the
+recorded manifest, those files are replaced by ``@@INPUT<n>@@`` and the
+working directory by :attr:`zvshlib.cache.PlanCache.WORKDIR`, so the run can
+be set up again in any directory, on any host.
+"""
+
+import hashlib
+import json
+import os
+import platform
+import re
+import time
+
+from tempfile import mkstemp
+
+from zvshlib import cache
+
+#: Version of the format of ``run.json``.
+FORMAT_VERSION = 1
+
+_INPUT = re.compile(r'@@INPUT(\d+)@@')
+
+
+class DigestWriter(object):
+    """
+    File-like object keeping only the sha256 digest and the size of what is
+    written to it.
+    """
+
+    def __init__(self):
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+class Recording(object):
+    """
+    A recording directory.
+
+    :param record_dir:
+        Path of the directory; it is created when something is recorded.
+    """
+
+    def __init__(self, record_dir):
+        self.record_dir = record_dir
+
+    @property
+    def run_file(self):
+        return os.path.join(self.record_dir, 'run.json')
+
+    def object_path(self, digest):
+        return os.path.join(self.record_dir, 'objects', digest[:2], digest)
+
+    def store(self, file_path):
+        """
+        Snapshot ``file_path`` into the object store.
+
+        :returns:
+            The sha256 hex digest of the file.
+        """
+        digest = cache.file_digest(file_path)
+        object_path = self.object_path(digest)
+        if not os.path.exists(object_path):
+            cache._makedirs(os.path.dirname(object_path))
+            fd, tmp_path = mkstemp(dir=os.path.dirname(object_path))
+            os.close(fd)
+            try:
+                cache.clone_file(file_path, tmp_path)
+                os.rename(tmp_path, object_path)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+        return digest
+
+    def snapshot_manifest(self, manifest_file, workdir):
+        """
+        Snapshot the program and the file channels of a manifest.
+
+        :param workdir:
+            Working directory of the run; FIFOs in it are recreated on replay
+            rather than recorded.
+        :returns:
+            `tuple` of the text of the manifest with placeholders for the
+            snapshots, and a `list` of the snapshots, as `dict` objects with
+            the ``digest`` and original ``name`` of each file.
+        """
+        workdir = os.path.abspath(workdir)
+        inputs = []
+        placeholders = {}
+
+        def placeholder(uri):
+            if uri not in placeholders:
+                if os.path.isfile(uri):
+                    inputs.append({'digest': self.store(uri),
+                                   'name': os.path.basename(uri)})
+                    placeholders[uri] = '@@INPUT%d@@' % (len(inputs) - 1)
+                else:
+                    placeholders[uri] = uri.replace(
+                        workdir, cache.PlanCache.WORKDIR)
+            return placeholders[uri]
+
+        lines = []
+        with open(manifest_file) as fp:
+            for line in fp.read().split('\n'):
+                key, _, value = line.partition('=')
+                if key.strip() in ('Channel', 'Program'):
+                    uri = value.split(',')[0].strip()
+                    line = line.replace(uri, placeholder(uri), 1)
+                lines.append(line)
+        return '\n'.join(lines), inputs
+
+    def save(self, run):
+        """
+        Write the description of the run, a JSON encodable `dict`.
+        """
+        cache._makedirs(self.record_dir)
+        run = dict(run, version=FORMAT_VERSION, time=time.time(),
+                   host=platform.node())
+        data = json.dumps(run, indent=2, sort_keys=True)
+        cache._atomic_write(self.run_file, data.encode('utf-8'))
+
+    def load(self):
+        """
+        Read the description of the recorded run.
+
+        :raises RuntimeError:
+            If there is no recording in the directory.
+        """
+        try:
+            with open(self.run_file) as fp:
+                run = json.load(fp)
+        except (IOError, OSError, ValueError):
+            raise RuntimeError("No zvsh recording in '%s'" % self.record_dir)
+        if run.get('version') != FORMAT_VERSION:
+            raise RuntimeError("Unsupported zvsh recording version in '%s'"
+                               % self.record_dir)
+        return run
+
+    def materialize(self, run, workdir):
+        """
+        Set up the recorded run in ``workdir``: copy the snapshots into it,
+        and write the manifest with their paths.
+
+        :returns:
+            The path to the manifest.
+        """
+        workdir = os.path.abspath(workdir)
+        paths = []
+        for i, snapshot in enumerate(run['inputs']):
+            dst = os.path.join(workdir, 'input.%d.%s' % (i, snapshot['name']))
+            # A copy, never a link: the run may write to its channels.
+            cache.clone_file(self.object_path(snapshot['digest']), dst)
+            paths.append(dst)
+        manifest = _INPUT.sub(lambda match: paths[int(match.group(1))],
+                              run['manifest'])
+        manifest = manifest.replace(cache.PlanCache.WORKDIR, workdir)
+        manifest_file = os.path.join(workdir, 'manifest.%d' % run['node'])
+        with open(manifest_file, 'w') as fp:
+            fp.write(manifest)
+        return manifest_file
@@ -0,0 +1,248 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Serialization of ZeroVM manifests and ZRT nvram files.
+
+Everything that writes a manifest or an nvram file goes through this
+module. Output is produced as a stream of lines, which the ``dumps_*``
+functions join once and :func:`dump` writes straight to a file, so the cost
+is linear in the number of channels.
+"""
+
+import re
+
+#: Characters which :func:`escape` replaces with ``\xNN`` sequences.
+ESCAPED_CHARS = '\\", \n'
+
+_ESCAPE_TABLE = dict((ord(c), '\\x%02x' % ord(c)) for c in ESCAPED_CHARS)
+_NEEDS_ESCAPE = re.compile('[%s]' % re.escape(ESCAPED_CHARS))
+
+CHANNEL_LINE = 'Channel = %s,%s,%s,%s,%s,%s,%s,%s'
+
+#: Lines are written to files in batches of this many.
+DUMP_BATCH_SIZE = 4096
+
+
+def escape(value):
+    r"""Escape value for inclusion as a value in a nvram file.
+
+    The ini-file parser in ZRT is very simple. One quirk is that it
+    handles ',' the same as '\n', which means that a value like
+
+      greeting = Hello, World
+
+    will be cut-off after "Hello".
+
+    Values also need protection in other ways:
+
+    * When "args" are loaded, the value is split on ' ' and each
+      argument found is then unescaped. This means that each arg need
+      to have ' ' escaped.
+
+    * When a "value" is loaded in [env], it is unescaped. It must
+      therefore also be escaped.
+
+    This function escapes '\\', '"', ',', ' ', and '\n'. These are the
+    characters that conf_parser::unescape_string_copy_to_dest is
+    documented to handle and they are sufficient to handle the above
+    use cases.
+
+    >>> escape('foo, bar')
+    'foo\\x2c\\x20bar'
+    >>> escape('new\nline')
+    'new\\x0aline'
+    """
+    if _NEEDS_ESCAPE.search(value) is None:
+        # Most values, like paths, have nothing to escape.
+        return value
+    if isinstance(value, bytes):
+        # Python 2 byte strings can't translate a character into several.
+        for c in ESCAPED_CHARS:
+            value = value.replace(c, '\\x%02x' % ord(c))
+        return value
+    return value.translate(_ESCAPE_TABLE)
+
+
+def format_channel(channel):
+    """
+    Format a manifest channel line.
+
+    :param channel:
+        `tuple` of the uri, alias, access type, etag, gets, get size, puts
+        and put size of the channel.
+
+    >>> format_channel(('/dev/stdin', '/dev/stdin', 0, 0, 10, 20, 0, 0))
+    'Channel = /dev/stdin,/dev/stdin,0,0,10,20,0,0'
+    """
+    return CHANNEL_LINE % channel
+
+
+def iter_channel_lines(uris, aliases, spec_ids, specs):
+    """
+    Format channel lines in bulk, for channels which share their access
+    type, etag and limits with many others.
+
+    :param uris:
+        Sequence of channel uris.
+    :param aliases:
+        Sequence of channel aliases, one for each uri.
+    :param spec_ids:
+        Sequence of indexes into ``specs``, one for each uri.
+    :param specs:
+        Sequence of (access type, etag, gets, get size, puts, put size)
+        tuples.
+
+    >>> list(iter_channel_lines(['/a', '/b'], ['/dev/a', '/dev/b'], [0, 0],
+    ...                         [(3, 0, 1, 2, 0, 0)]))
+    ['Channel = /a,/dev/a,3,0,1,2,0,0', 'Channel = /b,/dev/b,3,0,1,2,0,0']
+    """
+    suffixes = [',%s,%s,%s,%s,%s,%s' % tuple(spec) for spec in specs]
+    for uri, alias, spec_id in zip(uris, aliases, spec_ids):
+        yield 'Channel = %s,%s%s' % (uri, alias, suffixes[spec_id])
+
+
+def iter_manifest_lines(settings, channel_lines):
+    """
+    Generate the text of a manifest, piece by piece, from channel lines
+    formatted beforehand.
+
+    :param settings:
+        Iterable of (key, value) pairs, such as ``('Node', 1)``, written in
+        order before the channels.
+    :param channel_lines:
+        Iterable of channel lines; see :func:`format_channel` and
+        :func:`iter_channel_lines`.
+    """
+    sep = ''
+    for key, value in settings:
+        yield '%s%s = %s' % (sep, key, value)
+        sep = '\n'
+    for line in channel_lines:
+        yield sep + line
+        sep = '\n'
+
+
+def iter_manifest(settings, channels):
+    """
+    Generate the text of a manifest, piece by piece.
+
+    :param settings:
+        See :func:`iter_manifest_lines`.
+    :param channels:
+        Iterable of channel tuples; see :func:`format_channel`.
+    """
+    return iter_manifest_lines(
+        settings, (CHANNEL_LINE % channel for channel in channels))
+
+
+def dumps_manifest(settings, channels):
+    """
+    Get the text of a manifest. See :func:`iter_manifest` for the
+    parameters.
+
+    >>> print(dumps_manifest([('Node', 1), ('Program', '/tmp/boot.1')],
+    ...                      [('/dev/stdin', '/dev/stdin', 0, 0, 1, 2, 0, 0)]))
+    Node = 1
+    Program = /tmp/boot.1
+    Channel = /dev/stdin,/dev/stdin,0,0,1,2,0,0
+    """
+    return ''.join(iter_manifest(settings, channels))
+
+
+def env_line(name, value):
+    """
+    Format an ``[env]`` entry of an nvram file.
+
+    >>> env_line('LANG', 'en_US.UTF-8,')
+    'name=LANG,value=en_US.UTF-8\\\\x2c'
+    """
+    return 'name=%s,value=%s' % (name, escape(value))
+
+
+def fstab_line(device, mount_point, access):
+    """
+    Format an ``[fstab]`` entry of an nvram file.
+    """
+    return ('channel=%s,mountpoint=%s,access=%s,removable=no'
+            % (device, mount_point, access))
+
+
+def mapping_line(device, mode):
+    """
+    Format a ``[mapping]`` entry of an nvram file.
+    """
+    return 'channel=%s,mode=%s' % (device, mode)
+
+
+def args_line(args):
+    """
+    Format the ``args`` entry of an nvram file.
+
+    When ZRT presents a program with its argv, it parses the nvram file. This
+    parser is very simple. It will choke on ',' (it treats comma the same as
+    newline) and it will split the command line on ' '. We must therefore
+    escape each argument individually before joining them.
+
+    >>> args_line(['echo', 'Hello, World'])
+    'args = echo Hello\\\\x2c\\\\x20World'
+    """
+    return 'args = %s' % ' '.join([escape(arg) for arg in args])
+
+
+def iter_nvram(sections):
+    """
+    Generate the text of an nvram file, line by line.
+
+    :param sections:
+        Iterable of (section name, iterable of lines) pairs. Sections without
+        any lines are left out.
+    """
+    for name, lines in sections:
+        header = '[%s]\n' % name
+        for line in lines:
+            if header:
+                yield header
+                header = None
+            yield line + '\n'
+
+
+def dumps_nvram(sections):
+    """
+    Get the text of an nvram file. See :func:`iter_nvram` for the
+    parameters.
+
+    >>> print(dumps_nvram([('args', [args_line(['ls', '-l'])]),
+    ...                    ('env', [])]))
+    [args]
+    args = ls -l
+    <BLANKLINE>
+    """
+    return ''.join(iter_nvram(sections))
+
+
+def dump(file_name, pieces):
+    """
+    Write the text ``pieces``, as generated by :func:`iter_manifest` or
+    :func:`iter_nvram`, to ``file_name`` in UTF-8, without building the whole
+    text in memory.
+    """
+    batch = []
+    with open(file_name, 'wb') as fp:
+        for piece in pieces:
+            batch.append(piece)
+            if len(batch) >= DUMP_BATCH_SIZE:
+                fp.write(''.join(batch).encode('utf-8'))
+                batch = []
+        fp.write(''.join(batch).encode('utf-8'))
@@ -0,0 +1,104 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Timing spans for the phases of a zvsh run.
+
+Code marks a phase with ``with span('name'):``. Spans always measure their
+duration; once :func:`enable` is called they are also recorded, and
+:func:`dump` writes them out in the Chrome trace event format, which
+chrome://tracing and other trace viewers can open. Timestamps come from the
+wall clock, so the traces of many runs can be merged.
+"""
+
+import json
+import os
+import threading
+import time
+
+#: Environment variable naming the file (or directory) to write the spans
+#: of a run to, as with ``--zvm-profile``.
+PROFILE_ENV = 'ZVSH_PROFILE'
+
+# Recorded trace events, or None while recording is disabled.
+_events = None
+
+
+def enable():
+    """
+    Start recording spans.
+    """
+    global _events
+    if _events is None:
+        _events = []
+
+
+def enabled():
+    return _events is not None
+
+
+class Span(object):
+    """
+    Context manager timing a phase. Its ``duration``, in seconds, is set on
+    exit.
+    """
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = None
+        self.duration = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.duration = time.time() - self.start
+        if _events is not None:
+            # list.append is atomic, so spans can end in any thread.
+            _events.append({
+                'name': self.name,
+                'cat': 'zvsh',
+                'ph': 'X',
+                'ts': int(self.start * 1e6),
+                'dur': int(self.duration * 1e6),
+                'pid': os.getpid(),
+                'tid': threading.current_thread().ident,
+                'args': self.args,
+            })
+        return False
+
+
+def span(name, **args):
+    """
+    Get a :class:`Span` for the phase ``name``. Keyword arguments are shown
+    with the span in trace viewers.
+    """
+    return Span(name, args)
+
+
+def dump(file_name):
+    """
+    Write the recorded spans to ``file_name`` as Chrome trace event JSON. If
+    ``file_name`` is a directory, a new file named after the time and the
+    process id is written in it, so runs sharing the directory don't
+    overwrite each other.
+    """
+    if os.path.isdir(file_name):
+        file_name = os.path.join(file_name, 'zvsh-%d-%d.json'
+                                 % (time.time() * 1e6, os.getpid()))
+    with open(file_name, 'w') as fp:
+        json.dump({'traceEvents': _events or [], 'displayTimeUnit': 'ms'},
+                  fp)
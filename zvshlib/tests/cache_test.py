@@ -0,0 +1,266 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import shutil
+import tarfile
+import tempfile
+
+from io import BytesIO
+
+from zvshlib import cache
+
+
+def _write(file_path, data):
+    with open(file_path, 'wb') as fp:
+        fp.write(data)
+    return file_path
+
+
+class TestFileDigest:
+    """
+    Tests for :func:`zvshlib.cache.file_digest`.
+    """
+
+    def setup_method(self, _method):
+        self.tempdir = tempfile.mkdtemp()
+
+    def teardown_method(self, _method):
+        shutil.rmtree(self.tempdir)
+
+    def test_digest(self):
+        file_path = _write(os.path.join(self.tempdir, 'a'), b'abc')
+        exp = ('ba7816bf8f01cfea414140de5dae2223'
+               'b00361a396177a9cb410ff61f20015ad')
+        assert exp == cache.file_digest(file_path)
+
+    def test_index(self):
+        index_dir = os.path.join(self.tempdir, 'index')
+        file_path = _write(os.path.join(self.tempdir, 'a'), b'abc')
+        digest = cache.file_digest(file_path, index_dir)
+        assert len(os.listdir(index_dir)) == 1
+
+        # The memoized digest is used as long as the file is unchanged.
+        [index_file] = os.listdir(index_dir)
+        _write(os.path.join(index_dir, index_file), b'memoized')
+        assert 'memoized' == cache.file_digest(file_path, index_dir)
+
+        # Changing the file changes its stat data and forces a rehash.
+        _write(file_path, b'abcd')
+        assert digest != cache.file_digest(file_path, index_dir)
+
+
+class TestResultCache:
+    """
+    Tests for :class:`zvshlib.cache.ResultCache`.
+    """
+
+    def setup_method(self, _method):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = cache.ResultCache(os.path.join(self.tempdir, 'cache'),
+                                       1024)
+        self.program = _write(os.path.join(self.tempdir, 'prog'), b'nexe')
+        self.image = _write(os.path.join(self.tempdir, 'img'), b'tar')
+        self.stdout = _write(os.path.join(self.tempdir, 'out'), b'hello')
+        self.stderr = _write(os.path.join(self.tempdir, 'err'), b'')
+
+    def teardown_method(self, _method):
+        shutil.rmtree(self.tempdir)
+
+    def _key(self, nvram='[args]\nargs = prog\n'):
+        return self.cache.key(self.program, [self.image], nvram,
+                              'Node = 1\n')
+
+    def test_key(self):
+        assert self._key() == self._key()
+        assert self._key() != self._key(nvram='[args]\nargs = prog -v\n')
+
+        key = self._key()
+        _write(self.image, b'other tar')
+        assert key != self._key()
+
+    def test_miss(self):
+        assert self.cache.get(self._key()) is None
+
+    def test_put_get(self):
+        key = self._key()
+        self.cache.put(key, self.stdout, self.stderr, 3, 0)
+        entry = self.cache.get(key)
+        assert (3, 0) == (entry.rc, entry.zvm_rc)
+        with open(entry.stdout, 'rb') as fp:
+            assert b'hello' == fp.read()
+        with open(entry.stderr, 'rb') as fp:
+            assert b'' == fp.read()
+
+    def test_evict(self):
+        _write(self.stdout, b'x' * 600)
+        first = self._key()
+        self.cache.put(first, self.stdout, self.stderr, 0, 0)
+        os.utime(self.cache._entry_dir(first), (0, 0))
+        second = self._key(nvram='other')
+        self.cache.put(second, self.stdout, self.stderr, 0, 0)
+
+        # Both entries don't fit in 1024 bytes; the older one goes.
+        assert self.cache.get(first) is None
+        assert self.cache.get(second) is not None
+
+
+class TestValidationRecord:
+    """
+    Tests for :class:`zvshlib.cache.ValidationRecord`.
+    """
+
+    def setup_method(self, _method):
+        self.tempdir = tempfile.mkdtemp()
+        self.record_path = os.path.join(self.tempdir, 'validated')
+
+    def teardown_method(self, _method):
+        shutil.rmtree(self.tempdir)
+
+    def test_add(self):
+        record = cache.ValidationRecord(self.record_path, 'zvm1')
+        assert 'nexe1' not in record
+        record.add('nexe1')
+        record.add('nexe2')
+        assert 'nexe1' in record
+        assert 'nexe2' in record
+        with open(self.record_path) as fp:
+            assert 'zerovm zvm1\nnexe1\nnexe2\n' == fp.read()
+
+    def test_zerovm_changed(self):
+        cache.ValidationRecord(self.record_path, 'zvm1').add('nexe1')
+        record = cache.ValidationRecord(self.record_path, 'zvm2')
+        assert 'nexe1' not in record
+
+        # The stale entries are dropped on the next update.
+        record.add('nexe2')
+        with open(self.record_path) as fp:
+            assert 'zerovm zvm2\nnexe2\n' == fp.read()
+
+    def test_untrusted(self):
+        record = cache.ValidationRecord(self.record_path, 'zvm1')
+        record.add('nexe1')
+        os.chmod(self.record_path, 0o666)
+        assert 'nexe1' not in record
+
+
+class TestImageCache:
+    """
+    Tests for :class:`zvshlib.cache.ImageCache`.
+    """
+
+    def setup_method(self, _method):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = cache.ImageCache(os.path.join(self.tempdir, 'cache'))
+        self.snapshot = os.path.join(self.tempdir, 'snapshot.tar')
+
+    def teardown_method(self, _method):
+        shutil.rmtree(self.tempdir)
+
+    def test_snapshot_new(self):
+        self.cache.snapshot('key', self.snapshot)
+        tar = tarfile.open(self.snapshot)
+        assert [] == tar.getnames()
+        tar.close()
+
+    def test_publish(self):
+        snapshot_stat = self.cache.snapshot('key', self.snapshot)
+        tar = tarfile.open(self.snapshot, 'w')
+        info = tarfile.TarInfo('foo.pyc')
+        info.size = 3
+        tar.addfile(info, BytesIO(b'pyc'))
+        tar.close()
+        self.cache.publish('key', self.snapshot, snapshot_stat)
+
+        other = os.path.join(self.tempdir, 'other.tar')
+        self.cache.snapshot('key', other)
+        tar = tarfile.open(other)
+        assert ['foo.pyc'] == tar.getnames()
+        tar.close()
+
+    def test_publish_unchanged(self):
+        snapshot_stat = self.cache.snapshot('key', self.snapshot)
+        image_stat = os.stat(self.cache.image_path('key'))
+        self.cache.publish('key', self.snapshot, snapshot_stat)
+        assert image_stat == os.stat(self.cache.image_path('key'))
+
+
+class TestPlanCache:
+    """
+    Tests for :class:`zvshlib.cache.PlanCache`.
+    """
+
+    def setup_method(self, _method):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = cache.PlanCache(os.path.join(self.tempdir, 'cache'),
+                                     1024)
+        self.boot = _write(os.path.join(self.tempdir, 'boot.1'), b'nexe')
+
+    def teardown_method(self, _method):
+        shutil.rmtree(self.tempdir)
+
+    def test_key(self):
+        assert self.cache.key('a', {'b': 1}) == self.cache.key('a', {'b': 1})
+        assert self.cache.key('a', {'b': 1}) != self.cache.key('a', {'b': 2})
+
+    def test_miss(self):
+        assert self.cache.get(self.cache.key('a')) is None
+
+    def test_put_get(self):
+        key = self.cache.key('a')
+        self.cache.put(key, {'manifest': 'Node = 1\n'},
+                       {'boot.1': self.boot})
+        plan = self.cache.get(key)
+        assert 'Node = 1\n' == plan['manifest']
+        assert ['boot.1'] == plan['files']
+        with open(os.path.join(plan['dir'], 'boot.1'), 'rb') as fp:
+            assert b'nexe' == fp.read()
+
+    def test_evict(self):
+        _write(self.boot, b'x' * 600)
+        first = self.cache.key('a')
+        self.cache.put(first, {}, {'boot.1': self.boot})
+        os.utime(self.cache._entry_dir(first), (0, 0))
+        second = self.cache.key('b')
+        self.cache.put(second, {}, {'boot.1': self.boot})
+
+        assert self.cache.get(first) is None
+        assert self.cache.get(second) is not None
+
+
+class TestProfileStore:
+    """
+    Tests for :class:`zvshlib.cache.ProfileStore`.
+    """
+
+    def setup_method(self, _method):
+        self.tempdir = tempfile.mkdtemp()
+        self.store = cache.ProfileStore(os.path.join(self.tempdir, 'p'), 2)
+
+    def teardown_method(self, _method):
+        shutil.rmtree(self.tempdir)
+
+    def test_key(self):
+        key = self.store.key('nexe1', ['prog', '-v'])
+        assert key == self.store.key('nexe1', ['prog', '-v'])
+        assert key != self.store.key('nexe1', ['prog'])
+        assert key != self.store.key('nexe2', ['prog', '-v'])
+
+    def test_add(self):
+        key = self.store.key('nexe1', ['prog'])
+        assert [] == self.store.samples(key)
+        for memory in (1, 2, 3):
+            self.store.add(key, {'memory': memory})
+        # Only the newest samples are kept.
+        assert [{'memory': 2}, {'memory': 3}] == self.store.samples(key)
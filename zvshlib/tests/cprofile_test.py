@@ -0,0 +1,80 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import pstats
+import shutil
+import tempfile
+import time
+
+import mock
+
+from zvshlib import cprofile
+
+
+def _busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+    return 'done'
+
+
+class TestCProfile:
+    """
+    Tests for :mod:`zvshlib.cprofile`.
+    """
+
+    def setup_method(self, _method):
+        self.tempdir = tempfile.mkdtemp()
+
+    def teardown_method(self, _method):
+        shutil.rmtree(self.tempdir)
+        cprofile._active = False
+
+    def test_disabled(self):
+        with mock.patch.dict(os.environ, clear=True):
+            assert cprofile.start() is None
+            assert 'done' == cprofile.run(_busy, 0)
+
+    def test_pstats(self):
+        profile_file = os.path.join(self.tempdir, 'zpm.pstats')
+        env = {cprofile.CPROFILE_ENV: profile_file}
+        with mock.patch.dict(os.environ, env):
+            assert 'done' == cprofile.run(_busy, 0.01)
+
+        stats = pstats.Stats(profile_file)
+        assert '_busy' in [func for _, _, func in stats.stats]
+        assert not cprofile._active
+
+    def test_stacks(self):
+        env = {cprofile.STACKS_ENV: self.tempdir}
+        with mock.patch.dict(os.environ, env):
+            cprofile.run(_busy, 0.05)
+
+        [stacks_file] = os.listdir(self.tempdir)
+        assert stacks_file.endswith('-%d.folded' % os.getpid())
+        with open(os.path.join(self.tempdir, stacks_file)) as fp:
+            lines = fp.read().splitlines()
+        busy = [line for line in lines if ';_busy (cprofile_test.py:' in line]
+        assert busy
+        stack, count = busy[0].rsplit(' ', 1)
+        assert stack.startswith('MainThread;')
+        assert int(count) > 0
+
+    def test_nested(self):
+        env = {cprofile.CPROFILE_ENV: self.tempdir}
+        with mock.patch.dict(os.environ, env):
+            # Only the outermost call writes a profile.
+            cprofile.run(cprofile.run, _busy, 0)
+        assert 1 == len(os.listdir(self.tempdir))
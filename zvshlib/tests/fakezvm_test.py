@@ -0,0 +1,174 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from io import BytesIO
+
+import mock
+
+import zvshlib
+from zvshlib import fakezvm
+from zvshlib import ztrace
+from zvshlib import zvsh
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(zvshlib.__file__)))
+FAKE_ZEROVM = os.path.join(ROOT, 'scripts', 'fake-zerovm')
+
+
+class TestSession:
+    """
+    Tests for :class:`zvshlib.fakezvm.Session`.
+    """
+
+    def setup_method(self, _method):
+        self.tempdir = tempfile.mkdtemp()
+        self.program = os.path.join(self.tempdir, 'prog.nexe')
+        open(self.program, 'w').close()
+        self.stdin = os.path.join(self.tempdir, 'stdin')
+        with open(self.stdin, 'wb') as fp:
+            fp.write(b'x' * 100)
+        self.stdout = os.path.join(self.tempdir, 'stdout')
+        self.stderr = os.path.join(self.tempdir, 'stderr')
+        self.manifest = os.path.join(self.tempdir, 'manifest.1')
+
+    def teardown_method(self, _method):
+        shutil.rmtree(self.tempdir)
+
+    def _write_manifest(self, gets=1000, timeout=50):
+        with open(self.manifest, 'w') as fp:
+            fp.write('Timeout = %d\nMemory = 4096,0\nProgram = %s\n'
+                     'Channel = %s,/dev/stdin,0,0,%d,1000,0,0\n'
+                     'Channel = %s,/dev/stdout,0,0,0,0,1000,1000\n'
+                     'Channel = %s,/dev/stderr,0,0,0,0,1000,1000\n'
+                     % (timeout, self.program, self.stdin, gets, self.stdout,
+                        self.stderr))
+
+    def _output(self):
+        with open(self.stdout, 'rb') as fp:
+            return fp.read()
+
+    def test_copy(self):
+        self._write_manifest()
+        trace_log = os.path.join(self.tempdir, 'trace.log')
+        session = fakezvm.Session(self.manifest, trace_log,
+                                  env={'FAKE_ZEROVM_BLOCK': '30'})
+        assert 0 == session.run()
+        assert b'x' * 100 == self._output()
+
+        report = zvsh.parse_report(session.report())
+        assert (0, 'ok') == (report.return_code, report.status)
+        assert (5, 100, 4, 100) == tuple(
+            report.accounting[field]
+            for field in ('reads', 'rbytes', 'writes', 'wbytes'))
+        # What this process uses, not the 4096 bytes of the manifest.
+        assert report.accounting['memory'] >= 1024 * 1024
+
+        # The trace log can be analyzed with zvsh-trace.
+        with open(trace_log) as fp:
+            analysis = ztrace.TraceAnalysis(ztrace.parse_log(fp))
+        assert 100 == analysis.channels[0].rbytes
+        assert 100 == analysis.channels[1].wbytes
+
+    def test_generate(self):
+        self._write_manifest()
+        session = fakezvm.Session(self.manifest, env={
+            'FAKE_ZEROVM_MODE': 'generate', 'FAKE_ZEROVM_BYTES': '10',
+            'FAKE_ZEROVM_RC': '3'})
+        assert 0 == session.run()
+        assert b'x' * 10 == self._output()
+        assert 3 == zvsh.parse_report(session.report()).return_code
+
+    def test_limits(self):
+        self._write_manifest(gets=2)
+        session = fakezvm.Session(self.manifest,
+                                  env={'FAKE_ZEROVM_BLOCK': '30'})
+        assert 0 == session.run()
+        # The program failed after using up its reads.
+        assert b'x' * 60 == self._output()
+        assert 1 == zvsh.parse_report(session.report()).return_code
+
+    def test_timeout(self):
+        self._write_manifest(timeout=1)
+        session = fakezvm.Session(self.manifest,
+                                  env={'FAKE_ZEROVM_DELAY': '5'})
+        # The delay is cut short at the deadline.
+        with mock.patch('time.sleep') as sleep:
+            assert 0 == session.run()
+        assert sleep.call_args[0][0] <= 1.01
+
+        session = fakezvm.Session(self.manifest)
+        session.deadline -= 2
+        assert 1 == session.run()
+        assert 'session timeout' == session.status
+
+    def test_timeout_blocking_read(self):
+        # A read which never returns is cut short at the deadline.
+        os.unlink(self.stdin)
+        os.mkfifo(self.stdin)
+        writer = os.open(self.stdin, os.O_RDWR)
+        try:
+            self._write_manifest(timeout=1)
+            session = fakezvm.Session(self.manifest)
+            session.deadline = time.time() + 0.2
+            start = time.time()
+            assert 1 == session.run()
+            assert time.time() - start < 5
+            assert 'session timeout' == session.status
+        finally:
+            os.close(writer)
+
+    def test_report(self):
+        self._write_manifest()
+        session = fakezvm.Session(self.manifest)
+        session.run()
+        # The keys of ZeroVM's report.
+        assert ['validator state', 'daemon pid', 'user return code',
+                'etag(s)', 'accounting', 'exit state'] == [
+            line.split(' = ')[0]
+            for line in session.report().splitlines()]
+
+    def test_no_program(self):
+        os.unlink(self.program)
+        self._write_manifest()
+        session = fakezvm.Session(self.manifest)
+        assert 1 == session.run()
+        assert session.status.startswith('program ')
+
+    def test_runner(self):
+        # Run the real runner, FIFOs and all, against fake-zerovm.
+        os.unlink(self.stdin)
+        self.stdin = '/dev/stdin'
+        self._write_manifest()
+        os.mkfifo(self.stdout)
+        os.mkfifo(self.stderr)
+        runner = zvsh.ZvRunner(
+            [sys.executable, FAKE_ZEROVM, '-PQ', self.manifest],
+            self.stdout, self.stderr, self.tempdir)
+        runner.stdin = BytesIO(b'hello')
+        runner.stdout_copy = BytesIO()
+        with mock.patch.dict('os.environ', {'PYTHONPATH': ROOT}):
+            assert 0 == runner.execute()
+        assert b'hello' == runner.stdout_copy.getvalue()
+        assert 'ok' == zvsh.parse_report(runner.report).status
+        streams = runner.stats()['streams']
+        assert sorted(zvsh.PUMP_STREAMS) == sorted(streams)
+        assert 5 == streams['stdin']['bytes']
+        assert 5 == streams['stdout']['bytes']
+        assert 0 == streams['stderr']['chunks']
+        assert len(runner.report) == streams['report']['peak_buffered']
@@ -1,10 +1,13 @@
+import io
 import os
 import tarfile
 from tempfile import mkstemp, mkdtemp
 import unittest
 import errno
+import json
 from shutil import rmtree
 import sys
+import mock
 import pytest
 import zvshlib
 from zvshlib.zvsh import Shell, DEFAULT_LIMITS
@@ -20,6 +23,8 @@ except ImportError:
 
 MULTIVAL = ['channel']
 ZVSH = 'zvsh'
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))))
 
 zvshlib.zvsh.ZEROVM_EXECUTABLE = 'false'
 zvshlib.zvsh.ZEROVM_OPTIONS = ''
@@ -35,6 +40,7 @@ zvshlib.zvsh.ZvShell.cleanup = mock_cleanup
 def mock_return_code(report):
     return 0
 
+orig_parse_return_code = zvshlib.zvsh.parse_return_code
 zvshlib.zvsh.parse_return_code = mock_return_code
 
 
@@ -509,6 +515,280 @@ class TestZvsh(unittest.TestCase):
         finally:
             shell.zvsh.orig_cleanup()
 
+    def test_nodes(self):
+        self.argv = [ZVSH, '--zvm-nodes', '3', self.program]
+        shell = Shell(self.argv)
+        try:
+            with pytest.raises(SystemExit):
+                shell.run()
+            tmpdir = shell.zvsh.tmpdir
+            files = os.listdir(tmpdir)
+            for node_id in (1, 2, 3):
+                self.assertTrue('manifest.%d' % node_id in files)
+                self.assertTrue('nvram.%d' % node_id in files)
+                manifest = _read_manifest(join_path(tmpdir,
+                                                    'manifest.%d' % node_id))
+                reference = self._reference_manifest(tmpdir)
+                reference['node'] = str(node_id)
+                for channel in reference['channel']:
+                    channel[0] = channel[0].replace('.1', '.%d' % node_id)
+                self.assertEqual(manifest, reference)
+                nvram = _read_nvram(join_path(tmpdir, 'nvram.%d' % node_id))
+                self.assertEqual(nvram['env'],
+                                 [{'name': 'ZVM_NODE_ID',
+                                   'value': str(node_id)},
+                                  {'name': 'ZVM_NODE_COUNT',
+                                   'value': '3'}])
+        finally:
+            shell.zvsh.orig_cleanup()
+
+    def test_nodes_shared_output(self):
+        # Nodes can't all write to the same file.
+        output = join_path(self.testdir, 'output')
+        for argv in ([ZVSH, '--zvm-nodes', '2', self.program, '@' + output],
+                     [ZVSH, '--zvm-nodes', '2', '--zvm-debug',
+                      self.program]):
+            shell = Shell(argv)
+            try:
+                with pytest.raises(RuntimeError) as err:
+                    shell.run()
+                assert 'shared between nodes' in str(err.value)
+            finally:
+                shell.zvsh.orig_cleanup()
+
+    def test_record_tty(self):
+        # A terminal is recorded as an empty stdin, without waiting for EOF.
+        record_dir = join_path(self.testdir, 'record')
+        self.argv = [ZVSH, '--zvm-record', record_dir, self.program]
+        shell = Shell(self.argv)
+        try:
+            with mock.patch('sys.stdin') as stdin:
+                stdin.isatty.return_value = True
+                stdin.read.side_effect = AssertionError('stdin read')
+                stdin.buffer.read.side_effect = AssertionError('stdin read')
+                with pytest.raises(SystemExit):
+                    shell.run()
+            stdin_file = join_path(shell.zvsh.tmpdir, 'stdin.1')
+            self.assertEqual(0, os.path.getsize(stdin_file))
+        finally:
+            shell.zvsh.orig_cleanup()
+
+    def test_stats(self):
+        stats_file = join_path(self.testdir, 'stats.json')
+        self.argv = [ZVSH, '--zvm-stats', stats_file, self.program]
+        shell = Shell(self.argv)
+        try:
+            with pytest.raises(SystemExit):
+                shell.run()
+            with open(stats_file) as stats_fp:
+                stats = json.loads(stats_fp.readline())
+            self.assertEqual(self.argv, stats['command'])
+            self.assertEqual(['cleanup', 'execute', 'setup'],
+                             sorted(stats['timings']))
+            [node] = stats['nodes']
+            # 'false' exits with 1
+            self.assertEqual(1, node['zvm_rc'])
+            self.assertTrue(node['rusage']['ru_maxrss'] > 0)
+            self.assertEqual(['report', 'stderr', 'stdin', 'stdout'],
+                             sorted(node['streams']))
+            self.assertEqual(['bytes', 'chunks', 'peak_buffered',
+                              'read_time', 'write_time'],
+                             sorted(node['streams']['report']))
+        finally:
+            shell.zvsh.orig_cleanup()
+
+
+# fake-zerovm as the zerovm executable, logging its command lines as JSON.
+FAKE_ZEROVM = """#!%(python)s
+import json
+import sys
+sys.path.insert(0, %(root)r)
+from zvshlib import fakezvm
+with open(%(calls)r, 'a') as fp:
+    fp.write(json.dumps(sys.argv[1:]) + '\\n')
+%(code)s
+sys.exit(fakezvm.main())
+"""
+
+# Code for FAKE_ZEROVM failing the run if a channel names a missing file.
+CHECK_CHANNELS = """
+import os
+_, channels = fakezvm.read_manifest(sys.argv[-1])
+if not all(os.path.exists(channel[0]) for channel in channels):
+    sys.exit(5)
+"""
+
+# Adds a file to the bytecode cache image, as a Python program would.
+WRITE_BYTECODE = """
+import tarfile
+_, channels = fakezvm.read_manifest(sys.argv[-1])
+image = [c[0] for c in channels if c[0].endswith('bytecode.tar')][0]
+with tarfile.open(image, 'a') as tar:
+    tar.addfile(tarfile.TarInfo('run%d.pyc' % len(tar.getmembers())))
+"""
+
+
+class TestZvshFakeZerovm(unittest.TestCase):
+    """
+    Runs of zvsh against fake-zerovm, with the caches of zvsh.cfg.
+    """
+
+    def setUp(self):
+        self.testdir = mkdtemp()
+        self.program = join_path(self.testdir, 'prog.nexe')
+        with open(self.program, 'wb') as fp:
+            fp.write(b'\x7fELF')
+        self.zerovm = join_path(self.testdir, 'zerovm')
+        self.calls = join_path(self.testdir, 'calls')
+        self._write_zerovm()
+        # Settings of zvsh.cfg for the runs.
+        self.config = {'cache': {'path': join_path(self.testdir, 'cache')}}
+        for patch in [
+                mock.patch('zvshlib.zvsh.ZEROVM_EXECUTABLE', self.zerovm),
+                mock.patch('zvshlib.zvsh.ZEROVM_OPTIONS', '-PQ'),
+                mock.patch('zvshlib.zvsh.parse_return_code',
+                           orig_parse_return_code),
+                mock.patch.object(zvshlib.zvsh.ZvShell, 'cleanup',
+                                  zvshlib.zvsh.ZvShell.orig_cleanup)]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        rmtree(self.testdir)
+
+    def _write_zerovm(self, code=''):
+        # ``code`` runs before fake-zerovm, with its command line in argv.
+        with open(self.zerovm, 'w') as fp:
+            fp.write(FAKE_ZEROVM % {'python': sys.executable, 'root': ROOT,
+                                    'calls': self.calls, 'code': code})
+        os.chmod(self.zerovm, 0o755)
+
+    def _calls(self):
+        with open(self.calls) as fp:
+            return [json.loads(line) for line in fp]
+
+    def _run(self, argv, stdin=b''):
+        """
+        Run zvsh with the arguments ``argv`` and ``stdin``, and return its
+        exit code, its stdout, and the Shell.
+        """
+        shell = Shell([ZVSH] + argv)
+        for section, values in self.config.items():
+            shell.config[section].update(values)
+        stdout = io.TextIOWrapper(io.BytesIO())
+        with mock.patch.multiple(
+                'sys', stdin=io.TextIOWrapper(io.BytesIO(stdin)),
+                stdout=stdout, stderr=io.TextIOWrapper(io.BytesIO())):
+            with pytest.raises(SystemExit) as exc:
+                shell.run()
+        stdout.flush()
+        return exc.value.code, stdout.buffer.getvalue(), shell
+
+    def test_plan_cache_bytecode(self):
+        # The second run is stamped out from the plan of the first, bytecode
+        # cache snapshot included, in a new working directory.
+        self.config['cache'].update({'plans': 'yes', 'bytecode': '/pycache'})
+        self._write_zerovm(CHECK_CHANNELS)
+        add_arguments = zvshlib.zvsh.ZvShell.add_arguments
+        tmpdirs = []
+        with mock.patch.object(zvshlib.zvsh.ZvShell, 'add_arguments',
+                               autospec=True,
+                               side_effect=add_arguments) as added:
+            for data in (b'first', b'second'):
+                rc, out, shell = self._run([self.program], stdin=data)
+                self.assertEqual((0, data), (rc, out))
+                tmpdirs.append(shell.zvsh.tmpdir)
+        self.assertEqual(1, added.call_count)
+        self.assertNotEqual(tmpdirs[0], tmpdirs[1])
+        self.assertTrue(join_path(tmpdirs[1], 'bytecode.tar')
+                        in shell.zvsh.temp_files)
+
+    def test_bytecode_cache(self):
+        # The program writes to a snapshot of the shared image, which
+        # replaces it after the run; the second run comes from the plan of
+        # the first and sees what the first one wrote.
+        self.config['cache'].update({'plans': 'yes', 'bytecode': '/pycache'})
+        self._write_zerovm(WRITE_BYTECODE)
+        images = join_path(self.testdir, 'cache', 'bytecode')
+        for members in (['run0.pyc'], ['run0.pyc', 'run1.pyc']):
+            rc, _, shell = self._run([self.program])
+            self.assertEqual(0, rc)
+            snapshot = join_path(shell.zvsh.tmpdir, 'bytecode.tar')
+            self.assertTrue('%s,/pycache,rw' % snapshot
+                            in shell.args.zvm_image)
+            self.assertTrue(('/pycache', 'rw') in
+                            [fstab[1:] for fstab in shell.zvsh.nvram_fstab])
+            self.assertEqual('/pycache',
+                             shell.config['env']['PYTHONPYCACHEPREFIX'])
+            [image] = os.listdir(images)
+            with tarfile.open(join_path(images, image)) as tar:
+                self.assertEqual(members, tar.getnames())
+
+    def test_result_cache(self):
+        # The second identical run is replayed from the result cache: same
+        # output and exit code, without running ZeroVM.
+        self.config['cache']['results'] = 'yes'
+        with mock.patch.dict('os.environ', {'FAKE_ZEROVM_RC': '3'}):
+            for _ in range(2):
+                rc, out, _ = self._run([self.program], stdin=b'hello')
+                self.assertEqual((3, b'hello'), (rc, out))
+            self.assertEqual(1, len(self._calls()))
+            # Another stdin is another run.
+            rc, out, _ = self._run([self.program], stdin=b'world')
+            self.assertEqual((3, b'world'), (rc, out))
+            self.assertEqual(2, len(self._calls()))
+            # As are the changed contents of a channel file.
+            data = join_path(self.testdir, 'data')
+            for contents in (b'1', b'1', b'22'):
+                with open(data, 'wb') as fp:
+                    fp.write(contents)
+                rc, out, _ = self._run([self.program, '@' + data],
+                                       stdin=b'hello')
+                self.assertEqual((3, b'hello'), (rc, out))
+            self.assertEqual(4, len(self._calls()))
+
+    def test_validation_record(self):
+        # Validation is skipped for a nexe which validated under the same
+        # zerovm binary.
+        self.config['cache'].update({
+            'validation': 'yes',
+            'validation_record': join_path(self.testdir, 'validated')})
+
+        def skipped():
+            self.assertEqual(0, self._run([self.program])[0])
+            return zvshlib.zvsh.SKIP_VALIDATION_OPTION in self._calls()[-1]
+
+        file_digest = zvshlib.cache.file_digest
+        with mock.patch('zvshlib.cache.file_digest',
+                        side_effect=file_digest) as digest:
+            self.assertEqual([False, True], [skipped(), skipped()])
+        # Memoized, like the digests of the zerovm binary.
+        self.assertTrue(all(args[1] is not None
+                            for args, _ in digest.call_args_list))
+        # Another nexe.
+        with open(self.program, 'ab') as fp:
+            fp.write(b'\0')
+        self.assertEqual([False, True], [skipped(), skipped()])
+        # Another zerovm binary.
+        self._write_zerovm('# changed')
+        self.assertEqual([False, True], [skipped(), skipped()])
+
+    def test_autosize_converges(self):
+        # Sized from what the runs use, the reservation settles instead of
+        # growing by the headroom on every run.
+        self.config['cache']['profiles'] = 'yes'
+        reserved = []
+        with mock.patch('zvshlib.zvsh.AUTOSIZE_MIN_MEMORY', 1):
+            for _ in range(6):
+                rc, _, shell = self._run(['--zvm-autosize', self.program])
+                self.assertEqual(0, rc)
+                reserved.append(shell.autosize_memory)
+        self.assertEqual([None] * 3, reserved[:3])
+        configured = int(zvshlib.zvsh.DEFAULT_MANIFEST['Memory'])
+        for memory in reserved[3:]:
+            self.assertTrue(memory < configured)
+            self.assertTrue(abs(memory - reserved[3]) < reserved[3] * 0.1)
+
 
 def _read_manifest(file_name):
     with open(file_name) as manifest:
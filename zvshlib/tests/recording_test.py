@@ -0,0 +1,103 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from zvshlib import fakezvm
+from zvshlib import recording
+
+
+def _write(file_path, data):
+    with open(file_path, 'wb') as fp:
+        fp.write(data)
+    return file_path
+
+
+class TestRecording:
+    """
+    Tests for :class:`zvshlib.recording.Recording`.
+    """
+
+    def setup_method(self, _method):
+        self.tempdir = tempfile.mkdtemp()
+        self.workdir = os.path.join(self.tempdir, 'work')
+        os.mkdir(self.workdir)
+        self.record = recording.Recording(os.path.join(self.tempdir, 'rec'))
+        self.nexe = _write(os.path.join(self.tempdir, 'prog.nexe'), b'nexe')
+        self.input = _write(os.path.join(self.workdir, 'input'), b'data')
+        self.manifest = os.path.join(self.workdir, 'manifest.1')
+        with open(self.manifest, 'w') as fp:
+            fp.write('Node = 1\n'
+                     'Program = %(nexe)s\n'
+                     'Channel = %(input)s,/dev/stdin,0,0,10,10,0,0\n'
+                     'Channel = %(work)s/stdout.1,/dev/stdout,0,0,0,0,10,10\n'
+                     'Channel = %(nexe)s,/dev/self,3,0,10,10,0,0\n'
+                     'Channel = tcp:1:2,/dev/net,0,0,10,10,10,10\n'
+                     % {'nexe': self.nexe, 'input': self.input,
+                        'work': self.workdir})
+
+    def teardown_method(self, _method):
+        shutil.rmtree(self.tempdir)
+
+    def test_store(self):
+        digest = self.record.store(self.nexe)
+        assert digest == self.record.store(self.nexe)
+        with open(self.record.object_path(digest), 'rb') as fp:
+            assert b'nexe' == fp.read()
+
+    def test_snapshot_manifest(self):
+        manifest, inputs = self.record.snapshot_manifest(self.manifest,
+                                                         self.workdir)
+        assert ['prog.nexe', 'input'] == [i['name'] for i in inputs]
+        assert ('Node = 1\n'
+                'Program = @@INPUT0@@\n'
+                'Channel = @@INPUT1@@,/dev/stdin,0,0,10,10,0,0\n'
+                'Channel = @@WORKDIR@@/stdout.1,/dev/stdout,0,0,0,0,10,10\n'
+                'Channel = @@INPUT0@@,/dev/self,3,0,10,10,0,0\n'
+                'Channel = tcp:1:2,/dev/net,0,0,10,10,10,10\n') == manifest
+
+    def test_save_load(self):
+        with pytest.raises(RuntimeError):
+            self.record.load()
+        self.record.save({'node': 1})
+        run = self.record.load()
+        assert (1, recording.FORMAT_VERSION) == (run['node'], run['version'])
+
+    def test_replay(self):
+        manifest, inputs = self.record.snapshot_manifest(self.manifest,
+                                                         self.workdir)
+        # The originals go away; the recording has all that is needed.
+        shutil.rmtree(self.workdir)
+        os.unlink(self.nexe)
+        replay_dir = os.path.join(self.tempdir, 'replay')
+        os.mkdir(replay_dir)
+        manifest_file = self.record.materialize(
+            {'node': 1, 'manifest': manifest, 'inputs': inputs}, replay_dir)
+
+        session = fakezvm.Session(manifest_file)
+        assert 0 == session.run()
+        with open(os.path.join(replay_dir, 'stdout.1'), 'rb') as fp:
+            assert b'data' == fp.read()
+
+
+def test_digest_writer():
+    writer = recording.DigestWriter()
+    writer.write(b'ab')
+    writer.write(b'c')
+    assert 3 == writer.size
+    assert writer.hexdigest().startswith('ba7816bf')
@@ -0,0 +1,64 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+import mock
+
+from zvshlib import serializer
+
+
+def test_escape():
+    assert 'plain/path' == serializer.escape('plain/path')
+    assert r'\x5c\x22\x2c\x20\x0a' == serializer.escape('\\", \n')
+
+
+def test_dumps_nvram_skips_empty_sections():
+    text = serializer.dumps_nvram([
+        ('args', [serializer.args_line(['cat', 'a file'])]),
+        ('env', []),
+        ('fstab', iter([serializer.fstab_line('/dev/1.a.tar', '/', 'ro')])),
+    ])
+    assert (
+        '[args]\n'
+        'args = cat a\\x20file\n'
+        '[fstab]\n'
+        'channel=/dev/1.a.tar,mountpoint=/,access=ro,removable=no\n'
+    ) == text
+
+
+class TestDump:
+    """
+    Tests for :func:`zvshlib.serializer.dump`.
+    """
+
+    def setup_method(self, _method):
+        self.tempdir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.tempdir, 'manifest.1')
+
+    def teardown_method(self, _method):
+        shutil.rmtree(self.tempdir)
+
+    def test_dump(self):
+        settings = [('Node', 1), ('Program', '/tmp/boot.1')]
+        channels = [('/tmp/%d' % i, '/dev/%d' % i, 3, 0, 1, 2, 3, 4)
+                    for i in range(10)]
+        with mock.patch('zvshlib.serializer.DUMP_BATCH_SIZE', 3):
+            serializer.dump(self.file_name,
+                            serializer.iter_manifest(settings, channels))
+        with open(self.file_name, 'rb') as fp:
+            assert (serializer.dumps_manifest(settings, channels)
+                    == fp.read().decode('utf-8'))
@@ -0,0 +1,57 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+
+from zvshlib import spans
+
+
+class TestSpans:
+    """
+    Tests for :mod:`zvshlib.spans`.
+    """
+
+    def setup_method(self, _method):
+        self.tempdir = tempfile.mkdtemp()
+
+    def teardown_method(self, _method):
+        shutil.rmtree(self.tempdir)
+        spans._events = None
+
+    def test_disabled(self):
+        with spans.span('phase') as span:
+            pass
+        assert span.duration >= 0
+        assert not spans.enabled()
+
+    def test_dump(self):
+        spans.enable()
+        with spans.span('outer'):
+            with spans.span('inner', node=1):
+                pass
+        spans.dump(self.tempdir)
+
+        [trace_file] = os.listdir(self.tempdir)
+        with open(os.path.join(self.tempdir, trace_file)) as fp:
+            events = json.load(fp)['traceEvents']
+        # Spans are recorded as they end.
+        assert ['inner', 'outer'] == [e['name'] for e in events]
+        inner, outer = events
+        assert {'node': 1} == inner['args']
+        assert 'X' == inner['ph']
+        assert outer['ts'] <= inner['ts']
+        assert inner['dur'] <= outer['dur']
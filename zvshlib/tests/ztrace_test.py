@@ -0,0 +1,128 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+
+from zvshlib import ztrace
+
+MANIFEST = """\
+Node = 1
+Program = /tmp/boot.1
+Channel = /dev/stdin,/dev/stdin,0,0,1,2,0,0
+Channel = /tmp/out,/dev/stdout,0,0,0,0,1,2
+Channel = /tmp/img.tar,/dev/1.img.tar,3,0,1,2,1,2
+"""
+
+
+def _read(handle, offset, nbytes, time=0.0):
+    return ztrace.Event(time, 0.001, 'read', handle, 4096, offset, nbytes)
+
+
+class TestTraceAnalysis:
+    """
+    Tests for :class:`zvshlib.ztrace.TraceAnalysis`.
+    """
+
+    def setup_method(self, _method):
+        self.tempdir = tempfile.mkdtemp()
+        self.manifest = os.path.join(self.tempdir, 'manifest.1')
+        with open(self.manifest, 'w') as fp:
+            fp.write(MANIFEST)
+
+    def teardown_method(self, _method):
+        shutil.rmtree(self.tempdir)
+
+    def test_read_manifest(self):
+        channels = ztrace.read_manifest(self.manifest)
+        assert ['/dev/stdin', '/dev/stdout', '/dev/1.img.tar'] == [
+            c.alias for c in channels]
+        assert (2, '/tmp/img.tar', 3) == (channels[2].handle, channels[2].uri,
+                                          channels[2].access_type)
+
+    def test_find_manifest(self):
+        assert self.manifest == ztrace.find_manifest(self.tempdir,
+                                                     'zvsh.trace.log')
+        assert self.manifest == ztrace.find_manifest(self.tempdir,
+                                                     'zvsh.trace.1.log')
+        assert ztrace.find_manifest(self.tempdir, 'zvsh.trace.2.log') is None
+
+    def test_find_manifest__nodes(self):
+        # A --zvm-nodes run: one manifest and one trace log per node.
+        manifests = {}
+        for node_id in (2, 3):
+            manifests[node_id] = os.path.join(self.tempdir,
+                                              'manifest.%d' % node_id)
+            with open(manifests[node_id], 'w') as fp:
+                fp.write(MANIFEST.replace('Node = 1', 'Node = %d' % node_id))
+        assert self.manifest == ztrace.find_manifest(self.tempdir,
+                                                     'zvsh.trace.log')
+        assert self.manifest == ztrace.find_manifest(self.tempdir)
+        assert manifests[3] == ztrace.find_manifest(
+            self.tempdir, os.path.join(self.tempdir, 'zvsh.trace.3.log'))
+        assert manifests[2] == ztrace.find_manifest(self.tempdir,
+                                                    'zvsh.trace.2.log')
+        assert ztrace.find_manifest(self.tempdir, 'zvsh.trace.4.log') is None
+        # Without node 1, a log without an index can't be matched.
+        os.unlink(self.manifest)
+        assert ztrace.find_manifest(self.tempdir, 'zvsh.trace.log') is None
+
+    def test_stats(self):
+        log = [
+            '1 0.000010 0.000002 TrapRead(0, 0x1000, 65536, 0) = 5',
+            '2 0.000020 0.000003 TrapWrite(/dev/stdout, 0x1000, 5, 0) = 5',
+            '3 0.000030 0.000001 TrapExit(0) = 0',
+        ]
+        analysis = ztrace.TraceAnalysis(
+            ztrace.parse_log(log), ztrace.read_manifest(self.manifest))
+        stdin = analysis.channels[0]
+        assert (1, 5, 0, 0) == (stdin.reads, stdin.rbytes, stdin.writes,
+                                stdin.wbytes)
+        assert 1 == analysis.channels['/dev/stdout'].writes
+        assert '/dev/stdin (/dev/stdin)' == analysis.channel_name(0)
+        assert [1, 0, 0.000001] == analysis.calls['exit']
+
+        timeline = analysis.timeline(2)
+        assert [(1, 5, 0, 0), (0, 0, 1, 5)] == [row[1:] for row in timeline]
+
+    def test_warnings(self):
+        # The image is read front to back, in tiny pieces.
+        events = [_read(2, i * 10, 10) for i in range(ztrace.TINY_READ_STORM)]
+        analysis = ztrace.TraceAnalysis(
+            events, ztrace.read_manifest(self.manifest))
+        [storm, scan] = analysis.warnings()
+        assert storm.startswith('tiny-read storm on image channel '
+                                '/dev/1.img.tar (/tmp/img.tar)')
+        assert scan.startswith('sequential scan of random access channel')
+
+        # Without a manifest, the access type of the channel is unknown.
+        [storm] = ztrace.TraceAnalysis(events).warnings()
+        assert storm.startswith('tiny-read storm on channel 2:')
+
+    def test_main(self):
+        trace_log = os.path.join(self.tempdir, 'zvsh.trace.log')
+        with open(trace_log, 'w') as fp:
+            fp.write('ZeroVM trace\n'
+                     '0.000010 TrapRead(/dev/1.img.tar, 0x1, 10, 0) = 10\n')
+        with mock.patch('sys.stdout') as stdout:
+            ztrace.main([trace_log, '--save-dir', self.tempdir, '--json'])
+        stats = json.loads(''.join(call[0][0]
+                                   for call in stdout.write.call_args_list))
+        channel = stats['channels']['/dev/1.img.tar']
+        assert '/dev/1.img.tar (/tmp/img.tar)' == channel['name']
+        assert (1, 10) == (channel['reads'], channel['rbytes'])
@@ -15,6 +15,7 @@
 import mock
 import os
 import pytest
+import shutil
 import tempfile
 
 try:
@@ -101,6 +102,57 @@ class TestChannel:
         assert exp == repr(chan)
 
 
+class TestChannelTable:
+    """
+    Tests for :class:`zvshlib.zvsh.ChannelTable`.
+    """
+
+    def test_add_all(self):
+        table = zvsh.ChannelTable()
+        table.add_all(('/srv/obj%d' % i, '/dev/%d.obj' % i,
+                       zvsh.RND_READ_RND_WRITE, (1, 2, 0, 0))
+                      for i in range(1000))
+        table.add_all([('/dev/stdin', '/dev/stdin', zvsh.SEQ_READ_SEQ_WRITE,
+                        None)])
+        assert 1001 == len(table)
+        # Channels with the same access type and limits share one spec.
+        assert 2 == len(table.specs)
+
+        lines = list(table.lines())
+        assert 'Channel = /srv/obj0,/dev/0.obj,3,0,1,2,0,0' == lines[0]
+        exp = ('Channel = /dev/stdin,/dev/stdin,0,0,4294967296,4294967296,'
+               '4294967296,4294967296')
+        assert exp == lines[-1]
+
+    def test_channels(self):
+        chan = zvsh.Channel('/dev/stdin', '/dev/stdin', 0, etag=1, gets=10,
+                            get_size=20, puts=0, put_size=0)
+        table = zvsh.ChannelTable([chan])
+        assert [str(chan)] == [str(c) for c in table]
+        assert [str(chan)] == list(table.lines())
+
+    def test_list_operations(self):
+        table = zvsh.ChannelTable(
+            zvsh.Channel('/srv/%d' % i, '/dev/%d' % i, 3) for i in range(4))
+        assert ['/srv/1', '/srv/2'] == [c.uri for c in table[1:3]]
+        assert '/srv/3' == table[-1].uri
+
+        # Channels are copies, which have to be assigned back.
+        chan = table[0]
+        chan.uri = '/srv/new'
+        assert '/srv/0' == table[0].uri
+        table[0] = chan
+        assert '/srv/new' == table[0].uri
+
+        table[1:3] = [zvsh.Channel('/dev/stdin', '/dev/stdin', 0, puts=0)]
+        assert ['/srv/new', '/dev/stdin', '/srv/3'] == [c.uri for c in table]
+        assert 0 == table[1].puts
+        del table[0]
+        assert ['/dev/stdin', '/srv/3'] == [c.uri for c in table]
+        assert ('Channel = /srv/3,/dev/3,3,0,4294967296,4294967296,'
+                '4294967296,4294967296') == list(table.lines())[-1]
+
+
 class TestManifest:
     """
     Tests for :class:`zvshlib.zvsh.Manifest`.
@@ -249,6 +301,47 @@ Channel = /usr/share/bar.tar,/dev/2.bar.tar,3,0,16,32,64,128"""
     assert manifest.dumps() == expected_manifest_text
 
 
+def test_parse_validator_state():
+    # Test for :func:`zvshlib.zvsh.parse_validator_state`.
+    assert 0 == zvsh.parse_validator_state('0\n0\n0\n\n\nok\n')
+    assert 1 == zvsh.parse_validator_state(
+        'validator state = 1\n0\n0\n\n\nok\n')
+
+
+def test_parse_report():
+    # Test for :func:`zvshlib.zvsh.parse_report`.
+    report = zvsh.parse_report(
+        '0\n0\n1\n/dev/stdout 0a1b\n'
+        '0.01 0.02 8192 0 3 40 5 60 0 0 0 0\nok\n')
+    assert (0, 0, 1, '/dev/stdout 0a1b', 'ok') == (
+        report.validator_state, report.daemon, report.return_code,
+        report.etag, report.status)
+    assert dict(sys_time=0.01, user_time=0.02, memory=8192, swap=0,
+                reads=3, rbytes=40, writes=5, wbytes=60, net_reads=0,
+                net_rbytes=0, net_writes=0, net_wbytes=0) == report.accounting
+
+    with pytest.raises(ValueError):
+        zvsh.parse_report('0\nbusy\n0\n\n\nok\n')
+    # Fields missing from a truncated report are None.
+    assert zvsh.parse_report('0\n0\n').return_code is None
+
+
+def test_parse_report_zerovm():
+    # The report as ZeroVM writes it, with keys.
+    report = zvsh.parse_report(
+        'validator state = 0\n'
+        'daemon pid = 0\n'
+        'user return code = 0\n'
+        'etag(s) = disabled\n'
+        'accounting = 0.00 0.01 4294967296 0 12 3021 2 40 0 0 0 0\n'
+        'exit state = ok\n')
+    assert (0, 0, 0, 'disabled', 'ok') == (
+        report.validator_state, report.daemon, report.return_code,
+        report.etag, report.status)
+    assert 4294967296 == report.accounting['memory']
+    assert 3021 == report.accounting['rbytes']
+
+
 def test__check_runtime_files():
     # Test for :func:`zvshlib.zvsh._check_runtime_files`.
     _, file_a = tempfile.mkstemp()
@@ -263,3 +356,167 @@ def test__check_runtime_files():
     # A case where none of the files exist:
     os.unlink(file_a)
     zvsh._check_runtime_files(files)
+
+
+def test__create_run_dir():
+    # Test for :func:`zvshlib.zvsh._create_run_dir`.
+    save_dir = tempfile.mkdtemp()
+    try:
+        runs = []
+        for _ in range(3):
+            runs.append(zvsh._create_run_dir(save_dir, keep=2))
+            zvsh._release_run_dir(runs[-1])
+        run_names = [os.path.basename(run) for run in runs]
+        # Names are unique and sort in creation order.
+        assert sorted(set(run_names)) == run_names
+
+        # Only the two newest runs are kept.
+        assert not os.path.exists(runs[0])
+        assert os.path.isdir(runs[1])
+        assert os.path.isdir(runs[2])
+        with open(os.path.join(save_dir, 'index')) as index_fp:
+            assert run_names[1:] == index_fp.read().split()
+        assert run_names[2] == os.readlink(os.path.join(save_dir, 'latest'))
+    finally:
+        shutil.rmtree(save_dir)
+
+
+def test__create_run_dir_in_use():
+    # Runs still in progress are not pruned by :func:`_create_run_dir`.
+    save_dir = tempfile.mkdtemp()
+    try:
+        busy = zvsh._create_run_dir(save_dir, keep=1)
+        done = zvsh._create_run_dir(save_dir, keep=1)
+        zvsh._release_run_dir(done)
+        newest = zvsh._create_run_dir(save_dir, keep=1)
+        # busy is past the limit, but its run holds its lock.
+        assert os.path.isdir(busy)
+        assert not os.path.exists(done)
+        with open(os.path.join(save_dir, 'index')) as index_fp:
+            assert ([os.path.basename(busy), os.path.basename(newest)]
+                    == index_fp.read().split())
+
+        zvsh._release_run_dir(busy)
+        zvsh._release_run_dir(newest)
+        zvsh._create_run_dir(save_dir, keep=1)
+        assert not os.path.exists(busy)
+    finally:
+        for run_dir in list(zvsh._run_locks):
+            zvsh._release_run_dir(run_dir)
+        shutil.rmtree(save_dir)
+
+
+def test_shell__autosize():
+    # Test for :meth:`zvshlib.zvsh.Shell._autosize`.
+    shell = zvsh.Shell(['zvsh', '--zvm-autosize', 'prog.nexe'])
+    samples = [dict(memory=m * 1024 * 1024, runtime=1.5, reads=10,
+                    rbytes=4096, writes=2 * 1024, wbytes=8 * 1024 * 1024)
+               for m in (100, 200, 300)]
+
+    # Too few runs to go by.
+    shell._autosize(samples[:2])
+    assert zvsh.DEFAULT_MANIFEST['Memory'] == \
+        shell.config['manifest']['Memory']
+
+    shell._autosize(samples)
+    assert '%d' % (450 * 1024 * 1024) == shell.config['manifest']['Memory']
+    assert 3 == shell.config['manifest']['Timeout']
+    limits = shell.config['limits']
+    assert ('1024', '1048576', '3072', '12582912') == (
+        limits['reads'], limits['rbytes'], limits['writes'], limits['wbytes'])
+    assert 450 * 1024 * 1024 == shell.autosize_memory
+
+    # Never above the configured values.
+    shell = zvsh.Shell(['zvsh', '--zvm-autosize', 'prog.nexe'])
+    shell.config['manifest'].update({'Memory': '%d' % (256 * 1024 * 1024),
+                                     'Timeout': '2'})
+    shell.config['limits']['wbytes'] = '4096'
+    shell._autosize(samples)
+    assert '%d' % (256 * 1024 * 1024) == shell.config['manifest']['Memory']
+    assert 2 == shell.config['manifest']['Timeout']
+    assert '4096' == shell.config['limits']['wbytes']
+
+
+def test_shell__add_profile_sample():
+    # Test for :meth:`zvshlib.zvsh.Shell._add_profile_sample`.
+    shell = zvsh.Shell(['zvsh', '--zvm-autosize', 'prog.nexe'])
+    store = mock.Mock()
+    runner = mock.Mock()
+
+    def add(memory):
+        store.reset_mock()
+        runner.report = ('validator state = 0\ndaemon pid = 0\n'
+                         'user return code = 0\netag(s) = disabled\n'
+                         'accounting = 0.10 0.20 %d 0 3 100 4 200 1 10 2 20\n'
+                         'exit state = ok\n' % memory)
+        shell._add_profile_sample((store, 'key'), runner, 0.5)
+        return store.add.call_args_list
+
+    assert [mock.call('key', {'memory': 1000, 'runtime': 0.5, 'reads': 4,
+                              'rbytes': 110, 'writes': 6, 'wbytes': 220})
+            ] == add(1000)
+    # What a run sized by --zvm-autosize used, unless it is the
+    # reservation itself.
+    shell.autosize_memory = 2000
+    assert 1 == len(add(1000))
+    assert [] == add(2000)
+
+
+def test_shell__bench_report(capsys):
+    # Test for :meth:`zvshlib.zvsh.Shell._bench_report`.
+    tempdir = tempfile.mkdtemp()
+    try:
+        csv_file = os.path.join(tempdir, 'bench.csv')
+        shell = zvsh.Shell(['zvsh', '--zvm-bench', '2', '--zvm-bench-csv',
+                            csv_file, 'prog.nexe'])
+        samples = [dict(wall=1.0, cpu=0.5, overhead=0.1, rc=0),
+                   dict(wall=2.0, cpu=None, overhead=0.2, rc=0)]
+        shell._bench_report(samples, 0.25)
+        out, err = capsys.readouterr()
+        lines = out.splitlines()
+        assert '2 runs after 0 warmup runs; setup took 0.2500s' == lines[0]
+        assert ['wall', '1.0000', '1.5000', '1.0000', '2.0000', '2.0000',
+                '0.7071'] == lines[2].split()
+        assert ['cpu', '0.5000'] == lines[3].split()[:2]
+        # Runs this different can't be trusted.
+        assert err.startswith('warning: the wall time varies by 47%')
+        with open(csv_file) as fp:
+            assert ['run,wall,cpu,overhead,rc', '1,1.0,0.5,0.1,0',
+                    '2,2.0,,0.2,0'] == fp.read().splitlines()
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_pump_stats():
+    # Test for :class:`zvshlib.zvsh.PumpStats`.
+    stats = zvsh.PumpStats()
+    chunks = iter([b'abc', b'de', b''])
+    assert [b'abc', b'de'] == list(stats.chunks_of(lambda: next(chunks)))
+    result = stats.as_dict()
+    assert 5 == result['bytes']
+    assert 2 == result['chunks']
+    assert 3 == result['peak_buffered']
+    assert result['read_time'] >= 0
+    assert 0.0 == result['write_time']
+
+
+def test_zvargs_conflicting_options(capsys):
+    # Test for :meth:`zvshlib.zvsh.ZvArgs.parse`.
+    for argv in (['--zvm-bench', '3', '--zvm-nodes', '2'],
+                 ['--zvm-record', 'rec', '--zvm-nodes', '2'],
+                 ['--zvm-record', 'rec', '--zvm-bench', '3']):
+        with pytest.raises(SystemExit):
+            zvsh.ZvArgs().parse(argv + ['prog.nexe'])
+        assert "can't be combined with" in capsys.readouterr()[1]
+    zvsh.ZvArgs().parse(['--zvm-bench', '3', 'prog.nexe'])
+
+
+def test_zvargs_own_arguments():
+    # Subclasses with arguments of their own, like zvapp's, can use parse.
+    class AppArgs(zvsh.ZvArgs):
+        def add_agruments(self):
+            self.parser.add_argument('exec_file')
+
+    app_args = AppArgs()
+    app_args.parse(['job.json'])
+    assert 'job.json' == app_args.args.exec_file
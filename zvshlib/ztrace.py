@@ -0,0 +1,438 @@
+#  Copyright 2014 Rackspace, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Analysis of ZeroVM trace logs, as written with ``zvsh --zvm-trace``.
+
+ZeroVM writes one line per trap (system call) made by the program::
+
+    12 0.004180 0.000021 TrapRead(3, 0x7f0000001000, 65536, 0) = 4096
+
+The line holds an optional sequence number, the time since the start of the
+session, an optional time spent in the call, the call and its arguments, and
+the result. The first argument of an I/O call is the channel, either as its
+handle (the position of the channel in the manifest) or its alias; for reads
+and writes the next arguments are the buffer, the size and the offset.
+Lines which don't look like this, such as session headers, are skipped.
+
+:func:`main` is the ``zvsh-trace`` command.
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+
+from collections import namedtuple
+
+#: Access types of channels which allow random reads; see
+#: :data:`zvshlib.zvsh.RND_READ_SEQ_WRITE`.
+RANDOM_READ_TYPES = (1, 3)
+
+#: Reads of fewer bytes than this are tiny.
+TINY_READ_SIZE = 1024
+#: A channel with at least this many tiny reads, making up most of its reads,
+#: has a tiny-read storm.
+TINY_READ_STORM = 1000
+#: A random access channel with at least this many reads, nearly all of them
+#: continuing where the previous one ended, is scanned sequentially.
+SCAN_MIN_READS = 64
+SCAN_RATIO = 0.9
+
+_LINE = re.compile(
+    r'^\s*(?:(?P<seq>\d+)\s+)?'
+    r'(?P<ts>\d+\.\d+)\s+(?:\[?(?P<dur>\d+\.\d+)\]?\s+)?'
+    r'(?P<call>\w+)\((?P<args>.*)\)\s*=\s*(?P<result>-?(?:0x)?[0-9a-fA-F]+)')
+
+_READ_CALLS = ('read', 'pread')
+_WRITE_CALLS = ('write', 'pwrite')
+
+#: A system call from a trace log. ``channel`` is None for calls which don't
+#: act on a channel, ``size`` and ``offset`` are None for calls other than
+#: reads and writes, and ``duration`` is None when the log doesn't show it.
+Event = namedtuple('Event', ['time', 'duration', 'call', 'channel', 'size',
+                             'offset', 'result'])
+
+#: A channel of the manifest of a run.
+ManifestChannel = namedtuple('ManifestChannel', ['handle', 'uri', 'alias',
+                                                 'access_type'])
+
+
+def _call_name(name):
+    """
+    >>> _call_name('TrapRead')
+    'read'
+    >>> _call_name('pwrite')
+    'pwrite'
+    """
+    name = name.lower()
+    if name.startswith('trap') and len(name) > 4:
+        name = name[4:]
+    return name
+
+
+def _number(text):
+    try:
+        return int(text, 0)
+    except ValueError:
+        return None
+
+
+def _channel(text):
+    text = text.strip().strip('"\'')
+    if text.isdigit():
+        return int(text)
+    if text.startswith('/'):
+        return text
+    return None
+
+
+def parse_line(line):
+    """
+    Parse one line of a trace log into an :class:`Event`, or None if the line
+    isn't a system call.
+
+    >>> parse_line('1 0.5 0.25 TrapRead(3, 0x1000, 64, 128) = 10')
+    Event(time=0.5, duration=0.25, call='read', channel=3, size=64, \
+offset=128, result=10)
+    >>> parse_line('0.5 TrapExit(0) = 0').channel is None
+    True
+    >>> parse_line('ZeroVM trace') is None
+    True
+    """
+    match = _LINE.match(line)
+    if match is None:
+        return None
+    call = _call_name(match.group('call'))
+    args = match.group('args').split(',')
+    channel = size = offset = None
+    if call in _READ_CALLS + _WRITE_CALLS:
+        channel = _channel(args[0])
+        if len(args) > 2:
+            size = _number(args[2].strip())
+        if len(args) > 3:
+            offset = _number(args[3].strip())
+    elif call not in ('exit', 'fork') and args[0].strip():
+        channel = _channel(args[0])
+    dur = match.group('dur')
+    return Event(float(match.group('ts')),
+                 None if dur is None else float(dur), call, channel, size,
+                 offset, _number(match.group('result')))
+
+
+def parse_log(fp):
+    """
+    Generate the :class:`Event` objects of the trace log open in ``fp``.
+    """
+    for line in fp:
+        event = parse_line(line)
+        if event is not None:
+            yield event
+
+
+def read_manifest(manifest_file):
+    """
+    Read the channels of a manifest, in the order ZeroVM gives them handles.
+
+    :returns:
+        `list` of :class:`ManifestChannel`.
+    """
+    channels = []
+    with open(manifest_file) as fp:
+        for line in fp:
+            key, _, value = line.partition('=')
+            if key.strip() != 'Channel':
+                continue
+            fields = [f.strip() for f in value.split(',')]
+            channels.append(ManifestChannel(len(channels), fields[0],
+                                            fields[1], _number(fields[2])))
+    return channels
+
+
+def find_manifest(save_dir, trace_log=None):
+    """
+    Find the manifest of the run traced in ``trace_log`` in ``save_dir``,
+    which is either the directory of a single run or a directory of runs
+    kept with ``--zvm-save-runs``, in which case the latest run is used.
+
+    The node is taken from the trace log name, as in ``zvsh.trace.2.log``;
+    ``zvsh.trace.log`` is the log of node 1. A lone manifest of another name
+    is used for a log without a node index.
+
+    :returns:
+        Path of the manifest, or None if it can't be found.
+    """
+    latest = os.path.join(save_dir, 'latest')
+    if os.path.isdir(latest):
+        save_dir = latest
+    match = re.search(r'\.(\d+)\.log$', trace_log or '')
+    node_id = match.group(1) if match is not None else '1'
+    manifest_file = os.path.join(save_dir, 'manifest.%s' % node_id)
+    if os.path.isfile(manifest_file):
+        return manifest_file
+    if match is None:
+        manifests = glob.glob(os.path.join(save_dir, 'manifest.*'))
+        if len(manifests) == 1:
+            return manifests[0]
+    return None
+
+
+class ChannelStats(object):
+    """
+    I/O statistics of one channel.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.reads = 0
+        self.rbytes = 0
+        self.rtime = 0.0
+        self.writes = 0
+        self.wbytes = 0
+        self.wtime = 0.0
+        self.tiny_reads = 0
+        self.sequential_reads = 0
+        self._next_offset = 0
+
+    def add(self, event):
+        nbytes = max(event.result or 0, 0)
+        duration = event.duration or 0.0
+        if event.call in _READ_CALLS:
+            self.reads += 1
+            self.rbytes += nbytes
+            self.rtime += duration
+            if nbytes < TINY_READ_SIZE:
+                self.tiny_reads += 1
+            if event.offset is not None:
+                if event.offset == self._next_offset:
+                    self.sequential_reads += 1
+                self._next_offset = event.offset + nbytes
+        else:
+            self.writes += 1
+            self.wbytes += nbytes
+            self.wtime += duration
+
+    def as_dict(self):
+        return {
+            'reads': self.reads, 'rbytes': self.rbytes, 'rtime': self.rtime,
+            'writes': self.writes, 'wbytes': self.wbytes,
+            'wtime': self.wtime,
+        }
+
+
+class TraceAnalysis(object):
+    """
+    Statistics of a trace log.
+
+    :param events:
+        Iterable of :class:`Event`, see :func:`parse_log`.
+    :param manifest_channels:
+        Optional `list` of :class:`ManifestChannel`, see
+        :func:`read_manifest`, used to name channels known by their handle
+        and to tell which channels allow random access.
+    """
+
+    def __init__(self, events, manifest_channels=None):
+        self.manifest_channels = manifest_channels or []
+        self._by_alias = dict((c.alias, c) for c in self.manifest_channels)
+        # Statistics per channel, keyed by handle or alias as in the log.
+        self.channels = {}
+        # call name -> [count, bytes, time]
+        self.calls = {}
+        # (time, call, channel, bytes) of each read and write.
+        self.io = []
+        self.start = None
+        self.end = None
+        for event in events:
+            self.add(event)
+
+    def add(self, event):
+        if self.start is None:
+            self.start = event.time
+        self.end = event.time
+        nbytes = 0
+        if event.call in _READ_CALLS + _WRITE_CALLS:
+            nbytes = max(event.result or 0, 0)
+            stats = self.channels.get(event.channel)
+            if stats is None:
+                stats = self.channels[event.channel] = ChannelStats(
+                    self.resolve(event.channel))
+            stats.add(event)
+            self.io.append((event.time, event.call, event.channel, nbytes))
+        call = self.calls.setdefault(event.call, [0, 0, 0.0])
+        call[0] += 1
+        call[1] += nbytes
+        call[2] += event.duration or 0.0
+
+    def resolve(self, channel):
+        """
+        Get the :class:`ManifestChannel` for a channel handle or alias, or
+        None if there's no manifest or the channel isn't in it.
+        """
+        if isinstance(channel, int):
+            if 0 <= channel < len(self.manifest_channels):
+                return self.manifest_channels[channel]
+            return None
+        return self._by_alias.get(channel)
+
+    def channel_name(self, channel):
+        """
+        Describe a channel by its alias and the file it maps to, if known.
+        """
+        manifest_channel = self.resolve(channel)
+        if manifest_channel is None:
+            return str(channel)
+        return '%s (%s)' % (manifest_channel.alias, manifest_channel.uri)
+
+    def timeline(self, buckets=20):
+        """
+        Split the session into ``buckets`` intervals of equal length.
+
+        :returns:
+            `list` of (start time, reads, bytes read, writes, bytes written)
+            tuples, one for each interval.
+        """
+        if not self.io:
+            return []
+        start = self.start
+        width = (self.end - start) / buckets or 1.0
+        rows = [[start + i * width, 0, 0, 0, 0] for i in range(buckets)]
+        for time, call, _, nbytes in self.io:
+            row = rows[min(int((time - start) / width), buckets - 1)]
+            if call in _READ_CALLS:
+                row[1] += 1
+                row[2] += nbytes
+            else:
+                row[3] += 1
+                row[4] += nbytes
+        return [tuple(row) for row in rows]
+
+    def warnings(self):
+        """
+        Look for access patterns which waste time.
+
+        :returns:
+            `list` of messages.
+        """
+        warnings = []
+        for channel, stats in sorted(self.channels.items(), key=_sort_key):
+            name = self.channel_name(channel)
+            if (stats.tiny_reads >= TINY_READ_STORM
+                    and stats.tiny_reads * 2 > stats.reads):
+                kind = 'channel'
+                if getattr(stats.channel, 'uri', '').endswith('.tar'):
+                    kind = 'image channel'
+                warnings.append(
+                    'tiny-read storm on %s %s: %d of %d reads are under %d '
+                    'bytes (%.1f bytes on average); read in larger blocks'
+                    % (kind, name, stats.tiny_reads, stats.reads,
+                       TINY_READ_SIZE, float(stats.rbytes) / stats.reads))
+            access_type = getattr(stats.channel, 'access_type', None)
+            if (access_type in RANDOM_READ_TYPES
+                    and stats.reads >= SCAN_MIN_READS
+                    and stats.sequential_reads >= SCAN_RATIO * stats.reads):
+                warnings.append(
+                    'sequential scan of random access channel %s: %d of %d '
+                    'reads continue where the previous one ended; a '
+                    'sequential channel or larger reads would be cheaper'
+                    % (name, stats.sequential_reads, stats.reads))
+        return warnings
+
+    def as_dict(self, buckets=20):
+        return {
+            'channels': dict(
+                (str(channel), dict(stats.as_dict(),
+                                    name=self.channel_name(channel)))
+                for channel, stats in self.channels.items()),
+            'calls': dict(
+                (call, {'count': count, 'bytes': nbytes, 'time': time})
+                for call, (count, nbytes, time) in self.calls.items()),
+            'timeline': self.timeline(buckets),
+            'warnings': self.warnings(),
+        }
+
+    def report(self, buckets=20):
+        """
+        Get a plain text report of the statistics.
+        """
+        lines = ['Channels:',
+                 '%-40s %8s %12s %9s %8s %12s %9s'
+                 % ('channel', 'reads', 'bytes', 'time', 'writes', 'bytes',
+                    'time')]
+        for channel, stats in sorted(self.channels.items(), key=_sort_key):
+            lines.append('%-40s %8d %12d %9.4f %8d %12d %9.4f'
+                         % (self.channel_name(channel), stats.reads,
+                            stats.rbytes, stats.rtime, stats.writes,
+                            stats.wbytes, stats.wtime))
+        lines.extend(['', 'System calls:',
+                      '%-20s %8s %12s %9s' % ('call', 'count', 'bytes',
+                                              'time')])
+        for call, (count, nbytes, time) in sorted(self.calls.items()):
+            lines.append('%-20s %8d %12d %9.4f' % (call, count, nbytes, time))
+        lines.extend(['', 'Timeline:',
+                      '%10s %8s %12s %8s %12s' % ('time', 'reads', 'bytes',
+                                                  'writes', 'bytes')])
+        for row in self.timeline(buckets):
+            lines.append('%10.4f %8d %12d %8d %12d' % row)
+        warnings = self.warnings()
+        if warnings:
+            lines.extend(['', 'Warnings:'])
+            lines.extend('- %s' % warning for warning in warnings)
+        return '\n'.join(lines)
+
+
+def _sort_key(item):
+    # Handles and aliases can't be compared on Python 3.
+    return (not isinstance(item[0], int), str(item[0]).zfill(10))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='zvsh-trace',
+        description='Summarize the I/O of a ZeroVM trace log',
+    )
+    parser.add_argument('trace_log', help='trace log, e.g. zvsh.trace.log')
+    parser.add_argument(
+        '--save-dir', '-s',
+        help='--zvm-save-dir of the traced run, used to map channels to '
+             'the files in its manifest',
+    )
+    parser.add_argument('--manifest', '-m',
+                        help='manifest of the traced run')
+    parser.add_argument('--buckets', type=int, default=20,
+                        help='number of intervals in the timeline')
+    parser.add_argument('--json', action='store_true',
+                        help='print the statistics as JSON')
+    args = parser.parse_args(argv)
+
+    manifest_file = args.manifest
+    if manifest_file is None and args.save_dir is not None:
+        manifest_file = find_manifest(args.save_dir, args.trace_log)
+        if manifest_file is None:
+            parser.error('no manifest for %s in %s'
+                         % (args.trace_log, args.save_dir))
+    manifest_channels = None
+    if manifest_file is not None:
+        manifest_channels = read_manifest(manifest_file)
+
+    with open(args.trace_log) as fp:
+        analysis = TraceAnalysis(parse_log(fp), manifest_channels)
+    if args.json:
+        json.dump(analysis.as_dict(args.buckets), sys.stdout, indent=2,
+                  sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        print(analysis.report(args.buckets))
@@ -19,7 +19,14 @@ except ImportError:
     import ConfigParser
 import argparse
 import array
+import csv
+import datetime
+import errno
 import fcntl
+import functools
+import hashlib
+import json
+import math
 import os
 import re
 import shutil
@@ -31,6 +38,7 @@ from pty import _read as pty_read
 from pty import _copy as pty_copy
 import pty
 import threading
+import time
 import tty
 
 try:
@@ -38,11 +46,19 @@ try:
 except ImportError:
     # Python 2.6 fallback
     from ordereddict import OrderedDict
+from collections import namedtuple
 
 from os import path
 from subprocess import Popen, PIPE
 from tempfile import mkdtemp
 
+import zvshlib
+from zvshlib import cache
+from zvshlib import cprofile
+from zvshlib import recording
+from zvshlib import serializer
+from zvshlib import spans
+
 
 ENV_MATCH = re.compile(r'([_A-Z0-9]+)=(.*)')
 DEFAULT_MANIFEST = {
@@ -57,10 +73,43 @@ DEFAULT_LIMITS = {
     'writes': str(1024 * 1024 * 1024 * 4),
     'wbytes': str(1024 * 1024 * 1024 * 4)
 }
-CHANNEL_SEQ_READ_TEMPLATE = 'Channel = %s,%s,0,0,%s,%s,0,0'
-CHANNEL_SEQ_WRITE_TEMPLATE = 'Channel = %s,%s,0,0,0,0,%s,%s'
-CHANNEL_RANDOM_RW_TEMPLATE = 'Channel = %s,%s,3,0,%s,%s,%s,%s'
-CHANNEL_RANDOM_RO_TEMPLATE = 'Channel = %s,%s,3,0,%s,%s,0,0'
+DEFAULT_CACHE = {
+    'path': '~/.cache/zvsh',
+    'results': 'no',
+    'results_size': str(256 * 1024 * 1024),
+    'validation': 'no',
+    'validation_record': '',
+    'bytecode': '',
+    'plans': 'no',
+    'plans_size': str(256 * 1024 * 1024),
+    'profiles': 'no',
+    'profiles_keep': '20',
+    'autosize_percentile': '95',
+    'autosize_headroom': '1.5',
+    'autosize_min_runs': '3',
+}
+# Fields of the accounting line of the ZeroVM report: system and user CPU
+# seconds, memory and swap bytes, then the number of reads, bytes read,
+# number of writes and bytes written on local and on network channels.
+ACCOUNTING_FIELDS = ('sys_time', 'user_time', 'memory', 'swap',
+                     'reads', 'rbytes', 'writes', 'wbytes',
+                     'net_reads', 'net_rbytes', 'net_writes', 'net_wbytes')
+# Fields of the resource usage of the ZeroVM process, as returned by
+# os.wait4, which go into --zvm-stats.
+RUSAGE_FIELDS = ('ru_utime', 'ru_stime', 'ru_maxrss', 'ru_minflt',
+                 'ru_majflt', 'ru_inblock', 'ru_oublock', 'ru_nvcsw',
+                 'ru_nivcsw')
+# Streams ZvRunner relays, each with its PumpStats.
+PUMP_STREAMS = ('stdin', 'stdout', 'stderr', 'report')
+# --zvm-autosize never goes below these.
+AUTOSIZE_MIN_MEMORY = 64 * 1024 * 1024
+AUTOSIZE_MIN_OPS = 1024
+AUTOSIZE_MIN_BYTES = 1024 * 1024
+# Statistics --zvm-bench reports for each measure.
+BENCH_STATS = ('min', 'mean', 'p50', 'p95', 'p99', 'stdev')
+# --zvm-bench warns when the standard deviation of the wall time of the runs
+# is more than this fraction of the mean.
+BENCH_MAX_VARIATION = 0.1
 
 DEBUG_TEMPLATE = '''set confirm off
 b CreateSession
@@ -72,24 +121,6 @@ c
 d br
 '''
 
-NVRAM_TEMPLATE = """\
-[args]
-args = %(args)s
-[fstab]
-%(fstab)s
-[mapping]
-%(mapping)s"""
-
-CHANNEL_MAPPING_TEMPLATE = "channel=/dev/%s,mode=%s\n"
-
-MANIFEST_TEMPLATE = """\
-Node = %(node)s
-Version = %(version)s
-Timeout = %(timeout)s
-Memory = %(memory)s
-Program = %(program)s
-%(channels)s"""
-
 MANIFEST_DEFAULTS = dict(
     version='20130611',
     memory=4294967296,
@@ -114,6 +145,7 @@ ZEROVM_EXECUTABLE = 'zerovm'
 ZEROVM_OPTIONS = '-PQ'
 DEBUG_EXECUTABLE = 'zerovm-dbg'
 DEBUG_OPTIONS = '-sPQ'
+SKIP_VALIDATION_OPTION = '-s'
 GDB = 'x86_64-nacl-gdb'
 
 
@@ -154,6 +186,8 @@ class Channel(object):
 
         Default: 4294967296
     """
+    __slots__ = ('uri', 'alias', 'access_type', 'etag', 'gets', 'get_size',
+                 'puts', 'put_size')
 
     def __init__(self, uri, alias, access_type,
                  etag=0,
@@ -170,16 +204,165 @@ class Channel(object):
         self.puts = puts
         self.put_size = put_size
 
+    def astuple(self):
+        """
+        Get the channel as a `tuple`, as taken by
+        :func:`zvshlib.serializer.format_channel`.
+        """
+        return (self.uri, self.alias, self.access_type, self.etag,
+                self.gets, self.get_size, self.puts, self.put_size)
+
     def __str__(self):
-        return 'Channel = %s,%s,%s,%s,%s,%s,%s,%s' % (
-            self.uri, self.alias, self.access_type, self.etag,
-            self.gets, self.get_size, self.puts, self.put_size
-        )
+        return serializer.format_channel(self.astuple())
 
     def __repr__(self):
         return '<%s>' % self.__str__()
 
 
+class ChannelTable(object):
+    """
+    Compact storage for the channels of a manifest, for manifests with
+    thousands of channels.
+
+    Most channels share their access type, etag and limits with many
+    others, so each distinct combination of those (a "spec") is stored once.
+    Each channel only takes its uri, its alias and the index of its spec, and
+    channel lines are formatted in bulk, with
+    :func:`zvshlib.serializer.iter_channel_lines`.
+
+    The table can be used like a `list` of :class:`Channel` objects, with
+    indexes, slices, assignment and ``del``, except that the channels it
+    returns are copies: changing one doesn't change the table, until it is
+    assigned back with ``table[index] = channel``. To add many channels at
+    once, use :meth:`add_all`.
+
+    :param channels:
+        Optional. Iterable of :class:`Channel` objects to start with.
+    """
+    __slots__ = ('uris', 'aliases', 'spec_ids', 'specs', '_spec_index')
+
+    #: Limits of channels added without any, as (gets, get size, puts, put
+    #: size).
+    DEFAULT_LIMITS = (GETS_DEFAULT, GET_SIZE_DEFAULT_BYTES, PUTS_DEFAULT,
+                      PUT_SIZE_DEFAULT_BYTES)
+
+    def __init__(self, channels=None):
+        self.uris = []
+        self.aliases = []
+        self.spec_ids = array.array('I')
+        self.specs = []
+        self._spec_index = {}
+        if channels is not None:
+            self.extend(channels)
+
+    def _spec_id(self, spec):
+        spec_id = self._spec_index.get(spec)
+        if spec_id is None:
+            spec_id = len(self.specs)
+            self.specs.append(spec)
+            self._spec_index[spec] = spec_id
+        return spec_id
+
+    def add(self, uri, alias, access_type, limits=None, etag=0):
+        """
+        Add a channel.
+
+        :param limits:
+            Optional. (gets, get size, puts, put size) `tuple`; defaults to
+            :attr:`DEFAULT_LIMITS`.
+        """
+        self.uris.append(uri)
+        self.aliases.append(alias)
+        self.spec_ids.append(self._spec_id(
+            (access_type, etag) + tuple(limits or self.DEFAULT_LIMITS)))
+
+    def add_all(self, channels):
+        """
+        Add many channels.
+
+        :param channels:
+            Iterable of (uri, alias, access type, limits) tuples. ``limits``
+            is as for :meth:`add`.
+        """
+        uris_append = self.uris.append
+        aliases_append = self.aliases.append
+        spec_ids_append = self.spec_ids.append
+        spec_id = self._spec_id
+        default_limits = self.DEFAULT_LIMITS
+        # Consecutive channels tend to have the same spec.
+        last_key = last_id = None
+        for uri, alias, access_type, limits in channels:
+            uris_append(uri)
+            aliases_append(alias)
+            key = (access_type, limits)
+            if key != last_key:
+                last_id = spec_id((access_type, 0)
+                                  + tuple(limits or default_limits))
+                last_key = key
+            spec_ids_append(last_id)
+
+    def append(self, channel):
+        """
+        Add a :class:`Channel`.
+        """
+        self.add(channel.uri, channel.alias, channel.access_type,
+                 (channel.gets, channel.get_size, channel.puts,
+                  channel.put_size),
+                 etag=channel.etag)
+
+    def extend(self, channels):
+        """
+        Add an iterable of :class:`Channel` objects.
+        """
+        for channel in channels:
+            self.append(channel)
+
+    def lines(self):
+        """
+        Generate the manifest line of each channel.
+        """
+        return serializer.iter_channel_lines(self.uris, self.aliases,
+                                             self.spec_ids, self.specs)
+
+    def __len__(self):
+        return len(self.uris)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        access_type, etag, gets, get_size, puts, put_size = \
+            self.specs[self.spec_ids[index]]
+        return Channel(self.uris[index], self.aliases[index], access_type,
+                       etag=etag, gets=gets, get_size=get_size, puts=puts,
+                       put_size=put_size)
+
+    def _channel_spec_id(self, channel):
+        return self._spec_id((channel.access_type, channel.etag,
+                              channel.gets, channel.get_size, channel.puts,
+                              channel.put_size))
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            channels = list(value)
+            self.uris[index] = [channel.uri for channel in channels]
+            self.aliases[index] = [channel.alias for channel in channels]
+            self.spec_ids[index] = array.array(
+                'I', [self._channel_spec_id(channel) for channel in channels])
+        else:
+            self.uris[index] = value.uri
+            self.aliases[index] = value.alias
+            self.spec_ids[index] = self._channel_spec_id(value)
+
+    def __delitem__(self, index):
+        del self.uris[index]
+        del self.aliases[index]
+        del self.spec_ids[index]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
 class Manifest(object):
     """
     Object representation of a ZeroVM manifest. Includes utilities and sane
@@ -197,9 +380,7 @@ class Manifest(object):
         self.node = node
         self.etag = etag
 
-        self.channels = channels
-        if self.channels is None:
-            self.channels = []
+        self.channels = ChannelTable(channels)
 
     @classmethod
     def default_manifest(cls, basedir, program):
@@ -226,16 +407,15 @@ class Manifest(object):
         if not self.channels:
             raise RuntimeError("Manifest must have at least 1 channel.")
 
-        manifest = MANIFEST_TEMPLATE
-        manifest %= dict(
-            node=self.node,
-            version=self.version,
-            timeout=self.timeout,
-            memory='%s,%s' % (self.memory, self.etag),
-            program=self.program,
-            channels='\n'.join([str(c) for c in self.channels]),
-        )
-        return manifest
+        settings = [
+            ('Node', self.node),
+            ('Version', self.version),
+            ('Timeout', self.timeout),
+            ('Memory', '%s,%s' % (self.memory, self.etag)),
+            ('Program', self.program),
+        ]
+        return ''.join(serializer.iter_manifest_lines(settings,
+                                                      self.channels.lines()))
 
 
 class NVRAM(object):
@@ -269,82 +449,32 @@ class NVRAM(object):
         """
         Generate the text for an nvram file.
         """
-        nvram_text = NVRAM_TEMPLATE
-        fstab_channels = []
-        for i, (zvm_image, mount_point, access) in enumerate(
-                self.processed_images, start=1):
-            device = '/dev/%s.%s' % (i, path.basename(zvm_image))
-            fstab_channel = (
-                'channel=%(device)s,mountpoint=%(mount_point)s,'
-                'access=%(access)s,removable=no'
-                % dict(device=device, mount_point=mount_point, access=access)
-            )
-            fstab_channels.append(fstab_channel)
-
-        mapping = ''
-        if sys.stdin.isatty():
-            mapping += 'channel=/dev/stdin,mode=char\n'
-        if sys.stdout.isatty():
-            mapping += 'channel=/dev/stdout,mode=char\n'
-        if sys.stderr.isatty():
-            mapping += 'channel=/dev/stderr,mode=char\n'
-
-        # When ZRT presents a program with its argv, it parses the
-        # nvram file. This parser is very simple. It will choke on ','
-        # (it treats comma the same as newline) and it will split the
-        # command line on ' '. We must therefore escape each argument
-        # individually before joining them.
-        args = ' '.join(map(_nvram_escape, self.program_args))
-
-        nvram_text %= dict(
-            args=args,
-            fstab='\n'.join(fstab_channels),
-            mapping=mapping,
-            env='\n'.join([]),
-        )
-
+        fstab = [
+            serializer.fstab_line('/dev/%s.%s' % (i, path.basename(zvm_image)),
+                                  mount_point, access)
+            for i, (zvm_image, mount_point, access) in enumerate(
+                self.processed_images, start=1)
+        ]
+        mapping = [serializer.mapping_line('/dev/%s' % std_name, 'char')
+                   for std_name in ('stdin', 'stdout', 'stderr')
+                   if getattr(sys, std_name).isatty()]
+        env = []
         if self.env is not None:
-            nvram_text += '[env]\n'
-            for k, v in self.env.items():
-                nvram_text += 'name=%s,value=%s\n' % (k, _nvram_escape(v))
+            env = [serializer.env_line(k, v) for k, v in self.env.items()]
+        debug = []
         if self.debug_verbosity is not None:
-            nvram_text += '[debug]\nverbosity=%s\n' % self.debug_verbosity
+            debug = ['verbosity=%s' % self.debug_verbosity]
 
-        return nvram_text
+        return serializer.dumps_nvram([
+            ('args', [serializer.args_line(self.program_args)]),
+            ('fstab', fstab),
+            ('mapping', mapping),
+            ('env', env),
+            ('debug', debug),
+        ])
 
 
-def _nvram_escape(value):
-    r"""Escape value for inclusion as a value in a nvram file.
-
-    The ini-file parser in ZRT is very simple. One quirk is that it
-    handles ',' the same as '\n', which means that a value like
-
-      greeting = Hello, World
-
-    will be cut-off after "Hello".
-
-    Values also need protection in other ways:
-
-    * When "args" are loaded, the value is split on ' ' and each
-      argument found is then unescaped. This means that each arg need
-      to have ' ' escaped.
-
-    * When a "value" is loaded in [env], it is unescaped. It must
-      therefore also be escaped.
-
-    This function escapes '\\', '"', ',', ' ', and '\n'. These are the
-    characters that conf_parser::unescape_string_copy_to_dest is
-    documented to handle and they are sufficient to handle the above
-    use cases.
-
-    >>> _nvram_escape('foo, bar')
-    'foo\\x2c\\x20bar'
-    >>> _nvram_escape('new\nline')
-    'new\\x0aline'
-    """
-    for c in '\\", \n':
-        value = value.replace(c, '\\x%02x' % ord(c))
-    return value
+_nvram_escape = serializer.escape
 
 
 def _process_images(zvm_images):
@@ -407,17 +537,12 @@ def create_manifest(working_dir, program_path, manifest_cfg, tar_files,
     manifest.timeout = manifest_cfg['Timeout']
     manifest.memory = manifest_cfg['Memory']
 
-    for i, tar_file in enumerate(tar_files, start=1):
-        mount_point = '/dev/%s.%s' % (i, path.basename(tar_file))
-
-        ch = Channel(
-            tar_file, mount_point, access_type=RND_READ_RND_WRITE,
-            gets=limits_cfg['reads'],
-            get_size=limits_cfg['rbytes'],
-            puts=limits_cfg['writes'],
-            put_size=limits_cfg['wbytes'],
-        )
-        manifest.channels.append(ch)
+    limits = (limits_cfg['reads'], limits_cfg['rbytes'],
+              limits_cfg['writes'], limits_cfg['wbytes'])
+    manifest.channels.add_all(
+        (tar_file, '/dev/%s.%s' % (i, path.basename(tar_file)),
+         RND_READ_RND_WRITE, limits)
+        for i, tar_file in enumerate(tar_files, start=1))
 
     return manifest
 
@@ -464,6 +589,120 @@ def _check_runtime_files(runtime_files):
                                % file_path)
 
 
+# Open lock files of the run directories this process is using, by path;
+# see _create_run_dir.
+_run_locks = {}
+# Lock file in each run directory, locked while its run is in progress.
+RUN_LOCK = '.running'
+
+
+def _lock_run_dir(run_dir, blocking=True):
+    """
+    Lock the run directory ``run_dir``.
+
+    :returns:
+        The open lock file, which holds the lock until it is closed, or None
+        if ``blocking`` is false and another run holds the lock.
+    """
+    lock_fp = open(path.join(run_dir, RUN_LOCK), 'a')
+    flags = fcntl.LOCK_EX
+    if not blocking:
+        flags |= fcntl.LOCK_NB
+    try:
+        fcntl.flock(lock_fp, flags)
+    except (IOError, OSError) as err:
+        lock_fp.close()
+        if err.errno in (errno.EAGAIN, errno.EACCES):
+            return None
+        raise
+    return lock_fp
+
+
+def _release_run_dir(run_dir):
+    """
+    Mark the run directory ``run_dir``, from :func:`_create_run_dir`, as no
+    longer in use, so that it can be removed. Exiting has the same effect.
+    """
+    lock_fp = _run_locks.pop(run_dir, None)
+    if lock_fp is not None:
+        lock_fp.close()
+
+
+def _create_run_dir(save_dir, keep=None):
+    """
+    Create a new directory for the files of one run inside ``save_dir``, and
+    return its path. This is safe for any number of concurrent runs sharing
+    ``save_dir``.
+
+    Run directories are named ``<UTC timestamp>-<pid>``, so they sort in the
+    order they were created. ``save_dir/index`` lists them, oldest first, and
+    ``save_dir/latest`` is a symlink to the newest one.
+
+    The new directory is locked as in use until :func:`_release_run_dir` is
+    called with it, or the process exits.
+
+    :param int keep:
+        Optional. If given, only the ``keep`` newest run directories are
+        kept; older ones are removed, unless their run is still in progress.
+    """
+    try:
+        os.makedirs(save_dir)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+    base_name = '%s-%d' % (
+        datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S.%f'), os.getpid())
+    run_name = base_name
+    suffix = 0
+    while True:
+        # mkdir is atomic, so only one run can claim a given name.
+        try:
+            os.mkdir(path.join(save_dir, run_name))
+            break
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+            suffix += 1
+            run_name = '%s.%d' % (base_name, suffix)
+    # Lock it before it is in the index, where other runs could prune it.
+    run_dir = path.join(save_dir, run_name)
+    _run_locks[run_dir] = _lock_run_dir(run_dir)
+
+    index_path = path.join(save_dir, 'index')
+    with open(path.join(save_dir, 'index.lock'), 'a') as lock_fp:
+        fcntl.flock(lock_fp, fcntl.LOCK_EX)
+        runs = []
+        if path.exists(index_path):
+            with open(index_path) as index_fp:
+                runs = index_fp.read().split()
+        runs.append(run_name)
+        if keep:
+            in_use = []
+            for expired in runs[:-keep]:
+                expired_dir = path.join(save_dir, expired)
+                if not path.isdir(expired_dir):
+                    continue
+                lock_fp = _lock_run_dir(expired_dir, blocking=False)
+                if lock_fp is None:
+                    # Still running; it goes once it's done and expired.
+                    in_use.append(expired)
+                    continue
+                shutil.rmtree(expired_dir, ignore_errors=True)
+                lock_fp.close()
+            runs = in_use + runs[-keep:]
+
+        tmp_suffix = '.%d' % os.getpid()
+        with open(index_path + tmp_suffix, 'w') as index_fp:
+            index_fp.write(''.join('%s\n' % run for run in runs))
+        os.rename(index_path + tmp_suffix, index_path)
+        latest = path.join(save_dir, 'latest')
+        os.symlink(run_name, latest + tmp_suffix)
+        os.rename(latest + tmp_suffix, latest)
+
+    return run_dir
+
+
 def run_zerovm(zvconfig, zvargs):
     """
     :param zvconfig:
@@ -612,7 +851,9 @@ class ZvArgs:
             'command',
             help=('Zvsh command, can be:\n'
                   '- path to ZeroVM executable\n'
-                  '- "gdb" (for running debugger)\n'),
+                  '- "gdb" (for running debugger)\n'
+                  'Not needed with --zvm-replay\n'),
+            nargs='?',
         )
         self.parser.add_argument(
             '--zvm-image',
@@ -647,6 +888,84 @@ class ZvArgs:
             help=('Save ZeroVM environment files into provided directory'),
             action='store',
         )
+        self.parser.add_argument(
+            '--zvm-nodes',
+            help=('Run this many copies of the program side by side, with '
+                  'Node ids 1..N\n'),
+            type=int,
+            default=1,
+        )
+        self.parser.add_argument(
+            '--zvm-save-runs',
+            help=('Save the files of each run into a new timestamped '
+                  'directory\ninside --zvm-save-dir\n'),
+            action='store_true',
+        )
+        self.parser.add_argument(
+            '--zvm-save-keep',
+            help=('With --zvm-save-runs, only keep the files of this many '
+                  'runs\n'),
+            type=int,
+        )
+        self.parser.add_argument(
+            '--zvm-autosize',
+            help=('Set Memory, Timeout and the channel limits from the '
+                  'profile\nof earlier runs of the same program and '
+                  'arguments\n'),
+            action='store_true',
+        )
+        self.parser.add_argument(
+            '--zvm-stats',
+            help=('Append the timings, resource usage and report of the run '
+                  'to\nthis file, as one line of JSON\n'),
+            action='store',
+        )
+        self.parser.add_argument(
+            '--zvm-profile',
+            help=('Write the time spent in each phase of the run to this '
+                  'file\n(or a new file in this directory), as Chrome trace '
+                  'JSON;\nalso set by the ZVSH_PROFILE environment '
+                  'variable\n'),
+            action='store',
+        )
+        self.parser.add_argument(
+            '--zvm-bench',
+            help=('Run the program this many times, discarding its output, '
+                  'and\nprint statistics of the wall time, ZeroVM CPU time '
+                  'and zvsh\noverhead of the runs\n'),
+            type=int,
+        )
+        self.parser.add_argument(
+            '--zvm-warmup',
+            help='With --zvm-bench, first run the program this many times\n',
+            type=int,
+            default=0,
+        )
+        self.parser.add_argument(
+            '--zvm-bench-csv',
+            help='With --zvm-bench, write the measures of each run to this '
+                 'CSV file\n',
+            action='store',
+        )
+        self.parser.add_argument(
+            '--zvm-record',
+            help=('Record the run into this directory, with snapshots of its '
+                  'nexe,\nimages, file channels and stdin, so it can be '
+                  'replayed\n'),
+            action='store',
+        )
+        self.parser.add_argument(
+            '--zvm-replay',
+            help=('Run the recording in this directory again, and warn if '
+                  'the\noutput differs from the recorded output\n'),
+            action='store',
+        )
+        self.parser.add_argument(
+            '--zvm-no-cache',
+            help=('Don\'t use the result and run plan caches, even if they '
+                  'are\nenabled in zvsh.cfg\n'),
+            action='store_true',
+        )
         self.parser.add_argument(
             'cmd_args',
             help='command line arguments\n',
@@ -655,6 +974,28 @@ class ZvArgs:
 
     def parse(self, zvsh_args):
         self.args = self.parser.parse_args(args=zvsh_args)
+        if not hasattr(self.args, 'command'):
+            # A subclass with arguments of its own, like zvapp's AppArgs.
+            return
+        if self.args.command is None and not self.args.zvm_replay:
+            self.parser.error('too few arguments')
+        conflict = conflicting_options(self.args)
+        if conflict:
+            self.parser.error(conflict)
+
+
+def conflicting_options(args):
+    """
+    Get the error message for options of the parsed ``args`` which can't be
+    used together, or None if there are none.
+    """
+    nodes = (args.zvm_nodes or 1) > 1
+    if args.zvm_bench and nodes:
+        return "--zvm-bench can't be combined with --zvm-nodes"
+    if args.zvm_record and (nodes or args.zvm_bench):
+        return ("--zvm-record can't be combined with --zvm-nodes or "
+                "--zvm-bench")
+    return None
 
 
 class DebugArgs(ZvArgs):
@@ -679,8 +1020,10 @@ class ZvConfig(ConfigParser.ConfigParser):
         self.add_section('limits')
         self.add_section('fstab')
         self.add_section('zvapp')
+        self.add_section('cache')
         self._sections['manifest'].update(DEFAULT_MANIFEST)
         self._sections['limits'].update(DEFAULT_LIMITS)
+        self._sections['cache'].update(DEFAULT_CACHE)
         self.optionxform = str
 
     def __getitem__(self, item):
@@ -701,6 +1044,8 @@ class ZvShell(object):
         self.program = None
         self.savedir = None
         self.tmpdir = None
+        # Number of copies of the program run side by side; see add_node.
+        self.node_count = 1
         self.config = config
         self.savedir = savedir
         if self.savedir:
@@ -712,33 +1057,32 @@ class ZvShell(object):
             self.tmpdir = mkdtemp()
         self.node_id = self.config['manifest']['Node']
         self.config['manifest']['Memory'] += ',0'
-        self.stdout = os.path.join(self.tmpdir, 'stdout.%d' % self.node_id)
-        self.stderr = os.path.join(self.tmpdir, 'stderr.%d' % self.node_id)
-        stdin = '/dev/stdin'
-        self.channel_seq_read_template = CHANNEL_SEQ_READ_TEMPLATE \
-            % ('%s', '%s', self.config['limits']['reads'],
-               self.config['limits']['rbytes'])
-        self.channel_seq_write_template = CHANNEL_SEQ_WRITE_TEMPLATE \
-            % ('%s', '%s', self.config['limits']['writes'],
-               self.config['limits']['wbytes'])
-        self.channel_random_ro_template = CHANNEL_RANDOM_RO_TEMPLATE \
-            % ('%s', '%s', self.config['limits']['reads'],
-               self.config['limits']['rbytes'])
-        self.channel_random_rw_template = CHANNEL_RANDOM_RW_TEMPLATE \
-            % ('%s', '%s', self.config['limits']['reads'],
-               self.config['limits']['rbytes'],
-               self.config['limits']['writes'],
-               self.config['limits']['wbytes'])
+        self.stdout = self.node_stdout(self.node_id)
+        self.stderr = self.node_stderr(self.node_id)
         self.manifest_channels = [
-            self.channel_seq_read_template % (stdin, '/dev/stdin'),
-            self.channel_seq_write_template % (os.path.abspath(self.stdout),
-                                               '/dev/stdout'),
-            self.channel_seq_write_template % (os.path.abspath(self.stderr),
-                                               '/dev/stderr')
+            self.channel('/dev/stdin', '/dev/stdin', SEQ_READ_SEQ_WRITE,
+                         read=True),
+            self.channel(os.path.abspath(self.stdout), '/dev/stdout',
+                         SEQ_READ_SEQ_WRITE, write=True),
+            self.channel(os.path.abspath(self.stderr), '/dev/stderr',
+                         SEQ_READ_SEQ_WRITE, write=True),
         ]
         for k, v in self.config['fstab'].items():
             self.nvram_fstab[self.create_manifest_channel(k)] = v
 
+    def channel(self, uri, alias, access_type, read=False, write=False):
+        """
+        Get a channel `tuple` for the manifest, with the configured read
+        and/or write limits.
+        """
+        limits = self.config['limits']
+        gets = get_size = puts = put_size = 0
+        if read:
+            gets, get_size = limits['reads'], limits['rbytes']
+        if write:
+            puts, put_size = limits['writes'], limits['wbytes']
+        return (uri, alias, access_type, 0, gets, get_size, puts, put_size)
+
     def create_manifest_channel(self, file_name):
         name = os.path.basename(file_name)
         self.temp_files.append(file_name)
@@ -747,12 +1091,9 @@ class ZvShell(object):
         if not os.path.exists(abs_path):
             fd = open(abs_path, 'wb')
             fd.close()
-        if os.access(abs_path, os.W_OK):
-            self.manifest_channels.append(self.channel_random_rw_template
-                                          % (abs_path, devname))
-        else:
-            self.manifest_channels.append(self.channel_random_ro_template
-                                          % (abs_path, devname))
+        self.manifest_channels.append(
+            self.channel(abs_path, devname, RND_READ_RND_WRITE, read=True,
+                         write=os.access(abs_path, os.W_OK)))
         return devname
 
     def add_untrusted_args(self, program, cmdline):
@@ -788,78 +1129,107 @@ class ZvShell(object):
             self.nvram_fstab.append((dev_name, imgmp or '/',  imgacc or 'ro'))
             nexe = None
             try:
-                tar = tarfile.open(name=imgpath)
-                nexe = tar.extractfile(self.program)
+                with spans.span('scan_image', image=imgpath):
+                    tar = tarfile.open(name=imgpath)
+                    nexe = tar.extractfile(self.program)
                 tmpnexe_fn = os.path.join(self.tmpdir,
                                           'boot.%d' % self.node_id)
-                tmpnexe_fd = open(tmpnexe_fn, 'wb')
-                read_iter = iter(lambda: nexe.read(65535), b'')
-                for chunk in read_iter:
-                    tmpnexe_fd.write(chunk)
-                tmpnexe_fd.close()
+                with spans.span('extract_nexe', image=imgpath):
+                    tmpnexe_fd = open(tmpnexe_fn, 'wb')
+                    read_iter = iter(lambda: nexe.read(65535), b'')
+                    for chunk in read_iter:
+                        tmpnexe_fd.write(chunk)
+                    tmpnexe_fd.close()
                 self.program = tmpnexe_fn
             except (KeyError, tarfile.ReadError):
                 pass
 
     def add_debug(self, zvm_debug):
         if zvm_debug:
-            self.manifest_channels.append(self.channel_seq_write_template
-                                          % (os.path.abspath('zvsh.log'),
-                                             '/dev/debug'))
+            self.manifest_channels.append(
+                self.channel(os.path.abspath('zvsh.log'), '/dev/debug',
+                             SEQ_READ_SEQ_WRITE, write=True))
 
     def add_self(self):
-        self.manifest_channels.append(self.channel_random_ro_template
-                                      % (os.path.abspath(self.program),
-                                         '/dev/self'))
-
-    def create_nvram(self, verbosity):
-        nvram = '[args]\n'
-        nvram += 'args = %s\n' % ' '.join(
-            ['%s' % a.replace(',', '\\x2c').replace(' ', '\\x20')
-             for a in self.nvram_args['args']])
-        if len(self.config['env']) > 0:
-            nvram += '[env]\n'
-            for k, v in self.config['env'].items():
-                nvram += 'name=%s,value=%s\n' % (k, v.replace(',', '\\x2c'))
-        if len(self.nvram_fstab) > 0:
-            nvram += '[fstab]\n'
-            for channel, mp, access in self.nvram_fstab:
-                nvram += ('channel=%s,mountpoint=%s,access=%s,removable=no\n'
-                          % (channel, mp, access))
-        mapping = ''
+        self.manifest_channels.append(
+            self.channel(os.path.abspath(self.program), '/dev/self',
+                         RND_READ_RND_WRITE, read=True))
+
+    def create_nvram(self, verbosity, node_id=None):
+        if node_id is None:
+            node_id = self.node_id
+        env = list(self.config['env'].items())
+        if self.node_count > 1:
+            # Tell each copy of the program which one it is.
+            env.append(('ZVM_NODE_ID', str(node_id)))
+            env.append(('ZVM_NODE_COUNT', str(self.node_count)))
+        mapping = []
         for std_name in ('stdin', 'stdout', 'stderr'):
-            std_chan = getattr(sys, std_name)
-            if std_chan.isatty():
-                mapping += CHANNEL_MAPPING_TEMPLATE % (std_name, 'char')
-            else:
-                mapping += CHANNEL_MAPPING_TEMPLATE % (std_name, 'file')
-        for dev in self.nvram_reg_files:
-            mapping += 'channel=%s,mode=file\n' % dev
-        if mapping:
-            nvram += '[mapping]\n' + mapping
+            mode = 'char' if getattr(sys, std_name).isatty() else 'file'
+            mapping.append(serializer.mapping_line('/dev/%s' % std_name,
+                                                   mode))
+        mapping.extend(serializer.mapping_line(dev, 'file')
+                       for dev in self.nvram_reg_files)
+        debug = []
         if verbosity:
-            nvram += '[debug]\nverbosity=%d\n' % verbosity
-        self.nvram_filename = os.path.join(self.tmpdir,
-                                           'nvram.%d' % self.node_id)
-        nvram_fd = open(self.nvram_filename, 'wb')
-        nvram_fd.write(nvram.encode('utf-8'))
-        nvram_fd.close()
-
-    def create_manifest(self):
-        manifest = ''
-        for k, v in self.config['manifest'].items():
-            manifest += '%s = %s\n' % (k, v)
-        manifest += 'Program = %s\n' % os.path.abspath(self.program)
-        self.manifest_channels.append(self.channel_random_rw_template
-                                      % (os.path.abspath(self.nvram_filename),
-                                         '/dev/nvram'))
-        manifest += '\n'.join(self.manifest_channels)
-        manifest_fn = os.path.join(self.tmpdir, 'manifest.%d' % self.node_id)
-        manifest_fd = open(manifest_fn, 'wb')
-        manifest_fd.write(manifest.encode('utf-8'))
-        manifest_fd.close()
+            debug.append('verbosity=%d' % verbosity)
+        nvram_filename = os.path.join(self.tmpdir, 'nvram.%d' % node_id)
+        if node_id == self.node_id:
+            self.nvram_filename = nvram_filename
+        with spans.span('create_nvram', node=node_id):
+            serializer.dump(nvram_filename, serializer.iter_nvram([
+                ('args', [serializer.args_line(self.nvram_args['args'])]),
+                ('env', (serializer.env_line(k, v) for k, v in env)),
+                ('fstab', (serializer.fstab_line(*entry)
+                           for entry in self.nvram_fstab)),
+                ('mapping', mapping),
+                ('debug', debug),
+            ]))
+
+    def create_manifest(self, node_id=None):
+        if node_id is None:
+            node_id = self.node_id
+        settings = [(k, node_id if k == 'Node' else v)
+                    for k, v in self.config['manifest'].items()]
+        settings.append(('Program', os.path.abspath(self.program)))
+        channels = list(self.manifest_channels)
+        if node_id != self.node_id:
+            # Every node has its own stdout and stderr.
+            channels[1] = self.channel(
+                os.path.abspath(self.node_stdout(node_id)), '/dev/stdout',
+                SEQ_READ_SEQ_WRITE, write=True)
+            channels[2] = self.channel(
+                os.path.abspath(self.node_stderr(node_id)), '/dev/stderr',
+                SEQ_READ_SEQ_WRITE, write=True)
+        nvram_filename = os.path.join(self.tmpdir, 'nvram.%d' % node_id)
+        channels.append(self.channel(os.path.abspath(nvram_filename),
+                                     '/dev/nvram', RND_READ_RND_WRITE,
+                                     read=True, write=True))
+        manifest_fn = os.path.join(self.tmpdir, 'manifest.%d' % node_id)
+        with spans.span('create_manifest', node=node_id):
+            serializer.dump(manifest_fn,
+                            serializer.iter_manifest(settings, channels))
         return manifest_fn
 
+    def node_stdout(self, node_id):
+        return os.path.join(self.tmpdir, 'stdout.%d' % node_id)
+
+    def node_stderr(self, node_id):
+        return os.path.join(self.tmpdir, 'stderr.%d' % node_id)
+
+    def add_node(self, node_id, verbosity):
+        """
+        Set up another copy of the program, with the Node id ``node_id``,
+        after :meth:`add_arguments` has set up the first one. The copy shares
+        the program, images and files of the first one, but has its own
+        stdout, stderr and nvram.
+
+        :returns:
+            The path to the manifest of the new node.
+        """
+        self.create_nvram(verbosity, node_id)
+        return self.create_manifest(node_id)
+
     def add_arguments(self, args):
         self.add_debug(args.zvm_debug)
         self.add_untrusted_args(args.command, args.cmd_args)
@@ -869,6 +1239,85 @@ class ZvShell(object):
         manifest_file = self.create_manifest()
         return manifest_file
 
+    def plan(self):
+        """
+        Get the plan of the run set up by :meth:`add_arguments`, as a tuple
+        of a `dict` for :meth:`zvshlib.cache.PlanCache.put` and a `dict` of
+        the files it needs. :meth:`load_plan` sets up the same run from it in
+        another working directory.
+        """
+        tmpdir = os.path.abspath(self.tmpdir)
+
+        def read(file_name):
+            with open(file_name, 'rb') as fp:
+                text = fp.read().decode('utf-8')
+            return text.replace(tmpdir, cache.PlanCache.WORKDIR)
+
+        def workdir_path(file_name):
+            # Files of this run, such as the bytecode cache snapshot, are in
+            # the working directory of the run stamped out from the plan.
+            abs_path = os.path.abspath(file_name)
+            if abs_path.startswith(tmpdir + os.sep):
+                return cache.PlanCache.WORKDIR + abs_path[len(tmpdir):]
+            return file_name
+
+        program = os.path.abspath(self.program)
+        files = {}
+        if os.path.dirname(program) == tmpdir:
+            # The nexe was extracted from an image.
+            files[os.path.basename(program)] = program
+        plan = {
+            'program': workdir_path(program),
+            'manifest': read(os.path.join(self.tmpdir,
+                                          'manifest.%d' % self.node_id)),
+            'nvram': read(self.nvram_filename),
+            'temp_files': [workdir_path(f) for f in self.temp_files],
+            'nvram_fstab': [[workdir_path(field) for field in entry]
+                            for entry in self.nvram_fstab],
+        }
+        return plan, files
+
+    def load_plan(self, plan):
+        """
+        Set up a run from a plan returned by
+        :meth:`zvshlib.cache.PlanCache.get`, instead of
+        :meth:`add_arguments`.
+
+        :returns:
+            The path to the manifest file.
+        """
+        tmpdir = os.path.abspath(self.tmpdir)
+        for name in plan['files']:
+            src = os.path.join(plan['dir'], name)
+            dst = os.path.join(self.tmpdir, name)
+            try:
+                os.link(src, dst)
+            except OSError:
+                cache.clone_file(src, dst)
+
+        def local_path(file_name):
+            return file_name.replace(cache.PlanCache.WORKDIR, tmpdir)
+
+        self.program = local_path(plan['program'])
+        self.temp_files = [local_path(f) for f in plan['temp_files']]
+        self.nvram_fstab = [tuple(local_path(field) for field in entry)
+                            for entry in plan['nvram_fstab']]
+        # Files named with @ are created if they don't exist, as in
+        # create_manifest_channel.
+        for file_name in self.temp_files:
+            if not os.path.exists(file_name):
+                open(file_name, 'wb').close()
+
+        self.nvram_filename = os.path.join(self.tmpdir,
+                                           'nvram.%d' % self.node_id)
+        manifest_fn = os.path.join(self.tmpdir, 'manifest.%d' % self.node_id)
+        for file_name, text in ((self.nvram_filename, plan['nvram']),
+                                (manifest_fn, plan['manifest'])):
+            with open(file_name, 'wb') as fp:
+                fp.write(text.replace(cache.PlanCache.WORKDIR,
+                                      tmpdir).encode('utf-8'))
+        return manifest_fn
+
     def cleanup(self):
         if not self.savedir:
             shutil.rmtree(self.tmpdir, ignore_errors=True)
@@ -883,15 +1332,188 @@ class ZvShell(object):
         return debug_scp_fn
 
 
+#: A parsed ZeroVM report; see :func:`parse_report`.
+Report = namedtuple('Report', ['validator_state', 'daemon', 'return_code',
+                               'etag', 'accounting', 'status'])
+
+# Key of a report line, such as 'user return code = ' or 'etag(s) = '.
+_REPORT_KEY = re.compile(r'^[a-z][a-z ()]*?\s*=\s*')
+
+
+def _report_int(value):
+    if not value:
+        return None
+    return int(value)
+
+
+def parse_accounting(line):
+    """
+    Parse the accounting line of a ZeroVM report into a `dict` keyed by
+    :data:`ACCOUNTING_FIELDS`. Fields missing from the line are left out.
+
+    >>> sorted(parse_accounting('0.5 1.5 4096 0').items())
+    [('memory', 4096), ('swap', 0), ('sys_time', 0.5), ('user_time', 1.5)]
+    """
+    accounting = {}
+    for name, value in zip(ACCOUNTING_FIELDS, (line or '').split()):
+        accounting[name] = float(value) if name.endswith('_time') \
+            else int(value)
+    return accounting
+
+
+def parse_report(report):
+    """
+    Parse the report ZeroVM writes to its stdout at exit. The report has one
+    line for each field of :class:`Report`, each either a bare value or
+    ``key = value``:
+
+    * ``validator_state``: 0 if the nexe passed NaCl validation
+    * ``daemon``: daemon status
+    * ``return_code``: return code of the program
+    * ``etag``: etags of the channels, if enabled
+    * ``accounting``: CPU, memory and I/O counters; see
+      :func:`parse_accounting`
+    * ``status``: exit state, such as ``ok``
+
+    Fields missing from a truncated report are `None`.
+
+    :raises ValueError:
+        If a numeric field doesn't hold a number.
+
+    >>> report = parse_report(
+    ...     'validator state = 0\\ndaemon pid = 0\\n'
+    ...     'user return code = 3\\netag(s) = disabled\\n'
+    ...     'accounting = 0.5 1.5 4096 0\\nexit state = ok\\n')
+    >>> report.return_code, report.etag, report.status
+    (3, 'disabled', 'ok')
+    >>> report.accounting['memory']
+    4096
+    >>> parse_report('0\\n0\\n').return_code is None
+    True
+    """
+    lines = report.split('\n', len(Report._fields) - 1)
+    values = [_REPORT_KEY.sub('', line.strip(), 1) for line in lines]
+    values += [None] * (len(Report._fields) - len(values))
+    validator_state, daemon, return_code, etag, accounting, status = values
+    return Report(
+        validator_state=_report_int(validator_state),
+        daemon=_report_int(daemon),
+        return_code=_report_int(return_code),
+        etag=etag or None,
+        accounting=parse_accounting(accounting),
+        status=status or None,
+    )
+
+
 def parse_return_code(report):
-    rc = report.split('\n', 5)[2]
-    try:
-        rc = int(rc)
-    except ValueError:
-        rc = int(rc.replace('user return code = ', ''))
+    """
+    Get the return code of the program from a ZeroVM report.
+    """
+    rc = parse_report(report).return_code
+    if rc is None:
+        raise ValueError('No return code in the ZeroVM report')
     return rc
 
 
+def parse_validator_state(report):
+    """
+    Get the NaCl validator state from a ZeroVM report: 0 if the nexe was
+    validated successfully.
+    """
+    state = parse_report(report).validator_state
+    if state is None:
+        raise ValueError('No validator state in the ZeroVM report')
+    return state
+
+
+def _exit_code(rc, zvm_rc, getrc):
+    """
+    Combine the application return code ``rc`` and the ZeroVM return code
+    ``zvm_rc`` into the exit code of zvsh.
+    """
+    if getrc:
+        return zvm_rc
+    return rc | zvm_rc << 4
+
+
+def _binary(stream):
+    """
+    Get the byte stream underlying ``stream``. On Python 3 this is the
+    ``buffer`` of a text stream; on Python 2 it is the stream itself.
+    """
+    return getattr(stream, 'buffer', stream)
+
+
+def summarize(values):
+    """
+    Get the :data:`BENCH_STATS` of ``values`` as a `dict`.
+
+    >>> stats = summarize([1, 2, 3, 4])
+    >>> stats['min'], stats['mean'], stats['p50'], stats['p99']
+    (1, 2.5, 2, 4)
+    >>> round(stats['stdev'], 3)
+    1.291
+    """
+    mean = float(sum(values)) / len(values)
+    variance = 0.0
+    if len(values) > 1:
+        variance = (sum((value - mean) ** 2 for value in values)
+                    / (len(values) - 1))
+    return {
+        'min': min(values),
+        'mean': mean,
+        'p50': cache.percentile(values, 50),
+        'p95': cache.percentile(values, 95),
+        'p99': cache.percentile(values, 99),
+        'stdev': math.sqrt(variance),
+    }
+
+
+class PumpStats(object):
+    """
+    Counters of a stream relayed by :class:`ZvRunner`: the bytes and chunks
+    it moved, the seconds it spent blocked reading them from their source
+    and writing them to their destination, and the most bytes it held at
+    once.
+
+    Read time is the pump waiting for the producer (ZeroVM, or our own
+    stdin), write time is the pump waiting for the consumer: a stream with
+    a large write time is back-pressured downstream.
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.chunks = 0
+        self.read_time = 0.0
+        self.write_time = 0.0
+        self.peak_buffered = 0
+
+    def chunks_of(self, read):
+        """
+        Iterate over the chunks returned by ``read()`` until it returns an
+        empty one, counting them and the time spent reading.
+        """
+        while True:
+            start = time.time()
+            chunk = read()
+            self.read_time += time.time() - start
+            if not chunk:
+                return
+            self.chunks += 1
+            self.bytes += len(chunk)
+            self.peak_buffered = max(self.peak_buffered, len(chunk))
+            yield chunk
+
+    def as_dict(self):
+        return {
+            'bytes': self.bytes,
+            'chunks': self.chunks,
+            'read_time': self.read_time,
+            'write_time': self.write_time,
+            'peak_buffered': self.peak_buffered,
+        }
+
+
 class ZvRunner:
 
     def __init__(self, command_line, stdout, stderr, tempdir, getrc=False):
@@ -903,24 +1525,53 @@ class ZvRunner:
         self.getrc = getrc
         self.report = ''
         self.rc = -255
+        self.zvm_rc = None
+        # Stream fed to the ZeroVM stdin; defaults to our own stdin.
+        self.stdin = sys.stdin
+        # Optional binary files receiving a copy of the relayed stdout and
+        # stderr.
+        self.stdout_copy = None
+        self.stderr_copy = None
+        # Streams the stdout and stderr are relayed to; default to our own.
+        self.output = None
+        self.errors = None
+        # Wall time of each phase of the run, in seconds, and the resource
+        # usage of the ZeroVM process.
+        self.timings = {}
+        self.rusage = None
+        # The PumpStats of each of the PUMP_STREAMS.
+        self.streams = dict((name, PumpStats()) for name in PUMP_STREAMS)
         # create std{out,err} unless they already exist:
         for stdfile in (self.stdout, self.stderr):
             if not os.path.exists(stdfile):
                 os.mkfifo(stdfile)
 
     def run(self):
+        sys.exit(self.execute())
+
+    def execute(self):
+        """
+        Run ZeroVM, relaying its standard streams, and return the exit code
+        zvsh should report.
+        """
         try:
-            self.process = Popen(self.command, stdin=PIPE, stdout=PIPE)
-            self.spawn(True, self.stdin_reader)
-            err_reader = self.spawn(True, self.stderr_reader)
-            rep_reader = self.spawn(True, self.report_reader)
-            writer = self.spawn(True, self.stdout_write)
-            self.process.wait()
-            rep_reader.join()
-            self.rc = parse_return_code(self.report)
-            if self.process.returncode == 0:
-                writer.join()
-                err_reader.join()
+            with spans.span('spawn') as span:
+                self.process = Popen(self.command, stdin=PIPE, stdout=PIPE)
+                self.spawn(True, self.stdin_reader)
+                err_reader = self.spawn(True, self.stderr_reader)
+                rep_reader = self.spawn(True, self.report_reader)
+                writer = self.spawn(True, self.stdout_write)
+            self.timings['spawn'] = span.duration
+            with spans.span('run', pid=self.process.pid) as span:
+                self.wait()
+            self.timings['run'] = span.duration
+            with spans.span('drain') as span:
+                rep_reader.join()
+                self.rc = parse_return_code(self.report)
+                if self.process.returncode == 0:
+                    writer.join()
+                    err_reader.join()
+            self.timings['drain'] = span.duration
         except (KeyboardInterrupt, Exception):
             pass
         finally:
@@ -928,50 +1579,108 @@ class ZvRunner:
                 self.process.wait()
                 if self.process.returncode > 0:
                     self.print_error(self.process.returncode)
-            rc = self.rc
-            if self.getrc:
-                rc = self.process.returncode
-            else:
-                rc |= self.process.returncode << 4
-            sys.exit(rc)
+        self.zvm_rc = self.process.returncode
+        return _exit_code(self.rc, self.zvm_rc, self.getrc)
+
+    def wait(self):
+        """
+        Wait for the ZeroVM process to exit, and record its resource usage.
+        """
+        _pid, status, rusage = os.wait4(self.process.pid, 0)
+        self.rusage = dict((name, getattr(rusage, name))
+                           for name in RUSAGE_FIELDS)
+        # The process is reaped; tell Popen how it ended.
+        if os.WIFSIGNALED(status):
+            self.process.returncode = -os.WTERMSIG(status)
+        else:
+            self.process.returncode = os.WEXITSTATUS(status)
+
+    def stats(self):
+        """
+        Get the timings, resource usage, stream pump counters (see
+        :class:`PumpStats`) and parsed report of the run as a `dict` which
+        can be encoded as JSON.
+        """
+        try:
+            report = dict(parse_report(self.report)._asdict())
+        except ValueError:
+            report = None
+        return {
+            'rc': self.rc,
+            'zvm_rc': self.zvm_rc,
+            'timings': self.timings,
+            'rusage': self.rusage,
+            'streams': dict((name, stream.as_dict())
+                            for name, stream in self.streams.items()),
+            'report': report,
+        }
 
     def stdin_reader(self):
-        if sys.stdin.isatty():
-            try:
-                for l in sys.stdin:
-                    self.process.stdin.write(l)
-            except IOError:
-                pass
+        stats = self.streams['stdin']
+        stdin = _binary(self.stdin)
+        tty = self.stdin.isatty()
+        if tty:
+            read = stdin.readline
         else:
-            try:
-                for l in iter(lambda: sys.stdin.read(65535), b''):
-                    self.process.stdin.write(l)
-            except IOError:
-                pass
+            read = functools.partial(stdin.read, 65535)
+        try:
+            for chunk in stats.chunks_of(read):
+                start = time.time()
+                self.process.stdin.write(chunk)
+                if tty:
+                    self.process.stdin.flush()
+                stats.write_time += time.time() - start
+        except IOError:
+            pass
         self.process.stdin.close()
 
     def stderr_reader(self):
-        err = open(self.stderr)
+        stats = self.streams['stderr']
+        err = open(self.stderr, 'rb')
+        out = _binary(self.errors or sys.stderr)
         try:
-            for l in iter(lambda: err.read(65535), b''):
-                sys.stderr.write(l)
+            for chunk in stats.chunks_of(lambda: err.read(65535)):
+                start = time.time()
+                out.write(chunk)
+                out.flush()
+                if self.stderr_copy is not None:
+                    self.stderr_copy.write(chunk)
+                stats.write_time += time.time() - start
         except IOError:
             pass
         err.close()
 
     def stdout_write(self):
-        pipe = open(self.stdout)
-        if sys.stdout.isatty():
-            for line in pipe:
-                sys.stdout.write(line)
+        stats = self.streams['stdout']
+        pipe = open(self.stdout, 'rb')
+        output = self.output or sys.stdout
+        out = _binary(output)
+        tty = output.isatty()
+        if tty:
+            read = pipe.readline
         else:
-            for line in iter(lambda: pipe.read(65535), b''):
-                sys.stdout.write(line)
+            read = functools.partial(pipe.read, 65535)
+        for chunk in stats.chunks_of(read):
+            start = time.time()
+            out.write(chunk)
+            if tty:
+                out.flush()
+            if self.stdout_copy is not None:
+                self.stdout_copy.write(chunk)
+            stats.write_time += time.time() - start
+        start = time.time()
+        out.flush()
+        stats.write_time += time.time() - start
         pipe.close()
 
     def report_reader(self):
-        for line in iter(lambda: self.process.stdout.read(65535), b''):
-            self.report += line
+        stats = self.streams['report']
+        buffered = 0
+        for chunk in stats.chunks_of(lambda: self.process.stdout.read(65535)):
+            self.report += chunk.decode('utf-8', 'replace')
+            # The report is kept whole, to be parsed once ZeroVM exits.
+            buffered += len(chunk)
+            stats.peak_buffered = buffered
 
     def spawn(self, daemon, func, **kwargs):
         thread = threading.Thread(target=func, kwargs=kwargs)
@@ -1049,41 +1758,705 @@ class Shell(object):
             zvsh_args = ZvArgs()
             zvsh_args.parse(cmd_line[1:])
             self.args = zvsh_args.args
+        # File (or directory) receiving the timing spans of the run.
+        self.profile_file = (self.args.zvm_profile
+                             or os.environ.get(spans.PROFILE_ENV))
+        if self.profile_file:
+            spans.enable()
         zvsh_config = ['zvsh.cfg',
                        os.path.expanduser('~/.zvsh.cfg'),
                        '/etc/zvsh.cfg']
-        self.config = ZvConfig()
-        self.config.read(zvsh_config)
+        with spans.span('load_config'):
+            self.config = ZvConfig()
+            self.config.read(zvsh_config)
         self.zvsh = None
+        # The ZvRunner objects which ran ZeroVM.
+        self.runners = []
+        # Memory reserved by --zvm-autosize, if it sized this run.
+        self.autosize_memory = None
 
     def run(self):
+        cprofile.run(self._run)
+
+    def _run(self):
         if 'gdb' == self.args.command:
             self._run_gdb()
+        elif self.args.zvm_replay:
+            self._replay()
         else:
             self._run_zvsh()
 
-    def _run_zvsh(self):
-        self.zvsh = ZvShell(self.config, self.args.zvm_save_dir)
-        manifest_file = self.zvsh.add_arguments(self.args)
+    def _save_dir(self):
+        save_dir = self.args.zvm_save_dir
+        if save_dir and self.args.zvm_save_runs:
+            save_dir = _create_run_dir(save_dir, keep=self.args.zvm_save_keep)
+        return save_dir
+
+    def _zerovm_command(self, manifest_file, trace_log='zvsh.trace.log'):
         zvm_run = [ZEROVM_EXECUTABLE, ZEROVM_OPTIONS]
         if self.args.zvm_trace:
-            trace_log = os.path.abspath('zvsh.trace.log')
-            zvm_run.extend(['-T', trace_log])
+            zvm_run.extend(['-T', os.path.abspath(trace_log)])
         zvm_run.append(manifest_file)
-        runner = ZvRunner(zvm_run, self.zvsh.stdout, self.zvsh.stderr,
-                          self.zvsh.tmpdir,
-                          getrc=self.args.zvm_getrc)
+        return zvm_run
+
+    def _run_zvsh(self):
+        timings = {}
+        with spans.span('setup') as span:
+            if self.args.zvm_nodes > 1:
+                self.config['manifest']['Node'] = 1
+            profile = self._profile()
+            self.zvsh = ZvShell(self.config, self._save_dir())
+            self.zvsh.node_count = self.args.zvm_nodes
+            bytecode = self._bytecode_snapshot()
+            manifest_file = self._set_up_run()
+            runner = ZvRunner(self._zerovm_command(manifest_file),
+                              self.zvsh.stdout, self.zvsh.stderr,
+                              self.zvsh.tmpdir,
+                              getrc=self.args.zvm_getrc)
+        timings['setup'] = span.duration
         try:
-            runner.run()
+            result_cache = self._result_cache()
+            record = None
+            if self.args.zvm_record:
+                record = self._start_recording(manifest_file, runner)
+            with spans.span('execute') as span:
+                if self.args.zvm_bench:
+                    rc = self._bench(manifest_file, timings['setup'])
+                elif self.zvsh.node_count > 1:
+                    rc = self._run_nodes(runner)
+                elif result_cache is None or record is not None:
+                    rc = self._execute(runner)
+                else:
+                    rc = self._run_cached(result_cache, runner,
+                                          manifest_file)
+            timings['execute'] = span.duration
+            if record is not None:
+                self._finish_recording(record, runner, rc)
+            if profile is not None and runner.zvm_rc == 0:
+                self._add_profile_sample(profile, runner,
+                                         timings['execute'])
+            if bytecode is not None and runner.zvm_rc == 0:
+                image_cache, key, snapshot, snapshot_stat = bytecode
+                image_cache.publish(key, snapshot, snapshot_stat)
         finally:
-            self.zvsh.cleanup()
+            with spans.span('cleanup') as span:
+                self.zvsh.cleanup()
+                _release_run_dir(self.zvsh.savedir)
+            timings['cleanup'] = span.duration
+        if self.args.zvm_stats:
+            self._write_stats(rc, timings)
+        if self.profile_file:
+            spans.dump(self.profile_file)
+        sys.exit(rc)
+
+    def _start_recording(self, manifest_file, runner):
+        """
+        Snapshot the inputs of the run for ``--zvm-record``, before ZeroVM
+        gets to change any of them. stdin is spooled to a file, which
+        ``runner`` then reads, and the output is hashed as it is relayed.
+
+        :returns:
+            `tuple` of the :class:`zvshlib.recording.Recording` and the
+            description of the run so far.
+        """
+        record = recording.Recording(self.args.zvm_record)
+        tmpdir = os.path.abspath(self.zvsh.tmpdir)
+        stdin_file = os.path.join(tmpdir, 'stdin.%d' % self.zvsh.node_id)
+        with open(stdin_file, 'wb') as stdin_fp:
+            # As with --zvm-bench, a terminal is recorded as an empty stdin
+            # rather than waiting for EOF.
+            if not sys.stdin.isatty():
+                shutil.copyfileobj(_binary(sys.stdin), stdin_fp)
+        manifest, inputs = record.snapshot_manifest(manifest_file, tmpdir)
+        run = {
+            'command': self.cmd_line,
+            'node': self.zvsh.node_id,
+            'manifest': manifest,
+            'inputs': inputs,
+            'stdin': record.store(stdin_file),
+            'stdout': os.path.abspath(runner.stdout).replace(
+                tmpdir, cache.PlanCache.WORKDIR),
+            'stderr': os.path.abspath(runner.stderr).replace(
+                tmpdir, cache.PlanCache.WORKDIR),
+        }
+        runner.stdin = open(stdin_file, 'rb')
+        runner.stdout_copy = recording.DigestWriter()
+        runner.stderr_copy = recording.DigestWriter()
+        return record, run
+
+    @staticmethod
+    def _recorded_result(runner, rc):
+        return {
+            'exit_code': rc,
+            'stdout': runner.stdout_copy.hexdigest(),
+            'stderr': runner.stderr_copy.hexdigest(),
+        }
+
+    def _finish_recording(self, record, runner, rc):
+        """
+        Save the recording started by :meth:`_start_recording`, along with
+        the result of the run.
+        """
+        record, run = record
+        runner.stdin.close()
+        run['result'] = self._recorded_result(runner, rc)
+        record.save(run)
+
+    def _replay(self):
+        """
+        Run a recording made with ``--zvm-record`` again, with the zerovm
+        found now. The run is set up in a new working dir, or in
+        ``--zvm-save-dir``. A warning is printed if the exit code or the
+        output differ from the recorded ones.
+        """
+        timings = {}
+        with spans.span('setup') as span:
+            record = recording.Recording(self.args.zvm_replay)
+            run = record.load()
+            save_dir = self._save_dir()
+            if save_dir:
+                workdir = os.path.abspath(save_dir)
+                if not os.path.exists(workdir):
+                    os.makedirs(workdir)
+            else:
+                workdir = mkdtemp()
+        timings['setup'] = span.duration
+        try:
+            manifest_file = record.materialize(run, workdir)
+            runner = ZvRunner(
+                self._zerovm_command(manifest_file),
+                run['stdout'].replace(cache.PlanCache.WORKDIR, workdir),
+                run['stderr'].replace(cache.PlanCache.WORKDIR, workdir),
+                workdir, getrc=self.args.zvm_getrc)
+            runner.stdout_copy = recording.DigestWriter()
+            runner.stderr_copy = recording.DigestWriter()
+            self.runners = [runner]
+            with spans.span('execute') as span:
+                with open(record.object_path(run['stdin']), 'rb') as stdin:
+                    runner.stdin = stdin
+                    rc = runner.execute()
+            timings['execute'] = span.duration
+        finally:
+            if not save_dir:
+                shutil.rmtree(workdir, ignore_errors=True)
+        result = self._recorded_result(runner, rc)
+        for name in ('exit_code', 'stdout', 'stderr'):
+            if result[name] != run['result'][name]:
+                sys.stderr.write('zvsh: the %s of the replay differs from '
+                                 'the recording\n' % name.replace('_', ' '))
+        if self.args.zvm_stats:
+            self._write_stats(rc, timings)
+        if self.profile_file:
+            spans.dump(self.profile_file)
+        sys.exit(rc)
+
+    def _bench(self, manifest_file, setup_time):
+        """
+        Run the prepared program ``--zvm-warmup`` times, then ``--zvm-bench``
+        times, and print statistics of the timed runs. Every run reuses the
+        working dir and gets the same stdin, which is read once; the output
+        of the runs is discarded. Returns the first non-zero exit code of the
+        timed runs.
+        """
+        stdin_file = os.path.join(self.zvsh.tmpdir,
+                                  'stdin.%d' % self.zvsh.node_id)
+        with open(stdin_file, 'wb') as stdin_fp:
+            if not sys.stdin.isatty():
+                shutil.copyfileobj(_binary(sys.stdin), stdin_fp)
+        warmup = self.args.zvm_warmup or 0
+        runners = []
+        samples = []
+        rc = 0
+        with open(os.devnull, 'w') as devnull:
+            for i in range(warmup + self.args.zvm_bench):
+                start = time.time()
+                runner = ZvRunner(self._zerovm_command(manifest_file),
+                                  self.zvsh.stdout, self.zvsh.stderr,
+                                  self.zvsh.tmpdir,
+                                  getrc=self.args.zvm_getrc)
+                runner.output = runner.errors = devnull
+                with open(stdin_file, 'rb') as stdin_fp:
+                    runner.stdin = stdin_fp
+                    run_rc = self._execute(runner)
+                wall = time.time() - start
+                if i < warmup:
+                    continue
+                rc = rc or run_rc
+                runners.append(runner)
+                samples.append(self._bench_sample(runner, wall, run_rc))
+        self.runners = runners
+        self._bench_report(samples, setup_time)
+        return rc
+
+    @staticmethod
+    def _bench_sample(runner, wall, rc):
+        """
+        Get the measures of one ``--zvm-bench`` run: its wall time, the CPU
+        time ZeroVM accounted for, and the overhead of zvsh around the
+        ZeroVM process.
+        """
+        try:
+            accounting = parse_report(runner.report).accounting
+        except ValueError:
+            accounting = {}
+        cpu = None
+        if 'user_time' in accounting:
+            cpu = accounting['sys_time'] + accounting['user_time']
+        return {
+            'wall': wall,
+            'cpu': cpu,
+            'overhead': wall - runner.timings.get('run', 0),
+            'rc': rc,
+        }
+
+    def _bench_report(self, samples, setup_time):
+        """
+        Print the statistics of the ``--zvm-bench`` runs, and write them to
+        the ``--zvm-bench-csv`` file. ``setup_time`` is the time it took to
+        prepare the working dir, once for all runs.
+        """
+        out = sys.stdout
+        out.write('%d runs after %d warmup runs; setup took %.4fs\n'
+                  % (len(samples), self.args.zvm_warmup or 0, setup_time))
+        out.write('%-10s' % '' + ''.join('%10s' % name
+                                         for name in BENCH_STATS) + '\n')
+        for measure in ('wall', 'cpu', 'overhead'):
+            values = [sample[measure] for sample in samples
+                      if sample[measure] is not None]
+            if not values:
+                out.write('%-10s%10s\n' % (measure, '-'))
+                continue
+            stats = summarize(values)
+            out.write('%-10s' % measure + ''.join(
+                '%10.4f' % stats[name] for name in BENCH_STATS) + '\n')
+        wall = summarize([sample['wall'] for sample in samples])
+        if wall['mean'] and wall['stdev'] / wall['mean'] > \
+                BENCH_MAX_VARIATION:
+            sys.stderr.write(
+                'warning: the wall time varies by %.0f%% between runs; use '
+                'more runs\nor a quieter machine before trusting these '
+                'numbers\n' % (100 * wall['stdev'] / wall['mean']))
+        if self.args.zvm_bench_csv:
+            with open(self.args.zvm_bench_csv, 'w') as csv_fp:
+                writer = csv.writer(csv_fp)
+                writer.writerow(['run', 'wall', 'cpu', 'overhead', 'rc'])
+                for i, sample in enumerate(samples, start=1):
+                    writer.writerow([i, sample['wall'], sample['cpu'],
+                                     sample['overhead'], sample['rc']])
+
+    def _write_stats(self, rc, timings):
+        """
+        Append the stats of this run to the ``--zvm-stats`` file, as one line
+        of JSON. ``nodes`` holds the stats of each ZeroVM process (see
+        :meth:`ZvRunner.stats`); it is empty if the result came from the
+        result cache.
+        """
+        stats = {
+            'time': time.time(),
+            'command': self.cmd_line,
+            'exit_code': rc,
+            'timings': timings,
+            'nodes': [runner.stats() for runner in self.runners],
+        }
+        line = json.dumps(stats, sort_keys=True) + '\n'
+        # One write to a file opened for appending, so lines from
+        # concurrent runs don't interleave.
+        with open(self.args.zvm_stats, 'a') as stats_fp:
+            stats_fp.write(line)
+
+    def _profile(self):
+        """
+        Get the profile of this program and its arguments, if profiles are
+        recorded (``profiles = yes`` in the ``[cache]`` section of zvsh.cfg)
+        or ``--zvm-autosize`` is given. With ``--zvm-autosize``, the manifest
+        settings and channel limits are sized from the profile.
+
+        :returns:
+            `None`, or a tuple of the :class:`zvshlib.cache.ProfileStore` and
+            the profile key.
+        """
+        if self.args.zvm_nodes > 1 or not (
+                self.args.zvm_autosize
+                or self.config.getboolean('cache', 'profiles')):
+            return None
+        digest_dir = os.path.join(self._cache_dir(), 'digests')
+        # The program is identified by the nexe itself or, if it is to be
+        # found in an image, by the images.
+        if os.path.isfile(self.args.command):
+            nexe_files = [self.args.command]
+        else:
+            nexe_files = [image.split(',')[0]
+                          for image in self.args.zvm_image or []]
+        try:
+            nexe_digest = [cache.file_digest(nexe_file, digest_dir)
+                           for nexe_file in nexe_files]
+        except (IOError, OSError):
+            return None
+        store = cache.ProfileStore(
+            os.path.join(self._cache_dir(), 'profiles'),
+            int(self.config['cache']['profiles_keep']))
+        key = store.key(nexe_digest, [os.path.basename(self.args.command)]
+                        + self.args.cmd_args)
+        if self.args.zvm_autosize:
+            self._autosize(store.samples(key))
+        return store, key
+
+    def _autosize(self, samples):
+        """
+        Set Memory, Timeout and the channel limits to the configured
+        percentile of ``samples``, plus headroom, but never above their
+        configured values. Nothing changes until there are
+        ``autosize_min_runs`` samples.
+        """
+        settings = self.config['cache']
+        if not samples or len(samples) < int(settings['autosize_min_runs']):
+            return
+        pct = float(settings['autosize_percentile'])
+        headroom = float(settings['autosize_headroom'])
+
+        def size(name, minimum, maximum):
+            value = cache.percentile([s.get(name, 0) for s in samples], pct)
+            value = max(int(math.ceil(value * headroom)), minimum)
+            return min(value, int(maximum))
+
+        manifest = self.config['manifest']
+        self.autosize_memory = size('memory', AUTOSIZE_MIN_MEMORY,
+                                    manifest['Memory'])
+        manifest['Memory'] = '%d' % self.autosize_memory
+        manifest['Timeout'] = size('runtime', 1, manifest['Timeout'])
+        limits = self.config['limits']
+        for name, minimum in (('reads', AUTOSIZE_MIN_OPS),
+                              ('writes', AUTOSIZE_MIN_OPS),
+                              ('rbytes', AUTOSIZE_MIN_BYTES),
+                              ('wbytes', AUTOSIZE_MIN_BYTES)):
+            limits[name] = str(size(name, minimum, limits[name]))
+
+    def _add_profile_sample(self, profile, runner, runtime):
+        """
+        Add the resources used by the run of ``runner`` to ``profile``.
+        ZeroVM only accounts for I/O over all channels, so the totals are
+        recorded; no single channel can exceed them.
+        """
+        try:
+            accounting = parse_report(runner.report).accounting
+        except ValueError:
+            return
+        if 'memory' not in accounting:
+            return
+        if (self.autosize_memory is not None
+                and accounting['memory'] >= self.autosize_memory):
+            # That is the reservation, not what the program needed: fed
+            # back, it would grow the next reservation by the headroom.
+            return
+        sample = {'memory': accounting['memory'], 'runtime': runtime}
+        for name in ('reads', 'rbytes', 'writes', 'wbytes'):
+            sample[name] = (accounting.get(name, 0)
+                            + accounting.get('net_' + name, 0))
+        store, key = profile
+        store.add(key, sample)
+
+    def _plan_cache(self):
+        """
+        Get the :class:`zvshlib.cache.PlanCache` to use for this run, or
+        `None` if run plans aren't cached. Plans are cached with
+        ``plans = yes`` in the ``[cache]`` section of zvsh.cfg.
+        """
+        if (self.args.zvm_no_cache or self.zvsh.node_count > 1
+                or not self.config.getboolean('cache', 'plans')):
+            return None
+        return cache.PlanCache(os.path.join(self._cache_dir(), 'plans'),
+                               int(self.config['cache']['plans_size']))
+
+    def _plan_key(self, plan_cache):
+        """
+        Compute the plan key of this run from the effective configuration,
+        the command line, and the stat data of every file it refers to.
+        """
+        config = dict((section, sorted((k, str(v)) for k, v in
+                                       self.config[section].items()))
+                      for section in self.config.sections())
+        file_names = [self.args.command]
+        file_names.extend(image.split(',')[0]
+                          for image in self.args.zvm_image or [])
+        file_names.extend(arg[1:] for arg in self.args.cmd_args
+                          if arg.startswith('@')
+                          and not ENV_MATCH.match(arg[1:]))
+        file_names.extend(self.config['fstab'])
+        tmpdir = os.path.abspath(self.zvsh.tmpdir)
+        file_stats = []
+        for file_name in file_names:
+            file_name = os.path.abspath(file_name)
+            if os.path.dirname(file_name) == tmpdir:
+                # Made for this run, like the bytecode cache snapshot.
+                file_stats.append([os.path.basename(file_name)])
+                continue
+            try:
+                st = os.stat(file_name)
+            except OSError:
+                file_stats.append([file_name])
+                continue
+            file_stats.append([file_name, st.st_dev, st.st_ino, st.st_size,
+                               st.st_mtime, os.access(file_name, os.W_OK)])
+        ttys = [std.isatty() for std in (sys.stdin, sys.stdout, sys.stderr)]
+        images = [image.replace(tmpdir, plan_cache.WORKDIR)
+                  for image in self.args.zvm_image or []]
+        return plan_cache.key(zvshlib.__version__, config, self.args.command,
+                              self.args.cmd_args, images,
+                              self.args.zvm_debug, self.args.zvm_verbosity,
+                              file_stats, ttys, os.getcwd())
+
+    def _set_up_run(self):
+        """
+        Generate the files for the run, or stamp them out from a cached run
+        plan. Returns the path to the manifest.
+        """
+        plan_cache = self._plan_cache()
+        if plan_cache is None:
+            return self.zvsh.add_arguments(self.args)
+        key = self._plan_key(plan_cache)
+        plan = plan_cache.get(key)
+        if plan is not None:
+            return self.zvsh.load_plan(plan)
+        manifest_file = self.zvsh.add_arguments(self.args)
+        plan, files = self.zvsh.plan()
+        plan_cache.put(key, plan, files)
+        return manifest_file
+
+    def _bytecode_snapshot(self):
+        """
+        Mount a persistent, writable bytecode cache image if ``bytecode`` is
+        set in the ``[cache]`` section of zvsh.cfg.
+
+        The image is mounted at the path given by the ``bytecode`` setting,
+        which is also passed to the program as ``PYTHONPYCACHEPREFIX``. There
+        is one image for each combination of images the program runs with.
+        The program works on a snapshot of the image which replaces the
+        shared one after a successful run.
+
+        :returns:
+            `None` if there is no bytecode cache, otherwise a tuple of the
+            :class:`zvshlib.cache.ImageCache`, the image key, the snapshot
+            path and the snapshot stat data.
+        """
+        mount_point = self.config['cache']['bytecode']
+        if not mount_point or self.zvsh.node_count > 1:
+            return None
+        key = hashlib.sha256(mount_point.encode('utf-8'))
+        for image in self.args.zvm_image or []:
+            image_path = image.split(',')[0]
+            key.update(cache.file_digest(
+                image_path,
+                os.path.join(self._cache_dir(), 'digests')).encode('ascii'))
+        key = key.hexdigest()
+
+        image_cache = cache.ImageCache(
+            os.path.join(self._cache_dir(), 'bytecode'))
+        snapshot = os.path.join(self.zvsh.tmpdir, 'bytecode.tar')
+        snapshot_stat = image_cache.snapshot(key, snapshot)
+        if self.args.zvm_image is None:
+            self.args.zvm_image = []
+        self.args.zvm_image.append('%s,%s,rw' % (snapshot, mount_point))
+        self.config['env']['PYTHONPYCACHEPREFIX'] = mount_point
+        return image_cache, key, snapshot, snapshot_stat
+
+    def _run_nodes(self, runner):
+        """
+        Run ``--zvm-nodes`` copies of the program, the first one with
+        ``runner``. Only the first node gets our stdin.
+        """
+        for _dev, mount_point, access in self.zvsh.nvram_fstab:
+            if access != 'ro':
+                raise RuntimeError("Image mounted '%s' at '%s' can't be "
+                                   "shared between nodes"
+                                   % (access, mount_point))
+        # Every node would write to the same file.
+        for channel in self.zvsh.manifest_channels:
+            uri, alias, puts = channel[0], channel[1], channel[6]
+            if alias in self.zvsh.nvram_reg_files and puts:
+                raise RuntimeError("Writable file '%s' can't be shared "
+                                   "between nodes" % uri)
+        if self.args.zvm_debug:
+            raise RuntimeError("--zvm-debug output can't be shared between "
+                               "nodes")
+        runners = [runner]
+        for node_id in range(2, self.zvsh.node_count + 1):
+            manifest_file = self.zvsh.add_node(node_id,
+                                               self.args.zvm_verbosity)
+            node_runner = ZvRunner(
+                self._zerovm_command(manifest_file,
+                                     trace_log='zvsh.trace.%d.log' % node_id),
+                self.zvsh.node_stdout(node_id),
+                self.zvsh.node_stderr(node_id),
+                self.zvsh.tmpdir,
+                getrc=self.args.zvm_getrc)
+            node_runner.stdin = open(os.devnull, 'rb')
+            runners.append(node_runner)
+        try:
+            return self._execute(*runners)
+        finally:
+            for node_runner in runners[1:]:
+                node_runner.stdin.close()
+
+    def _cache_dir(self):
+        return os.path.expanduser(self.config['cache']['path'])
+
+    def _validation_record(self):
+        """
+        Get the :class:`zvshlib.cache.ValidationRecord` for the zerovm binary
+        in use, or `None` if validated nexes aren't recorded.
+        """
+        if not self.config.getboolean('cache', 'validation'):
+            return None
+        zerovm = cache.find_executable(ZEROVM_EXECUTABLE)
+        if zerovm is None:
+            return None
+        record_path = (self.config['cache']['validation_record']
+                       or os.path.join(self._cache_dir(), 'validated'))
+        zerovm_digest = cache.file_digest(
+            zerovm, os.path.join(self._cache_dir(), 'digests'))
+        return cache.ValidationRecord(os.path.expanduser(record_path),
+                                      zerovm_digest)
+
+    def _execute(self, *runners):
+        """
+        Run ZeroVM for each of ``runners``, side by side, and return the zvsh
+        exit code: the first non-zero one of all runs. Validation is skipped
+        for a nexe found in the validation record, and a nexe which validates
+        successfully is added to it.
+        """
+        record = self._validation_record()
+        nexe_digest = None
+        # Only nexes nobody else can swap under our feet are eligible.
+        if record is not None and cache.is_trusted(self.zvsh.program):
+            program = os.path.abspath(self.zvsh.program)
+            digest_dir = os.path.join(self._cache_dir(), 'digests')
+            if os.path.dirname(program) == os.path.abspath(self.zvsh.tmpdir):
+                # Extracted for this run: its path is new every time.
+                digest_dir = None
+            nexe_digest = cache.file_digest(program, digest_dir)
+            if nexe_digest in record:
+                for runner in runners:
+                    runner.command.insert(1, SKIP_VALIDATION_OPTION)
+                nexe_digest = None
+
+        self.runners = list(runners)
+        if len(runners) == 1:
+            rcs = [runners[0].execute()]
+        else:
+            rcs = [None] * len(runners)
+
+            def execute(i):
+                rcs[i] = runners[i].execute()
+            threads = [runner.spawn(False, execute, i=i)
+                       for i, runner in enumerate(runners)]
+            for thread in threads:
+                thread.join()
+
+        runner = runners[0]
+        if nexe_digest is not None and runner.zvm_rc == 0:
+            try:
+                validated = parse_validator_state(runner.report) == 0
+            except ValueError:
+                validated = False
+            if validated:
+                record.add(nexe_digest)
+        return next((rc for rc in rcs if rc), 0)
+
+    def _result_cache(self):
+        """
+        Get the :class:`zvshlib.cache.ResultCache` to use for this run, or
+        `None` if the result must not be cached.
+
+        Caching is enabled with ``results = yes`` in the ``[cache]`` section
+        of zvsh.cfg. Runs with an interactive stdin, or which produce debug
+        or trace logs, are never cached.
+        """
+        if (self.args.zvm_no_cache or self.args.zvm_debug
+                or self.args.zvm_trace or sys.stdin.isatty()
+                or not self.config.getboolean('cache', 'results')):
+            return None
+        return cache.ResultCache(self._cache_dir(),
+                                 int(self.config['cache']['results_size']))
+
+    def _result_key(self, result_cache, manifest_file, stdin_file):
+        tmpdir = os.path.abspath(self.zvsh.tmpdir)
+        with open(self.zvsh.nvram_filename) as nvram_fp:
+            nvram = nvram_fp.read()
+        # The manifest refers to files in the (random) working directory, so
+        # strip it to make the key independent of where the run happens.
+        with open(manifest_file) as manifest_fp:
+            manifest = manifest_fp.read().replace(tmpdir, '')
+        channel_files = [os.path.abspath(f) for f in self.zvsh.temp_files]
+        return result_cache.key(self.zvsh.program, channel_files, nvram,
+                                manifest, stdin=stdin_file)
+
+    def _run_cached(self, result_cache, runner, manifest_file):
+        """
+        Replay the result of an identical earlier run if there is one;
+        otherwise run ZeroVM and store its result. Returns the zvsh exit
+        code.
+        """
+        tmpdir = self.zvsh.tmpdir
+        node_id = self.zvsh.node_id
+        # stdin is an input like any other, so it is spooled to a file and
+        # made part of the key.
+        stdin_file = os.path.join(tmpdir, 'stdin.%d' % node_id)
+        with open(stdin_file, 'wb') as stdin_fp:
+            shutil.copyfileobj(_binary(sys.stdin), stdin_fp)
+        try:
+            key = self._result_key(result_cache, manifest_file, stdin_file)
+        except (IOError, OSError):
+            # Some input cannot be read (e.g. a nexe that doesn't exist);
+            # just let ZeroVM report the problem.
+            key = None
+
+        if key is not None:
+            entry = result_cache.get(key)
+            if entry is not None:
+                try:
+                    outputs = [(open(entry.stdout, 'rb'), sys.stdout),
+                               (open(entry.stderr, 'rb'), sys.stderr)]
+                except IOError:
+                    # The entry was evicted under our feet.
+                    pass
+                else:
+                    for src, dst in outputs:
+                        shutil.copyfileobj(src, _binary(dst))
+                        _binary(dst).flush()
+                        src.close()
+                    return _exit_code(entry.rc, entry.zvm_rc,
+                                      self.args.zvm_getrc)
+
+        stdout_copy = os.path.join(tmpdir, 'stdout.%d.cache' % node_id)
+        stderr_copy = os.path.join(tmpdir, 'stderr.%d.cache' % node_id)
+        runner.stdin = open(stdin_file, 'rb')
+        runner.stdout_copy = open(stdout_copy, 'wb')
+        runner.stderr_copy = open(stderr_copy, 'wb')
+        try:
+            rc = self._execute(runner)
+        finally:
+            for fp in (runner.stdin, runner.stdout_copy, runner.stderr_copy):
+                fp.close()
+        # Only store successful runs which left their inputs untouched; a
+        # program writing to a channel file has side effects we can't
+        # replay.
+        if key is not None and runner.zvm_rc == 0:
+            try:
+                unchanged = key == self._result_key(
+                    result_cache, manifest_file, stdin_file)
+            except (IOError, OSError):
+                unchanged = False
+            if unchanged:
+                result_cache.put(key, stdout_copy, stderr_copy,
+                                 runner.rc, runner.zvm_rc)
+        return rc
 
     def _run_gdb(self):
         # user wants to debug the program
         zvsh_args = DebugArgs()
         zvsh_args.parse(self.cmd_line[1:])
         self.args = zvsh_args.args
-        self.zvsh = ZvShell(self.config, self.args.zvm_save_dir)
+        self.zvsh = ZvShell(self.config, self._save_dir())
         # a month until debug session will time out
         self.zvsh.config['manifest']['Timeout'] = 60 * 60 * 24 * 30
         manifest_file = self.zvsh.add_arguments(self.args)